@@ -0,0 +1,217 @@
+# coding=utf-8
+
+"""
+ArticleQueue.py
+Describes the queue between the website objects and the DBWriter.  It is a bounded multiprocessing.Queue that keeps
+track of how deep it is, how long the producers wait to put articles on it and how fast the writer takes them off.
+"""
+
+import configparser
+import json
+import multiprocessing
+import multiprocessing.queues
+import os
+import queue
+import time
+
+# Marks that put() should use the configured timeout
+_defaultTimeout = object()
+
+
+class ArticleQueue(multiprocessing.queues.Queue):
+    """
+    This class limits how many scraped articles can be waiting on the DBWriter, so that if the writer falls behind the
+    producers block (or give up after PutTimeout seconds) instead of piling the articles up in memory.  The counters are
+    in shared memory so they add up across all of the processes using the queue.  The consumer reports them every
+    MetricsInterval seconds.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Queue parameters
+        self._maxSize = 1000
+        self._putTimeout = None
+        self._metricsInterval = 60.0
+        self._metricsPath = str()
+
+        self._ReadConfiguration(inConfigObject)
+
+        context = multiprocessing.get_context()
+        super().__init__(self._maxSize, ctx=context)
+
+        # Shared counters
+        self._enqueued = context.Value("q", 0)
+        self._dequeued = context.Value("q", 0)
+        self._timedOut = context.Value("q", 0)
+        self._enqueueWait = context.Value("d", 0.0)
+        self._maxEnqueueWait = context.Value("d", 0.0)
+
+        # Consumer side state for the dequeue rate
+        self._lastReportTime = time.time()
+        self._lastReportDequeued = 0
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser):
+        """
+        Use the passed-in ConfigParser object to set ourselves up.  The QUEUE section is optional.
+        :return: Nothing
+        """
+
+        try:
+            if inConfigObject.has_section("QUEUE"):
+                QUEUE = inConfigObject["QUEUE"]
+
+                self._maxSize = QUEUE.getint("MaxSize", self._maxSize)
+                self._metricsInterval = QUEUE.getfloat("MetricsInterval", self._metricsInterval)
+                self._metricsPath = QUEUE.get("MetricsPath", self._metricsPath)
+
+                # 0 means wait for as long as it takes
+                putTimeout = QUEUE.getfloat("PutTimeout", 0.0)
+                self._putTimeout = putTimeout if putTimeout > 0 else None
+
+            # Relative paths are relative to the program directory
+            if self._metricsPath:
+                self._metricsPath = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                                 self._metricsPath)
+
+        except Exception as e:
+            print("Exception in ArticleQueue::_ReadConfiguration: {}".format(e))
+
+    # ******************************************************************************************************************
+    def __getstate__(self):
+        """
+        Add our settings and counters to what gets sent to the child processes
+        """
+
+        return (super().__getstate__(),
+                (self._maxSize, self._putTimeout, self._metricsInterval, self._metricsPath, self._enqueued,
+                 self._dequeued, self._timedOut, self._enqueueWait, self._maxEnqueueWait))
+
+    # ******************************************************************************************************************
+    def __setstate__(self, inState):
+        """
+        Restore our settings and counters in a child process
+        """
+
+        queueState, ourState = inState
+
+        super().__setstate__(queueState)
+
+        (self._maxSize, self._putTimeout, self._metricsInterval, self._metricsPath, self._enqueued, self._dequeued,
+         self._timedOut, self._enqueueWait, self._maxEnqueueWait) = ourState
+
+        self._lastReportTime = time.time()
+        self._lastReportDequeued = self._dequeued.value
+
+    # ******************************************************************************************************************
+    def put(self, obj, block=True, timeout=_defaultTimeout):
+        """
+        Put an article on the queue, waiting for room if it is full.  Raises queue.Full if there still isn't room after
+        the timeout.
+        :param obj: article to add
+        :param block: wait for room if the queue is full
+        :param timeout: seconds to wait, None to wait forever.  Defaults to PutTimeout from the config.
+        :return: Nothing
+        """
+
+        if timeout is _defaultTimeout:
+            timeout = self._putTimeout
+
+        startTime = time.time()
+
+        try:
+            super().put(obj, block, timeout)
+
+        except queue.Full:
+            with self._timedOut.get_lock():
+                self._timedOut.value += 1
+            raise
+
+        finally:
+            waitTime = time.time() - startTime
+
+            with self._enqueueWait.get_lock():
+                self._enqueueWait.value += waitTime
+            with self._maxEnqueueWait.get_lock():
+                self._maxEnqueueWait.value = max(self._maxEnqueueWait.value, waitTime)
+
+        with self._enqueued.get_lock():
+            self._enqueued.value += 1
+
+    # ******************************************************************************************************************
+    def get(self, block=True, timeout=None):
+        """
+        Take an article off the queue, reporting the metrics if they are due
+        :param block: wait for an article if the queue is empty
+        :param timeout: seconds to wait, None to wait forever
+        :return: the article
+        """
+
+        obj = super().get(block, timeout)
+
+        with self._dequeued.get_lock():
+            self._dequeued.value += 1
+
+        if self._metricsInterval > 0 and time.time() - self._lastReportTime >= self._metricsInterval:
+            self.ReportMetrics()
+
+        return obj
+
+    # ******************************************************************************************************************
+    def Metrics(self) -> dict:
+        """
+        Get the current queue metrics
+        :return: dict of the metrics
+        """
+
+        enqueued = self._enqueued.value
+        dequeued = self._dequeued.value
+
+        return {"depth": max(enqueued - dequeued, 0),
+                "maxSize": self._maxSize,
+                "enqueued": enqueued,
+                "dequeued": dequeued,
+                "putTimeouts": self._timedOut.value,
+                "averageEnqueueWait": self._enqueueWait.value / max(enqueued + self._timedOut.value, 1),
+                "maxEnqueueWait": self._maxEnqueueWait.value}
+
+    # ******************************************************************************************************************
+    def ReportMetrics(self):
+        """
+        Print the metrics along with the dequeue rate since the last report, and write them to MetricsPath if it is set.
+        Called from the consumer.
+        :return: Nothing
+        """
+
+        try:
+            now = time.time()
+
+            metrics = self.Metrics()
+            metrics["dequeueRate"] = (metrics["dequeued"] - self._lastReportDequeued) / max(now - self._lastReportTime,
+                                                                                          1e-6)
+            metrics["time"] = now
+
+            self._lastReportTime = now
+            self._lastReportDequeued = metrics["dequeued"]
+
+            print("ArticleQueue: depth {}/{}, {} enqueued, {} dequeued ({:.2f}/s), {} put timeouts, enqueue wait "
+                  "{:.3f}s average {:.3f}s max".format(metrics["depth"], metrics["maxSize"], metrics["enqueued"],
+                                                       metrics["dequeued"], metrics["dequeueRate"],
+                                                       metrics["putTimeouts"], metrics["averageEnqueueWait"],
+                                                       metrics["maxEnqueueWait"]))
+
+            if self._metricsPath:
+                tempPath = self._metricsPath + ".tmp"
+
+                with open(tempPath, "w") as metricsFile:
+                    json.dump(metrics, metricsFile)
+
+                os.replace(tempPath, self._metricsPath)
+
+        except Exception as e:
+            print("Exception in ArticleQueue::ReportMetrics: {}".format(e))
@@ -0,0 +1 @@
+from .ArticleQueue import ArticleQueue
@@ -0,0 +1,392 @@
+# coding=utf-8
+
+"""
+ArticleWorker.py
+Describes the class that runs the extract mode.  It claims discovered articles from pending_articles, scrapes them and
+runs the NLP, and hands them to the DBWriter.  Articles that fail are retried later with exponential backoff.
+"""
+
+import configparser
+import multiprocessing
+import os
+import socket
+import threading
+from typing import List, Tuple
+import psycopg2
+import websites
+from websites import ExtractedArticle
+
+
+class ArticleWorker(object):
+    """
+    This class drains the pending_articles table.  Articles are claimed in batches with SELECT ... FOR UPDATE SKIP
+    LOCKED and a lease, so any number of workers on any number of machines can run at once, and the articles of a
+    worker that dies are claimed again when their leases run out.  One slow article only holds up its own worker.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inQueue: multiprocessing.Queue, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inQueue: multiprocessing.Queue object the website objects push to
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        if not inQueue:
+            self.good = False
+
+            # Don't bother running if we don't have a Queue object passed in
+            return
+
+        self._queue = inQueue
+        self._configObject = inConfigObject
+
+        # DB Parameters
+        self._DBHost = str()
+        self._DBPort = str()
+        self._DBUser = str()
+        self._DBPassword = str()
+        self._DBTable = str()
+
+        # DB Objects
+        self._DBConnection = None
+        self._DBCursor = None
+
+        # Extraction parameters
+        self._batchSize = 10
+        self._leaseSeconds = 1800
+        self._queuedSeconds = 21600
+        self._maxAttempts = 5
+        self._retryDelay = 60
+        self._maxRetryDelay = 21600
+        self._idleWait = 0
+        self._workerID = "{}:{}".format(socket.gethostname(), os.getpid())
+
+        # Website objects, keyed by class name and NLP profile
+        self._websites = dict()
+
+        # Set when we've been asked to shut down
+        self._stopEvent = threading.Event()
+
+        # Read the configuration
+        if not self._ReadConfiguration(inConfigObject):
+            self.good = False
+            return
+
+        if not self._CreateDBObjects():
+            self.good = False
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser) -> bool:
+        """
+        Use the passed-in ConfigParser object to set ourselves up
+        :return: True if OK, False otherwise
+        """
+
+        try:
+            # Get the top level
+            DB = inConfigObject["DB"]
+
+            # Now set our member variables
+            self._DBHost = DB["DBHost"]
+            self._DBPort = DB["DBPort"]
+            self._DBUser = DB["DBUser"]
+            self._DBPassword = DB["DBPassword"]
+            self._DBTable = DB["DBTable"]
+
+            # The EXTRACT section is optional, use the defaults if it is not there
+            if inConfigObject.has_section("EXTRACT"):
+                EXTRACT = inConfigObject["EXTRACT"]
+
+                self._batchSize = EXTRACT.getint("BatchSize", self._batchSize)
+                self._leaseSeconds = EXTRACT.getint("LeaseSeconds", self._leaseSeconds)
+                self._queuedSeconds = EXTRACT.getint("QueuedSeconds", self._queuedSeconds)
+                self._maxAttempts = EXTRACT.getint("MaxAttempts", self._maxAttempts)
+                self._retryDelay = EXTRACT.getint("RetryDelay", self._retryDelay)
+                self._maxRetryDelay = EXTRACT.getint("MaxRetryDelay", self._maxRetryDelay)
+                self._idleWait = EXTRACT.getint("IdleWait", self._idleWait)
+
+            # Use the same worker name as the subscription leases
+            if inConfigObject.has_section("SHARDING"):
+                self._workerID = inConfigObject["SHARDING"].get("WorkerID", fallback=str()) or self._workerID
+
+            return True
+
+        except Exception as e:
+            print("Exception in ArticleWorker::_ReadConfiguration: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def Stop(self):
+        """
+        Ask the worker to shut down after the article it is working on.  Safe to call from a signal handler.
+        :return: Nothing
+        """
+
+        self._stopEvent.set()
+
+    # ******************************************************************************************************************
+    def Run(self):
+        """
+        Main loop.  Processes articles until none are due, or with IdleWait set, keeps checking for more every IdleWait
+        seconds until Stop is called.
+        :return: Nothing
+        """
+
+        if not self.good:
+            return
+
+        processed = 0
+
+        while not self._stopEvent.is_set():
+            claimed = self._ClaimBatch()
+
+            if not claimed:
+                if self._idleWait <= 0:
+                    break
+
+                self._stopEvent.wait(self._idleWait)
+                continue
+
+            for index, row in enumerate(claimed):
+                # Give back what we haven't started on so another worker can have it right away
+                if self._stopEvent.is_set():
+                    self._Unclaim([pendingID for pendingID, *rest in claimed[index:]])
+                    break
+
+                self._ProcessPending(row)
+                processed += 1
+
+        print("ArticleWorker: Processed {} articles".format(processed))
+
+    # ******************************************************************************************************************
+    def _ProcessPending(self, inRow: Tuple):
+        """
+        Scrape and process one claimed article
+        :param inRow: (id, article_url, article_title, website, classname, attempts, subscription_url, nlp_profile) from
+            pending_articles and the subscription
+        :return: Nothing
+        """
+
+        pendingID, url, title, website, classname, attempts, subscriptionURL, NLPProfile = inRow
+
+        try:
+            # It may have been written by a worker that died before the row was marked
+            if self._AlreadyStored(url):
+                self._SetStatus(pendingID, "done")
+                return
+
+            # The same as the async engine, one website object per class and NLP profile.  Articles discovered before
+            # migration 012 have no subscription and use the global NLP section.
+            websiteObject = self._websites.get((classname, NLPProfile))
+            if websiteObject is None or not websiteObject.good:
+                websiteObject = websites.WebsiteFactory((subscriptionURL or url, classname), self._queue,
+                                                        self._configObject)
+                websiteObject.UseNLPProfile(NLPProfile)
+                self._websites[(classname, NLPProfile)] = websiteObject
+
+            article = ExtractedArticle()
+            article.articleTitle = title
+            article.articleURL = url
+            article.canonicalURL = websiteObject.CanonicalizeURL(url)
+            article.website = website
+            article.pendingID = pendingID
+
+            if websiteObject.ProcessArticle(article):
+                # The DB writer marks it done once it is stored
+                self._SetStatus(pendingID, "queued")
+            elif article.duplicate:
+                self._SetStatus(pendingID, "done")
+            elif article.skipped:
+                # The DB writer is behind, that's not the article's fault
+                self._Unclaim([pendingID])
+            else:
+                self._Retry(pendingID, attempts, "No article text or the article could not be processed")
+
+        except Exception as e:
+            print("Exception in ArticleWorker::_ProcessPending for {}: {}".format(url, e))
+            self._Retry(pendingID, attempts, str(e))
+
+    # ******************************************************************************************************************
+    def _ClaimBatch(self) -> List[Tuple]:
+        """
+        Claim up to BatchSize articles that are due, plus any whose worker's lease has expired.  A queued article's
+        lease is QueuedSeconds from when it was queued, as it may still be waiting in the DB writer.  Expired articles
+        that are out of attempts are marked failed instead.
+        :return: list of (id, article_url, article_title, website, classname, attempts, subscription_url, nlp_profile)
+            tuples
+        """
+
+        try:
+            if not self._DBConnection and not self._CreateDBObjects():
+                return list()
+
+            # The writer got to these after all, it just couldn't mark them done
+            self._DBCursor.execute("""
+                                    UPDATE pending_articles
+                                    SET status = 'done', lease_owner = NULL, lease_expires = NULL
+                                    WHERE status = 'queued' AND lease_expires < NOW()
+                                    AND EXISTS (SELECT 1 FROM news_articles
+                                                WHERE news_articles.article_url = pending_articles.article_url);
+                                    """)
+
+            self._DBCursor.execute("""
+                                    UPDATE pending_articles
+                                    SET status = 'failed', last_error = 'Lease expired', lease_owner = NULL,
+                                        lease_expires = NULL
+                                    WHERE status IN ('processing', 'queued') AND lease_expires < NOW()
+                                    AND attempts >= %s;
+                                    """, (self._maxAttempts,))
+
+            self._DBCursor.execute("""
+                                    UPDATE pending_articles
+                                    SET status = 'processing',
+                                        attempts = attempts + 1,
+                                        lease_owner = %s,
+                                        lease_expires = NOW() + %s * INTERVAL '1 second'
+                                    WHERE id IN (SELECT id FROM pending_articles
+                                                 WHERE (status = 'pending' AND next_attempt <= NOW())
+                                                 OR (status IN ('processing', 'queued') AND lease_expires < NOW())
+                                                 ORDER BY next_attempt
+                                                 LIMIT %s
+                                                 FOR UPDATE SKIP LOCKED)
+                                    RETURNING id, article_url, article_title, website, classname, attempts,
+                                        subscription_url,
+                                        COALESCE((SELECT nlp_profile FROM subscriptions
+                                                  WHERE subscriptions.url = pending_articles.subscription_url), '');
+                                    """, (self._workerID, self._leaseSeconds, self._batchSize))
+            claimed = self._DBCursor.fetchall()
+            self._DBConnection.commit()
+
+            return claimed
+
+        except Exception as e:
+            print("Exception in ArticleWorker::_ClaimBatch: {}".format(e))
+            self._CreateDBObjects()
+            return list()
+
+    # ******************************************************************************************************************
+    def _AlreadyStored(self, inURL: str) -> bool:
+        """
+        Check if the article is already in news_articles
+        :param inURL: article URL
+        :return: True if it is
+        """
+
+        self._DBCursor.execute("SELECT id FROM news_articles WHERE article_url = %s;", (inURL,))
+        self._DBConnection.commit()
+
+        return self._DBCursor.fetchone() is not None
+
+    # ******************************************************************************************************************
+    def _SetStatus(self, inPendingID: int, inStatus: str):
+        """
+        Update the status of a claimed article.  Queued articles keep a lease of QueuedSeconds, so they are claimed
+        again if the DB writer never gets to them but not while they're still waiting in its queue.  The article is
+        already on the queue by then, so queued only replaces processing, in case the writer has stored it and marked it
+        done first.
+        :param inPendingID: id in pending_articles
+        :param inStatus: new status
+        :return: Nothing
+        """
+
+        try:
+            if inStatus == "queued":
+                self._DBCursor.execute("""
+                                        UPDATE pending_articles
+                                        SET status = %s, lease_expires = NOW() + %s * INTERVAL '1 second'
+                                        WHERE id = %s AND status = 'processing';
+                                        """, (inStatus, self._queuedSeconds, inPendingID))
+            else:
+                self._DBCursor.execute("""
+                                        UPDATE pending_articles SET status = %s, lease_owner = NULL,
+                                        lease_expires = NULL WHERE id = %s;
+                                        """, (inStatus, inPendingID))
+            self._DBConnection.commit()
+
+        except Exception as e:
+            print("Exception in ArticleWorker::_SetStatus: {}".format(e))
+            self._CreateDBObjects()
+
+    # ******************************************************************************************************************
+    def _Retry(self, inPendingID: int, inAttempts: int, inError: str):
+        """
+        Put a failed article back as pending, to be tried again after RetryDelay * 2^(attempts - 1) seconds (up to
+        MaxRetryDelay).  Once it has had MaxAttempts tries it is marked failed.
+        :param inPendingID: id in pending_articles
+        :param inAttempts: number of attempts so far, including this one
+        :param inError: what went wrong
+        :return: Nothing
+        """
+
+        try:
+            status = "failed" if inAttempts >= self._maxAttempts else "pending"
+            delay = min(self._retryDelay * 2 ** max(inAttempts - 1, 0), self._maxRetryDelay)
+
+            self._DBCursor.execute("""
+                                    UPDATE pending_articles
+                                    SET status = %s, next_attempt = NOW() + %s * INTERVAL '1 second',
+                                        last_error = %s, lease_owner = NULL, lease_expires = NULL
+                                    WHERE id = %s;
+                                    """, (status, delay, inError, inPendingID))
+            self._DBConnection.commit()
+
+        except Exception as e:
+            print("Exception in ArticleWorker::_Retry: {}".format(e))
+            self._CreateDBObjects()
+
+    # ******************************************************************************************************************
+    def _Unclaim(self, inPendingIDs: List[int]):
+        """
+        Give back articles we claimed but didn't start on.  The attempt doesn't count.
+        :param inPendingIDs: ids in pending_articles
+        :return: Nothing
+        """
+
+        try:
+            self._DBCursor.execute("""
+                                    UPDATE pending_articles
+                                    SET status = 'pending', attempts = attempts - 1, lease_owner = NULL,
+                                        lease_expires = NULL
+                                    WHERE id = ANY(%s) AND lease_owner = %s;
+                                    """, (inPendingIDs, self._workerID))
+            self._DBConnection.commit()
+
+        except Exception as e:
+            print("Exception in ArticleWorker::_Unclaim: {}".format(e))
+            self._CreateDBObjects()
+
+    # ******************************************************************************************************************
+    def _CreateDBObjects(self) -> bool:
+        """
+        Create (or re-create after an error) the psycopg2 connection and cursor
+        :return: True if successful, False otherwise
+        """
+
+        try:
+            if self._DBCursor:
+                self._DBCursor.close()
+            if self._DBConnection:
+                self._DBConnection.close()
+        except Exception as e:
+            print("Exception in ArticleWorker::_CreateDBObjects closing the old connection: {}".format(e))
+
+        try:
+            self._DBConnection = psycopg2.connect(host=self._DBHost,
+                                                  port=self._DBPort,
+                                                  dbname=self._DBTable,
+                                                  user=self._DBUser,
+                                                  password=self._DBPassword)
+            self._DBCursor = self._DBConnection.cursor()
+
+            return True
+
+        except Exception as e:
+            print("Exception in ArticleWorker::_CreateDBObjects: {}".format(e))
+            self._DBConnection = None
+            self._DBCursor = None
+            return False
@@ -0,0 +1 @@
+from .ArticleWorker import ArticleWorker
@@ -0,0 +1,540 @@
+# coding=utf-8
+
+"""
+AsyncEngine.py
+Describes the asyncio runtime.  Feeds and articles are downloaded concurrently with aiohttp, the feed bytes are parsed
+by feedparser from memory, and the scraping/NLP is handed off to a pool of worker processes that push their results
+onto the same queue the DBWriter reads from.
+"""
+
+import asyncio
+import configparser
+import gc
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Tuple
+import websites
+from websites import ExtractedArticle
+from websites.WebsiteBase import LoadModel, NLPProfileNames, ProcessMemory, ReadNLPProfile
+
+# aiohttp and asyncpg are only needed for this runtime, so don't make them a hard requirement for the rest of the program.
+# They're imported by _ImportAsyncModules when an engine is created, so the other modes don't pay for importing them.
+aiohttp = None
+asyncpg = None
+
+
+# **********************************************************************************************************************
+def _ImportAsyncModules() -> bool:
+    """
+    Import aiohttp and asyncpg into the module globals
+    :return: True if they're both available
+    """
+
+    global aiohttp, asyncpg
+
+    try:
+        import aiohttp
+        import asyncpg
+
+        return True
+
+    except ImportError:
+        return False
+
+
+# Per-process state for the NLP workers.  These are set by _InitWorker when the pool starts the process.
+_workerQueue = None
+_workerConfigObject = None
+_workerWebsites = dict()
+_workerMemoryReportInterval = 0
+_workerArticles = 0
+
+
+# **********************************************************************************************************************
+def _InitWorker(inQueue: multiprocessing.Queue, inConfigObject: configparser.ConfigParser,
+                inMemoryReportInterval: int = 0):
+    """
+    Process pool initializer.  Saves the queue and configuration for the website objects created in this process.
+    :param inQueue: queue the DBWriter reads from
+    :param inConfigObject: global config object
+    :param inMemoryReportInterval: report the memory of the worker every this many articles, 0 to not report it
+    :return: Nothing
+    """
+
+    global _workerQueue, _workerConfigObject, _workerMemoryReportInterval
+
+    _workerQueue = inQueue
+    _workerConfigObject = inConfigObject
+    _workerMemoryReportInterval = inMemoryReportInterval
+
+
+# **********************************************************************************************************************
+def _ReportWorkerMemory(inWhen: str):
+    """
+    Print the memory use of this worker process
+    :param inWhen: what the worker has done so far, for the message
+    :return: Nothing
+    """
+
+    memory = ProcessMemory()
+
+    print("AsyncEngine worker {} {}: {}".format(os.getpid(), inWhen,
+                                                ", ".join("{} {:.0f} MB".format(name, value)
+                                                          for name, value in memory.items())))
+
+
+# **********************************************************************************************************************
+def _StartWorker():
+    """
+    Does nothing but make the pool start a worker, so the memory of each one can be reported before any work comes in
+    :return: Nothing
+    """
+
+    _ReportWorkerMemory("started")
+
+
+# **********************************************************************************************************************
+def _ProcessInWorker(inURL: tuple, inArticle: ExtractedArticle, inContent: bytes, inNLPProfile: str = str()) -> bool:
+    """
+    Runs in the worker process.  Extracts the text from the downloaded page, runs the NLP and pushes the article onto the
+    queue.  Website objects are kept per class name and NLP profile, and the models are shared by all of them.
+    :param inURL: (url, classname) tuple of the subscription the article came from
+    :param inArticle: article wrapper from the feed
+    :param inContent: raw page content, None to have the website object get it (archive replay)
+    :param inNLPProfile: NLP profile of the subscription
+    :return: True if the article was pushed onto the queue
+    """
+
+    global _workerArticles
+
+    try:
+        url, classname = inURL
+
+        _workerArticles += 1
+        if _workerMemoryReportInterval > 0 and _workerArticles % _workerMemoryReportInterval == 0:
+            _ReportWorkerMemory("after {} articles".format(_workerArticles))
+
+        websiteObject = _workerWebsites.get((classname, inNLPProfile))
+        if websiteObject is None:
+            websiteObject = websites.WebsiteFactory(inURL, _workerQueue, _workerConfigObject)
+            websiteObject.UseNLPProfile(inNLPProfile)
+            _workerWebsites[(classname, inNLPProfile)] = websiteObject
+
+        return websiteObject.ParserFor(inArticle.articleURL).ProcessArticle(inArticle, inContent)
+
+    except Exception as e:
+        print("Exception in AsyncEngine::_ProcessInWorker: {}".format(e))
+        return False
+
+
+class AsyncFeedEngine(object):
+    """
+    This class runs all of the subscriptions at once on a single event loop.  The only blocking work left (scraping
+    and NLP) runs in a process pool, so the event loop can keep hundreds of requests in flight.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inQueue: multiprocessing.Queue, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inQueue: multiprocessing.Queue object the workers push finished articles to
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        if not inQueue:
+            self.good = False
+
+            # Don't bother running if we don't have a Queue object passed in
+            return
+
+        self._queue = inQueue
+        self._configObject = inConfigObject
+
+        # DB Parameters
+        self._DBHost = str()
+        self._DBPort = str()
+        self._DBUser = str()
+        self._DBPassword = str()
+        self._DBTable = str()
+
+        # Async parameters
+        self._maxRequests = 200
+        self._maxRequestsPerHost = 20
+        self._requestTimeout = 30
+        self._NLPWorkers = 2
+        self._DBPoolSize = 10
+        self._preloadModel = False
+        self._memoryReportInterval = 0
+        self._sharedVectorsPath = str()
+
+        # Check canonical URLs as well when looking for articles we already have
+        self._dedupEnabled = False
+
+        # In archive replay mode the workers read the pages from the archive, so nothing is downloaded but the feeds
+        self._archiveReplay = False
+
+        # NLP profile name by subscription URL
+        self._nlpProfiles = dict()
+
+        # DB Objects
+        self._DBPool = None
+
+        # NLP worker pool.  Only kept between calls to Run after Start.
+        self._workerPool = None
+        self._keepWorkerPool = False
+
+        # Limits how many articles are being downloaded or waiting on a worker at once
+        self._articleSlots = None
+
+        if not _ImportAsyncModules():
+            print("AsyncFeedEngine: aiohttp and asyncpg are required for the async runtime.")
+            self.good = False
+            return
+
+        # Read the configuration
+        if not self._ReadConfiguration(inConfigObject):
+            self.good = False
+            return
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser) -> bool:
+        """
+        Use the passed-in ConfigParser object to set ourselves up
+        :return: True if OK, False otherwise
+        """
+
+        try:
+            # Get the top level
+            DB = inConfigObject["DB"]
+
+            # Now set our member variables
+            self._DBHost = DB["DBHost"]
+            self._DBPort = DB["DBPort"]
+            self._DBUser = DB["DBUser"]
+            self._DBPassword = DB["DBPassword"]
+            self._DBTable = DB["DBTable"]
+
+            # The ASYNC section is optional, use the defaults if it is not there
+            if inConfigObject.has_section("ASYNC"):
+                ASYNC = inConfigObject["ASYNC"]
+
+                self._maxRequests = ASYNC.getint("MaxRequests", self._maxRequests)
+                self._maxRequestsPerHost = ASYNC.getint("MaxRequestsPerHost", self._maxRequestsPerHost)
+                self._requestTimeout = ASYNC.getint("RequestTimeout", self._requestTimeout)
+                self._NLPWorkers = ASYNC.getint("NLPWorkers", self._NLPWorkers)
+                self._DBPoolSize = ASYNC.getint("DBPoolSize", self._DBPoolSize)
+                self._preloadModel = ASYNC.getboolean("PreloadModel", self._preloadModel)
+                self._memoryReportInterval = ASYNC.getint("MemoryReportInterval", self._memoryReportInterval)
+
+            # 0 workers means one per core we're allowed to run on
+            if self._NLPWorkers <= 0:
+                self._NLPWorkers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else \
+                    os.cpu_count() or 1
+
+            # Same setting the website objects use, so the preloaded model is the one they'd load
+            if inConfigObject.has_section("NLP"):
+                self._sharedVectorsPath = inConfigObject["NLP"].get("SharedVectorsPath", self._sharedVectorsPath)
+
+            if self._sharedVectorsPath:
+                self._sharedVectorsPath = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                                       self._sharedVectorsPath)
+
+            if inConfigObject.has_section("DEDUP"):
+                self._dedupEnabled = inConfigObject["DEDUP"].getboolean("Enabled", self._dedupEnabled)
+
+            if inConfigObject.has_section("ARCHIVE"):
+                ARCHIVE = inConfigObject["ARCHIVE"]
+
+                self._archiveReplay = ARCHIVE.getboolean("Enabled", False) and ARCHIVE.getboolean("Replay", False)
+
+            return True
+
+        except Exception as e:
+            print("Exception in AsyncFeedEngine::_ReadConfiguration: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def Run(self, inSubscriptions: List[Tuple]):
+        """
+        Process all of the subscriptions and return once every article has been handed to the queue
+        :param inSubscriptions: list of (url, classname) tuples
+        :return: Nothing
+        """
+
+        if not self.good or not inSubscriptions:
+            return
+
+        try:
+            # The pool is started before the event loop so forked workers don't inherit its threads
+            if self._workerPool is None:
+                self._workerPool = self._CreateWorkerPool()
+
+            asyncio.run(self._RunAsync(inSubscriptions, self._workerPool))
+        except BrokenProcessPool as e:
+            print("Exception in AsyncFeedEngine::Run, a worker died: {}".format(e))
+
+            # A broken pool can't take any more work, the next call starts a new one
+            self._ShutdownWorkerPool()
+        except Exception as e:
+            print("Exception in AsyncFeedEngine::Run: {}".format(e))
+        finally:
+            if not self._keepWorkerPool:
+                self._ShutdownWorkerPool()
+
+    # ******************************************************************************************************************
+    def Start(self) -> bool:
+        """
+        Start the NLP worker pool and keep it, with its loaded models, for every call to Run until Stop.  Without this
+        each call to Run starts and stops its own pool.  Call it before starting any threads, for the same reason.
+        :return: True if the pool is running
+        """
+
+        if not self.good:
+            return False
+
+        self._keepWorkerPool = True
+
+        try:
+            if self._workerPool is None:
+                self._workerPool = self._CreateWorkerPool()
+        except Exception as e:
+            print("Exception in AsyncFeedEngine::Start: {}".format(e))
+            return False
+
+        return True
+
+    # ******************************************************************************************************************
+    def Stop(self):
+        """
+        Shut down the worker pool started by Start
+        :return: Nothing
+        """
+
+        self._keepWorkerPool = False
+        self._ShutdownWorkerPool()
+
+    # ******************************************************************************************************************
+    def _ShutdownWorkerPool(self):
+        """
+        Wait for the workers to finish and shut the pool down
+        :return: Nothing
+        """
+
+        if self._workerPool is None:
+            return
+
+        try:
+            self._workerPool.shutdown()
+        except Exception as e:
+            print("Exception in AsyncFeedEngine::_ShutdownWorkerPool: {}".format(e))
+        finally:
+            self._workerPool = None
+
+    # ******************************************************************************************************************
+    def _CreateWorkerPool(self) -> ProcessPoolExecutor:
+        """
+        Create the NLP worker pool.  With PreloadModel on, the Spacy models are loaded here once and the workers are
+        forked from this process, so they share the models' memory copy-on-write instead of each loading their own.
+        :return: the pool
+        """
+
+        initArgs = (self._queue, self._configObject, self._memoryReportInterval)
+
+        if not self._preloadModel:
+            return ProcessPoolExecutor(max_workers=self._NLPWorkers, initializer=_InitWorker, initargs=initArgs)
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            print("AsyncFeedEngine: PreloadModel needs fork, which this platform doesn't have.  Each worker will load "
+                  "its own model.")
+            return ProcessPoolExecutor(max_workers=self._NLPWorkers, initializer=_InitWorker, initargs=initArgs)
+
+        for modelName in {ReadNLPProfile(self._configObject, profileName)["model"]
+                          for profileName in NLPProfileNames(self._configObject)}:
+            try:
+                LoadModel(modelName, self._sharedVectorsPath)
+            except Exception as e:
+                # The workers will try again if a subscription actually uses it
+                print("Exception in AsyncFeedEngine::_CreateWorkerPool loading {}: {}".format(modelName, e))
+
+        print("AsyncFeedEngine: Model loaded, parent {}: {}".format(os.getpid(),
+                                                                    ", ".join("{} {:.0f} MB".format(name, value)
+                                                                              for name, value in
+                                                                              ProcessMemory().items())))
+
+        # Move everything loaded so far out of the garbage collector's reach.  Otherwise the first collection in each
+        # worker writes to the header of every object in the model and copies the pages they're on.
+        gc.freeze()
+
+        workerPool = ProcessPoolExecutor(max_workers=self._NLPWorkers,
+                                         mp_context=multiprocessing.get_context("fork"),
+                                         initializer=_InitWorker,
+                                         initargs=initArgs)
+
+        # Start all of the workers now, while this process has no other threads
+        wait([workerPool.submit(_StartWorker) for worker in range(self._NLPWorkers)])
+
+        return workerPool
+
+    # ******************************************************************************************************************
+    async def _RunAsync(self, inSubscriptions: List[Tuple], inWorkerPool: ProcessPoolExecutor):
+        """
+        Set up the shared session and DB pool, then run every subscription concurrently
+        :param inSubscriptions: list of (url, classname) tuples
+        :param inWorkerPool: pool running the NLP
+        :return: Nothing
+        """
+
+        self._articleSlots = asyncio.Semaphore(self._maxRequests)
+
+        self._DBPool = await asyncpg.create_pool(host=self._DBHost,
+                                                 port=int(self._DBPort),
+                                                 database=self._DBTable,
+                                                 user=self._DBUser,
+                                                 password=self._DBPassword,
+                                                 min_size=1,
+                                                 max_size=self._DBPoolSize)
+
+        self._nlpProfiles = await self._GetNLPProfiles()
+
+        try:
+            connector = aiohttp.TCPConnector(limit=self._maxRequests, limit_per_host=self._maxRequestsPerHost)
+            timeout = aiohttp.ClientTimeout(total=self._requestTimeout)
+
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                await asyncio.gather(*[self._ProcessSubscription(session, inWorkerPool, subscription)
+                                       for subscription in inSubscriptions])
+        finally:
+            await self._DBPool.close()
+
+    # ******************************************************************************************************************
+    async def _ProcessSubscription(self, inSession, inWorkerPool: ProcessPoolExecutor, inURL: tuple):
+        """
+        Download and parse one feed, then process every article in it that we have not seen before
+        :param inSession: aiohttp ClientSession
+        :param inWorkerPool: pool running the NLP
+        :param inURL: (url, classname) tuple for the subscription
+        :return: Nothing
+        """
+
+        try:
+            url, classname = inURL
+
+            import feedparser
+
+            websiteClass = websites.GetWebsiteClass(classname)
+
+            print("Using URL: {}".format(url))
+            feedContent = await self._Fetch(inSession, url)
+            if not feedContent:
+                return
+
+            # feedparser is happy to take the bytes directly so we don't download the feed twice
+            loop = asyncio.get_running_loop()
+            myFeedParser = await loop.run_in_executor(None, feedparser.parse, feedContent)
+
+            articles = await self._FilterNewArticles([websiteClass.ArticleFromEntry(entry)
+                                                      for entry in myFeedParser.entries])
+
+            await asyncio.gather(*[self._ProcessArticle(inSession, inWorkerPool, inURL, article)
+                                   for article in articles])
+
+        except Exception as e:
+            print("Exception in AsyncFeedEngine::_ProcessSubscription for {}: {}".format(inURL, e))
+
+    # ******************************************************************************************************************
+    async def _GetNLPProfiles(self) -> dict:
+        """
+        Read the NLP profile of every subscription
+        :return: profile name by subscription URL, empty if migration 007 isn't applied
+        """
+
+        try:
+            async with self._DBPool.acquire() as connection:
+                rows = await connection.fetch("SELECT url, nlp_profile FROM subscriptions WHERE nlp_profile <> '';")
+
+            return {row["url"]: row["nlp_profile"] for row in rows}
+
+        except Exception as e:
+            print("Exception in AsyncFeedEngine::_GetNLPProfiles: {}".format(e))
+            return dict()
+
+    # ******************************************************************************************************************
+    async def _FilterNewArticles(self, inArticles: List[ExtractedArticle]) -> List[ExtractedArticle]:
+        """
+        Check the whole feed against news_articles in a single query and return only the articles we don't have yet
+        :param inArticles: articles from the feed
+        :return: articles not already in the database
+        """
+
+        if not inArticles:
+            return list()
+
+        async with self._DBPool.acquire() as connection:
+            if self._dedupEnabled:
+                rows = await connection.fetch("""
+                                              SELECT article_url, canonical_url FROM news_articles
+                                              WHERE article_url = ANY($1::text[]) OR canonical_url = ANY($2::text[]);
+                                              """,
+                                              [article.articleURL for article in inArticles],
+                                              [article.canonicalURL for article in inArticles])
+            else:
+                rows = await connection.fetch("""
+                                              SELECT article_url, NULL AS canonical_url FROM news_articles
+                                              WHERE article_url = ANY($1::text[]);
+                                              """,
+                                              [article.articleURL for article in inArticles])
+
+        seenURLs = {row["article_url"] for row in rows} | {row["canonical_url"] for row in rows}
+
+        return [article for article in inArticles
+                if article.articleURL not in seenURLs and
+                (not self._dedupEnabled or article.canonicalURL not in seenURLs)]
+
+    # ******************************************************************************************************************
+    async def _ProcessArticle(self, inSession, inWorkerPool: ProcessPoolExecutor, inURL: tuple,
+                              inArticle: ExtractedArticle) -> bool:
+        """
+        Download the article and hand it to a worker.  The slot is held until the worker is done with it so pages
+        can't pile up in memory faster than the NLP can process them.
+        :param inSession: aiohttp ClientSession
+        :param inWorkerPool: pool running the NLP
+        :param inURL: (url, classname) tuple for the subscription
+        :param inArticle: article wrapper from the feed
+        :return: True if the article was pushed onto the queue
+        """
+
+        async with self._articleSlots:
+            if self._archiveReplay:
+                content = None
+            else:
+                content = await self._Fetch(inSession, inArticle.articleURL)
+                if not content:
+                    return False
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(inWorkerPool, _ProcessInWorker, inURL, inArticle, content,
+                                              self._nlpProfiles.get(inURL[0], str()))
+
+    # ******************************************************************************************************************
+    async def _Fetch(self, inSession, inURL: str) -> bytes:
+        """
+        Download the URL
+        :param inSession: aiohttp ClientSession
+        :param inURL: URL to download
+        :return: the raw content, empty on error
+        """
+
+        try:
+            async with inSession.get(inURL) as response:
+                response.raise_for_status()
+                return await response.read()
+
+        except Exception as e:
+            print("Exception in AsyncFeedEngine::_Fetch for {}: {}".format(inURL, e))
+            return bytes()
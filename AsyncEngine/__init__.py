@@ -0,0 +1 @@
+from .AsyncEngine import AsyncFeedEngine
@@ -5,13 +5,50 @@ DBWriter.py
 Describes the class that runs as a separate process and writes data to the database as it is pushed into a global queue.
 """
 
+from collections import defaultdict
+import io
 import multiprocessing
 import configparser
+import queue
+import time
 import psycopg2
 from typing import List, Tuple
 from websites import ExtractedArticle
+from websites.Fingerprint import FingerprintBands
 from psycopg2 import sql
 
+# The article link tables and their entity columns
+LINK_TABLES = [("article_people", "people_id"),
+               ("article_locations", "location_id"),
+               ("article_facilities", "facility_id"),
+               ("article_organizations", "organization_id"),
+               ("article_events", "event_id")]
+
+# The entity tables, in the same order as LINK_TABLES
+ENTITY_TABLES = ["people", "locations", "facilities", "organizations", "event"]
+
+# link_table value of the country lookups in staging_names, after the entity tables
+COUNTRY_NAMES = len(ENTITY_TABLES)
+
+# How long _FindCountries trusts its cache before looking the names up again
+COUNTRY_CACHE_SECONDS = 3600
+
+
+# **********************************************************************************************************************
+def ArticleTextSQL(inSeparateText: bool) -> Tuple[sql.Composable, sql.Composable]:
+    """
+    The article text column and the join it needs, for a query on news_articles.  With the text in news_article_texts
+    it still falls back to news_articles.article_text, for the rows migration 009 hasn't moved yet.
+    :param inSeparateText: the DB SeparateArticleText setting
+    :return: (text column, join clause)
+    """
+
+    if not inSeparateText:
+        return sql.SQL("news_articles.article_text"), sql.SQL("")
+
+    return (sql.SQL("COALESCE(news_article_texts.article_text, news_articles.article_text)"),
+            sql.SQL("LEFT JOIN news_article_texts ON news_article_texts.article_id = news_articles.id"))
+
 
 class DBWriter(multiprocessing.Process):
     """
@@ -52,6 +89,24 @@ class DBWriter(multiprocessing.Process):
             self._DBConnection = None
             self._DBCursor = None
 
+            # Results of the countries lookups by name, and when the cache was last emptied
+            self._countryCache = dict()
+            self._countryCacheSince = time.time()
+
+            # When not None, article links are collected here keyed by (table, column) instead of being written
+            self._linkBuffer = None
+
+            # Names already matched by _GetUniqueCommon, keyed by (table, name).  Only used while collecting links.
+            self._uniqueCache = dict()
+
+            # Articles waiting to be written in bulk mode, and when the first of them arrived
+            self._pendingArticles = list()
+            self._pendingSince = 0.0
+
+            # Snapshot of the locations table, loaded the first time it's needed
+            self._configObject = inConfigObject
+            self._gazetteer = None
+
             # Read the configuration
             if not self._ReadConfiguration(inConfigObject):
                 self.good = False
@@ -135,6 +190,40 @@ class DBWriter(multiprocessing.Process):
             self._DBPassword = DB["DBPassword"]
             self._DBTable = DB["DBTable"]
 
+            # Keep the article text in news_article_texts instead of news_articles
+            self._separateText = DB.getboolean("SeparateArticleText", False)
+
+            # Store the canonical URL and fingerprint of each article
+            self._dedupEnabled = False
+            if inConfigObject.has_section("DEDUP"):
+                self._dedupEnabled = inConfigObject["DEDUP"].getboolean("Enabled", self._dedupEnabled)
+
+            # Keep a centroid, bounding box and geohash cells for each article's locations in article_spatial
+            self._spatialEnabled = False
+            self._geohashPrecision = 5
+            if inConfigObject.has_section("SPATIAL"):
+                SPATIAL = inConfigObject["SPATIAL"]
+
+                self._spatialEnabled = SPATIAL.getboolean("Enabled", self._spatialEnabled)
+                self._geohashPrecision = SPATIAL.getint("GeohashPrecision", self._geohashPrecision)
+
+            # Match the locations against the gazetteer snapshot before going to the database
+            self._gazetteerEnabled = False
+            if inConfigObject.has_section("GAZETTEER"):
+                self._gazetteerEnabled = inConfigObject["GAZETTEER"].getboolean("Enabled", self._gazetteerEnabled)
+
+            # Buffer the articles and write them with COPY once there are FlushArticles of them or the oldest has waited
+            # FlushSeconds
+            self._bulkEnabled = False
+            self._flushArticles = 500
+            self._flushSeconds = 30.0
+            if inConfigObject.has_section("BULK"):
+                BULK = inConfigObject["BULK"]
+
+                self._bulkEnabled = BULK.getboolean("Enabled", self._bulkEnabled)
+                self._flushArticles = BULK.getint("FlushArticles", self._flushArticles)
+                self._flushSeconds = BULK.getfloat("FlushSeconds", self._flushSeconds)
+
             return True
 
         except Exception as e:
@@ -174,59 +263,60 @@ class DBWriter(multiprocessing.Process):
             return False
 
     # ******************************************************************************************************************
-    def _InsertArticlePeople(self, inArticleID: int, inPeopleID: int):
+    def _InsertArticleLink(self, inTable: str, inColumn: str, inArticleID: int, inEntityID: int):
         """
-        Insert the passed-in values to the database.
+        Insert a link between an article and an entity.  If we are collecting links (see RewriteEntries) the link is
+        added to the buffer instead of being written right away.
+        :param inTable: link table (ie, article_people)
+        :param inColumn: entity column in the link table (ie, people_id)
         :param inArticleID: integer article identifier
-        :param inPeopleID: integer person identifier
+        :param inEntityID: integer entity identifier
         :return: none
         """
 
         try:
             # Do not do anything if nothing passed in
-            if not inArticleID or not inPeopleID:
+            if not inArticleID or not inEntityID:
                 return
 
             # Don't do anything if we are debugging
             if inArticleID == -1:
                 return
 
-            print("INSERT INTO article_people (article_id, people_id) VALUES ({}, {});".format(inArticleID, inPeopleID))
-            self._DBCursor.execute("INSERT INTO article_people (article_id, people_id) VALUES (%s, %s);",
-                                   (inArticleID, inPeopleID))
+            if self._linkBuffer is not None:
+                self._linkBuffer[(inTable, inColumn)].append((inArticleID, inEntityID))
+                return
+
+            print("INSERT INTO {} (article_id, {}) VALUES ({}, {});".format(inTable, inColumn, inArticleID, inEntityID))
+            self._DBCursor.execute(sql.SQL("INSERT INTO {} (article_id, {}) VALUES (%s, %s);").format(
+                                   sql.Identifier(inTable), sql.Identifier(inColumn)), (inArticleID, inEntityID))
             self._DBConnection.commit()
 
         except Exception as e:
-            print("Exception in DBWriter::_InsertArticlePeople: {}".format(e))
+            print("Exception in DBWriter::_InsertArticleLink for {}: {}".format(inTable, e))
             self._ResetSQLConnection()
 
     # ******************************************************************************************************************
-    def _InsertArticleLocations(self, inArticleID: int, inLocationID: int):
+    def _InsertArticlePeople(self, inArticleID: int, inPeopleID: int):
         """
         Insert the passed-in values to the database.
         :param inArticleID: integer article identifier
-        :param inLocationID: integer location identifier
+        :param inPeopleID: integer person identifier
         :return: none
         """
 
-        try:
-            # Do not do anything if nothing passed in
-            if not inArticleID or not inLocationID:
-                return
+        self._InsertArticleLink("article_people", "people_id", inArticleID, inPeopleID)
 
-            # Don't do anything if we are debugging
-            if inArticleID == -1:
-                return
-
-            print("INSERT INTO article_locations (article_id, location_id) VALUES ({}, {});".format(inArticleID,
-                                                                                                    inLocationID))
-            self._DBCursor.execute("INSERT INTO article_locations (article_id, location_id) VALUES (%s, %s);",
-                                   (inArticleID, inLocationID))
-            self._DBConnection.commit()
+    # ******************************************************************************************************************
+    def _InsertArticleLocations(self, inArticleID: int, inLocationID: int):
+        """
+        Insert the passed-in values to the database.
+        :param inArticleID: integer article identifier
+        :param inLocationID: integer location identifier
+        :return: none
+        """
 
-        except Exception as e:
-            print("Exception in DBWriter::_InsertArticleLocations: {}".format(e))
-            self._ResetSQLConnection()
+        self._InsertArticleLink("article_locations", "location_id", inArticleID, inLocationID)
 
     # ******************************************************************************************************************
     def _InsertArticleFacilities(self, inArticleID: int, inFacilityID: int):
@@ -237,24 +327,7 @@ class DBWriter(multiprocessing.Process):
         :return: none
         """
 
-        try:
-            # Do not do anything if nothing passed in
-            if not inArticleID or not inFacilityID:
-                return
-
-            # Don't do anything if we are debugging
-            if inArticleID == -1:
-                return
-
-            print("INSERT INTO article_facilities (article_id, facility_id) VALUES ({}, {});".format(inArticleID,
-                                                                                                     inFacilityID))
-            self._DBCursor.execute("INSERT INTO article_facilities (article_id, facility_id) VALUES (%s, %s);",
-                                   (inArticleID, inFacilityID))
-            self._DBConnection.commit()
-
-        except Exception as e:
-            print("Exception in DBWriter::_InsertArticleFacilities: {}".format(e))
-            self._ResetSQLConnection()
+        self._InsertArticleLink("article_facilities", "facility_id", inArticleID, inFacilityID)
 
     # ******************************************************************************************************************
     def _InsertArticleOrganizations(self, inArticleID: int, inOrganizationID: int):
@@ -265,24 +338,7 @@ class DBWriter(multiprocessing.Process):
         :return: none
         """
 
-        try:
-            # Do not do anything if nothing passed in
-            if not inArticleID or not inOrganizationID:
-                return
-
-            # Don't do anything if we are debugging
-            if inArticleID == -1:
-                return
-
-            print("INSERT INTO article_organizations (article_id, organization_id) VALUES ({}, {});".format(inArticleID,
-                                                                                                            inOrganizationID))
-            self._DBCursor.execute("INSERT INTO article_organizations (article_id, organization_Id) VALUES (%s, %s);",
-                                   (inArticleID, inOrganizationID))
-            self._DBConnection.commit()
-
-        except Exception as e:
-            print("Exception in DBWriter::_InsertArticleOrganizations: {}".format(e))
-            self._ResetSQLConnection()
+        self._InsertArticleLink("article_organizations", "organization_id", inArticleID, inOrganizationID)
 
     # ******************************************************************************************************************
     def _InsertArticleEvents(self, inArticleID: int, inEventID: int):
@@ -293,22 +349,28 @@ class DBWriter(multiprocessing.Process):
         :return: none
         """
 
-        try:
-            # Do not do anything if nothing passed in
-            if not inArticleID or not inEventID:
-                return
+        self._InsertArticleLink("article_events", "event_id", inArticleID, inEventID)
 
-            # Don't do anything if we are debugging
-            if inArticleID == -1:
-                return
+    # ******************************************************************************************************************
+    def _InsertFingerprintBands(self, inArticleID: int, inFingerprint: int):
+        """
+        Insert the bands of the article's fingerprint into the near-duplicate index.
+        :param inArticleID: integer article identifier
+        :param inFingerprint: SimHash of the article text
+        :return: none
+        """
 
-            print("INSERT INTO article_events (article_id, event_id) VALUES ({}, {});".format(inArticleID, inEventID))
-            self._DBCursor.execute("INSERT INTO article_events (article_id, event_id) VALUES (%s, %s);",
-                                   (inArticleID, inEventID))
+        try:
+            bands = FingerprintBands(inFingerprint)
+
+            self._DBCursor.execute("""
+                                    INSERT INTO article_simhash_bands (article_id, band, band_value)
+                                    SELECT %s, UNNEST(%s::smallint[]), UNNEST(%s::integer[]);
+                                    """, (inArticleID, list(range(len(bands))), bands))
             self._DBConnection.commit()
 
         except Exception as e:
-            print("Exception in DBWriter::_InsertArticleEvents: {}".format(e))
+            print("Exception in DBWriter::_InsertFingerprintBands: {}".format(e))
             self._ResetSQLConnection()
 
     # ******************************************************************************************************************
@@ -492,7 +554,14 @@ class DBWriter(multiprocessing.Process):
         print(inLocationList)
 
         try:
+            # Settle everything the gazetteer can in one go, the rest go through the database
+            gazetteerMatches = self._GazetteerMatches(inLocationList)
+
             for location in inLocationList:
+                if location in gazetteerMatches:
+                    self._InsertArticleLocations(inArticleID, gazetteerMatches[location])
+                    continue
+
                 # Run location disambiguation case 1 (check for a unique location result)
                 locationID = self._GetUniqueCommon(location, "locations")
                 if locationID != -1:
@@ -612,23 +681,49 @@ class DBWriter(multiprocessing.Process):
         """
 
         try:
+            # The text goes in its own table once we have the id
+            articleText = None if self._separateText else inArticleObject.articleText
+
             # Push the article metadata to the DB and get the assigned identifier for it.
             print("""
                  INSERT INTO news_articles (article_title, article_url, article_text, website)
                  VALUES ({}, {}, {}, {}) RETURNING id;
                  """.format(inArticleObject.articleTitle, inArticleObject.articleURL, inArticleObject.articleText,
                             inArticleObject.website))
-            self._DBCursor.execute("""
-                                    INSERT INTO news_articles (article_title, article_url, article_text, website)
-                                    VALUES (%s, %s, %s, %s) RETURNING id;
-                                    """,
-                                   (inArticleObject.articleTitle, inArticleObject.articleURL,
-                                     inArticleObject.articleText, inArticleObject.website))
-            self._DBConnection.commit()
+            if self._dedupEnabled:
+                self._DBCursor.execute("""
+                                        INSERT INTO news_articles (article_title, article_url, article_text, website,
+                                                                   canonical_url, simhash)
+                                        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id;
+                                        """,
+                                       (inArticleObject.articleTitle, inArticleObject.articleURL,
+                                        articleText, inArticleObject.website,
+                                        inArticleObject.canonicalURL or None, inArticleObject.fingerprint))
+            else:
+                self._DBCursor.execute("""
+                                        INSERT INTO news_articles (article_title, article_url, article_text, website)
+                                        VALUES (%s, %s, %s, %s) RETURNING id;
+                                        """,
+                                       (inArticleObject.articleTitle, inArticleObject.articleURL,
+                                         articleText, inArticleObject.website))
 
             # Get the ID of the inserted object
             articleID = self._DBCursor.fetchone()[0]
 
+            if self._separateText:
+                self._DBCursor.execute("""
+                                        INSERT INTO news_article_texts (article_id, article_text) VALUES (%s, %s);
+                                        """, (articleID, inArticleObject.articleText))
+
+            # Articles from the extract mode are finished once they're stored
+            self._MarkPendingDone([inArticleObject])
+
+            self._DBConnection.commit()
+
+            # Add the article to the near-duplicate index
+            if self._dedupEnabled and inArticleObject.fingerprint is not None:
+                self._InsertFingerprintBands(articleID, inArticleObject.fingerprint)
+
             # Now populate the article_people table
             self._ProcessPeople(articleID, inArticleObject.people)
 
@@ -644,11 +739,98 @@ class DBWriter(multiprocessing.Process):
             # Now populate the article_locations table
             self._ProcessLocations(articleID, inArticleObject.locations)
 
+            # Now summarize the locations that were linked
+            if self._spatialEnabled:
+                self._UpdateArticleSpatial([articleID])
+                self._DBConnection.commit()
+
         except Exception as e:
             print("Exception in DBWriter::WriteEntries: {}".format(e))
             self.good = False
             self._ResetSQLConnection()
 
+    # ******************************************************************************************************************
+    def RewriteEntries(self, inArticleObjects: List[ExtractedArticle], inUpdateText: bool = False):
+        """
+        Replace the entity links for articles that are already in the database.  The entities are matched the same way
+        as WriteEntries, but the links are collected and then the old links are deleted and the new ones inserted with
+        one statement per table.
+        :param inArticleObjects: articles with articleID set
+        :param inUpdateText: also replace the stored article text
+        :return:
+        """
+
+        try:
+            articleIDs = [article.articleID for article in inArticleObjects]
+
+            self._linkBuffer = defaultdict(list)
+
+            for article in inArticleObjects:
+                self._ProcessPeople(article.articleID, article.people)
+                self._ProcessFacilities(article.articleID, article.facilities)
+                self._ProcessOrganizations(article.articleID, article.organizations)
+                self._ProcessEvents(article.articleID, article.events)
+                self._ProcessLocations(article.articleID, article.locations)
+
+            linkBuffer = self._linkBuffer
+            self._linkBuffer = None
+
+            # Swap the links over in one transaction
+            for table, column in LINK_TABLES:
+                self._DBCursor.execute(sql.SQL("DELETE FROM {} WHERE article_id = ANY(%s);").format(
+                                       sql.Identifier(table)), (articleIDs,))
+
+            self._InsertLinks(linkBuffer)
+
+            if self._spatialEnabled:
+                self._UpdateArticleSpatial(articleIDs)
+
+            if inUpdateText and self._separateText:
+                self._DBCursor.execute("""
+                                        INSERT INTO news_article_texts (article_id, article_text)
+                                        SELECT * FROM UNNEST(%s::bigint[], %s::text[])
+                                        ON CONFLICT (article_id) DO UPDATE SET article_text = EXCLUDED.article_text;
+                                        """, (articleIDs, [article.articleText for article in inArticleObjects]))
+            elif inUpdateText:
+                self._DBCursor.execute("""
+                                        UPDATE news_articles SET article_text = new_text.article_text
+                                        FROM UNNEST(%s::bigint[], %s::text[]) AS new_text(id, article_text)
+                                        WHERE news_articles.id = new_text.id;
+                                        """, (articleIDs, [article.articleText for article in inArticleObjects]))
+
+            self._DBConnection.commit()
+
+        except Exception as e:
+            print("Exception in DBWriter::RewriteEntries: {}".format(e))
+            self.good = False
+            self._ResetSQLConnection()
+
+        finally:
+            self._linkBuffer = None
+
+            # Don't hang on to matches between batches, the entity tables can be edited while we're running
+            self._uniqueCache.clear()
+
+    # ******************************************************************************************************************
+    def _InsertLinks(self, inLinks: dict):
+        """
+        Insert collected article links with one statement per table.  Does not commit.
+        :param inLinks: lists of (article id, entity id) keyed by (table, column)
+        :return: none
+        """
+
+        for (table, column), links in inLinks.items():
+            if not links:
+                continue
+
+            articleIDs, entityIDs = zip(*links)
+
+            self._DBCursor.execute(sql.SQL("""
+                                            INSERT INTO {} (article_id, {})
+                                            SELECT * FROM UNNEST(%s::bigint[], %s::bigint[]);
+                                            """).format(sql.Identifier(table), sql.Identifier(column)),
+                                   (list(articleIDs), list(entityIDs)))
+
     # ******************************************************************************************************************
     def run(self):
         """
@@ -659,14 +841,530 @@ class DBWriter(multiprocessing.Process):
         continueFlag = True
 
         while continueFlag:
-            articleObject = self._queue.get()
+            if self._bulkEnabled:
+                try:
+                    articleObject = self._queue.get(timeout=self._FlushTimeout())
+                except queue.Empty:
+                    self.FlushArticles()
+                    continue
+            else:
+                articleObject = self._queue.get()
 
             # Check for our poison pill
             if articleObject.articleText == "EXITCALLED":
                 continueFlag = False
                 continue
 
-            self.WriteEntries(articleObject)
+            if self._bulkEnabled:
+                self.BufferArticle(articleObject)
+            else:
+                self.WriteEntries(articleObject)
+
+        # Write out whatever is left
+        if self._bulkEnabled:
+            self.FlushArticles()
+
+    # ******************************************************************************************************************
+    def _FlushTimeout(self) -> float:
+        """
+        How long to wait on the queue before the buffered articles are due to be written
+        :return: seconds, None to wait forever if nothing is buffered
+        """
+
+        if not self._pendingArticles:
+            return None
+
+        return max(self._pendingSince + self._flushSeconds - time.time(), 0.0)
+
+    # ******************************************************************************************************************
+    def BufferArticle(self, inArticleObject: ExtractedArticle):
+        """
+        Add an article to the bulk buffer, writing the buffer out once it is full
+        :param inArticleObject: article to write
+        :return:
+        """
+
+        if not self._pendingArticles:
+            self._pendingSince = time.time()
+
+        self._pendingArticles.append(inArticleObject)
+
+        if len(self._pendingArticles) >= self._flushArticles:
+            self.FlushArticles()
+
+    # ******************************************************************************************************************
+    def FlushArticles(self):
+        """
+        Write the buffered articles.  The articles and their entity names are loaded into temporary tables with COPY,
+        the names are matched the same way as WriteEntries but with one statement per check for the whole buffer (see
+        _ResolveEntities), and the articles and links are moved into the real tables with one statement per table, all
+        in one transaction.  If that fails nothing was written, so the articles are written one at a time with
+        WriteEntries instead of being dropped.
+        :return:
+        """
+
+        if not self._pendingArticles:
+            return
+
+        articles = self._pendingArticles
+        self._pendingArticles = list()
+
+        startTime = time.time()
+        flushed = False
+
+        try:
+            # Take the ids from the sequence up front so the links can be built before the articles are written
+            self._DBCursor.execute("""
+                                    SELECT nextval(pg_get_serial_sequence('news_articles', 'id'))
+                                    FROM generate_series(1, %s);
+                                    """, (len(articles),))
+            articleIDs = [row[0] for row in self._DBCursor.fetchall()]
+
+            for articleID, article in zip(articleIDs, articles):
+                article.articleID = articleID
+
+            self._CreateStagingTables()
+
+            self._CopyRows("staging_articles",
+                           ["id", "article_title", "article_url", "article_text", "website", "canonical_url",
+                            "simhash"],
+                           [(article.articleID, article.articleTitle, article.articleURL, article.articleText,
+                             article.website, article.canonicalURL or None, article.fingerprint)
+                            for article in articles])
+
+            # Leave news_articles.article_text empty when the text has its own table
+            textColumn = sql.SQL("NULL") if self._separateText else sql.Identifier("article_text")
+
+            if self._dedupEnabled:
+                self._DBCursor.execute(sql.SQL("""
+                                        INSERT INTO news_articles (id, article_title, article_url, article_text, website,
+                                                                   canonical_url, simhash)
+                                        SELECT id, article_title, article_url, {}, website, canonical_url, simhash
+                                        FROM staging_articles;
+                                        """).format(textColumn))
+
+                bandRows = [(article.articleID, band, bandValue) for article in articles
+                            if article.fingerprint is not None
+                            for band, bandValue in enumerate(FingerprintBands(article.fingerprint))]
+                if bandRows:
+                    articleColumn, bandColumn, valueColumn = zip(*bandRows)
+                    self._DBCursor.execute("""
+                                            INSERT INTO article_simhash_bands (article_id, band, band_value)
+                                            SELECT * FROM UNNEST(%s::bigint[], %s::smallint[], %s::integer[]);
+                                            """, (list(articleColumn), list(bandColumn), list(valueColumn)))
+            else:
+                self._DBCursor.execute(sql.SQL("""
+                                        INSERT INTO news_articles (id, article_title, article_url, article_text, website)
+                                        SELECT id, article_title, article_url, {}, website
+                                        FROM staging_articles;
+                                        """).format(textColumn))
+
+            if self._separateText:
+                self._DBCursor.execute("""
+                                        INSERT INTO news_article_texts (article_id, article_text)
+                                        SELECT id, article_text FROM staging_articles;
+                                        """)
+
+            self._StageEntities(articles)
+            self._ResolveEntities()
+
+            linkCount = self._MoveLinks()
+
+            if self._spatialEnabled:
+                self._UpdateArticleSpatial(articleIDs)
+
+            self._MarkPendingDone(articles)
+
+            self._DBConnection.commit()
+            flushed = True
+
+            print("DBWriter: Wrote {} articles and {} links in {:.2f} seconds".format(len(articles), linkCount,
+                                                                                      time.time() - startTime))
+
+        except Exception as e:
+            print("Exception in DBWriter::FlushArticles: {}".format(e))
+            self._ResetSQLConnection()
+
+        if not flushed:
+            print("DBWriter: Writing the {} buffered articles one at a time".format(len(articles)))
+
+            for article in articles:
+                self.WriteEntries(article)
+
+    # ******************************************************************************************************************
+    def _MarkPendingDone(self, inArticleObjects: List[ExtractedArticle]):
+        """
+        Mark the articles that came from pending_articles as done.  Does not commit, so it goes in with the articles.
+        :param inArticleObjects: articles being written
+        :return: none
+        """
+
+        pendingIDs = [article.pendingID for article in inArticleObjects if article.pendingID is not None]
+        if not pendingIDs:
+            return
+
+        self._DBCursor.execute("""
+                                UPDATE pending_articles SET status = 'done', lease_owner = NULL, lease_expires = NULL
+                                WHERE id = ANY(%s);
+                                """, (pendingIDs,))
+
+    # ******************************************************************************************************************
+    def _UpdateArticleSpatial(self, inArticleIDs: List[int]):
+        """
+        Summarize the linked locations of each article in article_spatial, so the spatial queries don't have to join
+        the link table to locations.  Called once the links are written.  Does not commit, so it goes in with the links.
+        :param inArticleIDs: article ids
+        :return: none
+        """
+
+        # Replace the whole row, the links may have changed when reprocessing and some articles have no locations left
+        self._DBCursor.execute("DELETE FROM article_spatial WHERE article_id = ANY(%s);", (inArticleIDs,))
+
+        self._DBCursor.execute("""
+                                INSERT INTO article_spatial (article_id, location_count, centroid, centroid_geohash,
+                                                             bbox, geohashes)
+                                SELECT article_id, location_count, centroid, ST_GeoHash(centroid, %(precision)s),
+                                       bbox, geohashes
+                                FROM (
+                                    SELECT article_locations.article_id,
+                                           COUNT(DISTINCT locations.id) AS location_count,
+                                           ST_Centroid(ST_Collect(locations.the_geom)) AS centroid,
+                                           ST_Envelope(ST_Collect(locations.the_geom)) AS bbox,
+                                           ARRAY_AGG(DISTINCT ST_GeoHash(locations.the_geom, %(precision)s)) AS geohashes
+                                    FROM article_locations
+                                    JOIN locations ON locations.id = article_locations.location_id
+                                    WHERE article_locations.article_id = ANY(%(articleIDs)s)
+                                      AND locations.the_geom IS NOT NULL
+                                    GROUP BY article_locations.article_id
+                                ) AS summary;
+                                """, {"precision": self._geohashPrecision, "articleIDs": inArticleIDs})
+
+    # ******************************************************************************************************************
+    def _CreateStagingTables(self):
+        """
+        Create the temporary tables used by FlushArticles.  They are emptied on every commit.
+        :return: none
+        """
+
+        self._DBCursor.execute("""
+                                CREATE TEMPORARY TABLE IF NOT EXISTS staging_articles (
+                                    id bigint,
+                                    article_title text,
+                                    article_url text,
+                                    article_text text,
+                                    website text,
+                                    canonical_url text,
+                                    simhash bigint
+                                ) ON COMMIT DELETE ROWS;
+                                """)
+
+        # One row per entity name of each article, position is its place in the article's list
+        self._DBCursor.execute("""
+                                CREATE TEMPORARY TABLE IF NOT EXISTS staging_entities (
+                                    link_table smallint,
+                                    article_id bigint,
+                                    position integer,
+                                    name text,
+                                    entity_id bigint
+                                ) ON COMMIT DELETE ROWS;
+                                """)
+
+        # The distinct names of each table, and the location names to look up in countries (COUNTRY_NAMES)
+        self._DBCursor.execute("""
+                                CREATE TEMPORARY TABLE IF NOT EXISTS staging_names (
+                                    link_table smallint,
+                                    name text,
+                                    entity_id bigint
+                                ) ON COMMIT DELETE ROWS;
+                                """)
+
+    # ******************************************************************************************************************
+    def _CopyRows(self, inTable: str, inColumns: List[str], inRows: List[Tuple]):
+        """
+        Load rows into a table with COPY.  Does not commit.
+        :param inTable: table to load
+        :param inColumns: columns in the order of the values in the rows
+        :param inRows: rows to load.  None is written as NULL.
+        :return: none
+        """
+
+        buffer = io.StringIO()
+        for row in inRows:
+            buffer.write(",".join(self._CSVField(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        copyQuery = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv);").format(
+                    sql.Identifier(inTable), sql.SQL(", ").join(sql.Identifier(column) for column in inColumns))
+
+        self._DBCursor.copy_expert(copyQuery.as_string(self._DBConnection), buffer)
+
+    # ******************************************************************************************************************
+    @staticmethod
+    def _CSVField(inValue) -> str:
+        """
+        Format a value for COPY in csv format.  Strings are always quoted so an empty string stays an empty string and
+        only None (an unquoted empty field) is read as NULL.
+        :param inValue: value to format
+        :return: csv field
+        """
+
+        if inValue is None:
+            return str()
+
+        if isinstance(inValue, str):
+            return '"' + inValue.replace('"', '""') + '"'
+
+        return str(inValue)
+
+    # ******************************************************************************************************************
+    def _StageEntities(self, inArticleObjects: List[ExtractedArticle]):
+        """
+        Load the entity names of the articles into staging_entities with a single COPY, and their distinct names into
+        staging_names.  Locations the gazetteer can match go in already matched.  Does not commit.
+        :param inArticleObjects: articles being written, with articleID set
+        :return: none
+        """
+
+        rows = list()
+
+        for article in inArticleObjects:
+            gazetteerMatches = self._GazetteerMatches(article.locations)
+
+            entityLists = [article.people, article.locations, article.facilities, article.organizations,
+                           article.events]
+
+            for number, names in enumerate(entityLists):
+                for position, name in enumerate(names):
+                    # The one at a time inserts skip empty names too
+                    if not name:
+                        continue
+
+                    entityID = gazetteerMatches.get(name) if ENTITY_TABLES[number] == "locations" else None
+                    rows.append((number, article.articleID, position, name, entityID))
+
+        if not rows:
+            return
+
+        self._CopyRows("staging_entities", ["link_table", "article_id", "position", "name", "entity_id"], rows)
+
+        self._DBCursor.execute("""
+                                INSERT INTO staging_names (link_table, name)
+                                SELECT DISTINCT link_table, name FROM staging_entities WHERE entity_id IS NULL;
+                                """)
+
+        # Temporary tables are never analyzed on their own, and the joins below need the row counts
+        self._DBCursor.execute("ANALYZE staging_entities;")
+        self._DBCursor.execute("ANALYZE staging_names;")
+
+    # ******************************************************************************************************************
+    def _ResolveEntities(self):
+        """
+        Match every name in staging_entities to an entity id, the set based version of the _Process* functions.  Each
+        check runs once for all of the names that are still unmatched, in the same order as WriteEntries: the checks in
+        _FindUniqueCommon, then for locations the country (_LocationCaseTwo) and population (_LocationCaseThree) checks,
+        and the names that are left are added to their tables with one INSERT per table.  Does not commit.
+        :return: none
+        """
+
+        for number, table in enumerate(ENTITY_TABLES):
+            self._ResolveNames(number, table)
+
+        # Hand the matches down to the article rows, the location checks below are per article
+        self._DBCursor.execute("""
+                                UPDATE staging_entities SET entity_id = staging_names.entity_id
+                                FROM staging_names
+                                WHERE staging_entities.entity_id IS NULL
+                                  AND staging_names.entity_id IS NOT NULL
+                                  AND staging_names.link_table = staging_entities.link_table
+                                  AND staging_names.name = staging_entities.name;
+                                """)
+
+        locations = ENTITY_TABLES.index("locations")
+
+        # Same as _FindCountries, only for the articles that still have an unmatched location
+        self._DBCursor.execute("""
+                                INSERT INTO staging_names (link_table, name)
+                                SELECT DISTINCT %(countries)s, name FROM staging_entities
+                                WHERE link_table = %(locations)s AND article_id IN (
+                                    SELECT article_id FROM staging_entities
+                                    WHERE link_table = %(locations)s AND entity_id IS NULL);
+                                """, {"countries": COUNTRY_NAMES, "locations": locations})
+
+        if self._DBCursor.rowcount > 0:
+            self._ResolveNames(COUNTRY_NAMES, "countries")
+            self._ResolveLocationsByCountry(locations)
+
+        self._ResolveLocationsByPopulation(locations)
+
+        for number, table in enumerate(ENTITY_TABLES):
+            self._InsertNewEntities(number, table)
+
+    # ******************************************************************************************************************
+    def _ResolveNames(self, inNumber: int, inTable: str):
+        """
+        Run the checks in _FindUniqueCommon for the unmatched names of one table in staging_names.  As there, a check
+        only counts when it gives a single row.  Does not commit.
+        :param inNumber: link_table value of the names
+        :param inTable: table to match them against
+        :return: none
+        """
+
+        # (extra FROM items, condition) for exact names, aliases, similar names and similar aliases
+        checks = [(sql.SQL(""), sql.SQL("entities.name = staging_names.name")),
+                  (sql.SQL(""), sql.SQL("entities.aliases @> ARRAY[staging_names.name]")),
+                  (sql.SQL(""), sql.SQL("entities.name %% staging_names.name "
+                                        "AND SIMILARITY(entities.name, staging_names.name) > 0.5")),
+                  (sql.SQL(", UNNEST(entities.aliases) AS alias"),
+                   sql.SQL("SIMILARITY(alias, staging_names.name) > 0.5"))]
+
+        for extraFrom, condition in checks:
+            self._DBCursor.execute(sql.SQL("""
+                                            UPDATE staging_names SET entity_id = matches.entity_id
+                                            FROM (
+                                                SELECT staging_names.name, MIN(entities.id) AS entity_id
+                                                FROM staging_names, {} AS entities{}
+                                                WHERE staging_names.link_table = %(number)s
+                                                  AND staging_names.entity_id IS NULL
+                                                  AND {}
+                                                GROUP BY staging_names.name
+                                                HAVING COUNT(*) = 1
+                                            ) AS matches
+                                            WHERE staging_names.link_table = %(number)s
+                                              AND staging_names.name = matches.name;
+                                            """).format(sql.Identifier(inTable), extraFrom, condition),
+                                   {"number": inNumber})
+
+    # ******************************************************************************************************************
+    def _ResolveLocationsByCountry(self, inLocations: int):
+        """
+        The set based _LocationCaseTwo.  Each unmatched location is checked against the countries of the other
+        locations in its article, in the order they appear, and takes the first of: an exact name match in the country
+        (the highest population if there are several), a single similar name in the country, or a single alias match
+        in the country.  Does not commit.
+        :param inLocations: link_table value of the locations
+        :return: none
+        """
+
+        self._DBCursor.execute("""
+                                WITH unmatched AS (
+                                    SELECT article_id, position, name FROM staging_entities
+                                    WHERE link_table = %(locations)s AND entity_id IS NULL
+                                ), admins AS (
+                                    SELECT staging_entities.article_id, staging_entities.position, countries.cc2
+                                    FROM staging_entities
+                                    JOIN staging_names ON staging_names.link_table = %(countries)s
+                                                      AND staging_names.name = staging_entities.name
+                                    JOIN countries ON countries.id = staging_names.entity_id
+                                    WHERE staging_entities.link_table = %(locations)s
+                                ), candidates AS (
+                                    SELECT unmatched.article_id, unmatched.position, admins.position AS admin_position,
+                                           1 AS step,
+                                           (ARRAY_AGG(locations.id ORDER BY locations.population DESC NULLS LAST))[1]
+                                               AS entity_id
+                                    FROM unmatched
+                                    JOIN admins ON admins.article_id = unmatched.article_id
+                                    JOIN locations ON locations.name = unmatched.name AND locations.cc2 = admins.cc2
+                                    GROUP BY unmatched.article_id, unmatched.position, admins.position
+                                    HAVING COUNT(*) = 1 OR COUNT(locations.population) > 0
+                                    UNION ALL
+                                    SELECT unmatched.article_id, unmatched.position, admins.position, 2,
+                                           MIN(locations.id)
+                                    FROM unmatched
+                                    JOIN admins ON admins.article_id = unmatched.article_id
+                                    JOIN locations ON locations.cc2 = admins.cc2
+                                                  AND locations.name %% unmatched.name
+                                                  AND SIMILARITY(locations.name, unmatched.name) > 0.5
+                                    GROUP BY unmatched.article_id, unmatched.position, admins.position
+                                    HAVING COUNT(*) = 1
+                                    UNION ALL
+                                    SELECT unmatched.article_id, unmatched.position, admins.position, 3,
+                                           MIN(locations.id)
+                                    FROM unmatched
+                                    JOIN admins ON admins.article_id = unmatched.article_id
+                                    JOIN locations ON locations.cc2 = admins.cc2
+                                                  AND locations.aliases @> ARRAY[unmatched.name]
+                                    GROUP BY unmatched.article_id, unmatched.position, admins.position
+                                    HAVING COUNT(*) = 1
+                                )
+                                UPDATE staging_entities SET entity_id = matches.entity_id
+                                FROM (
+                                    SELECT DISTINCT ON (article_id, position) article_id, position, entity_id
+                                    FROM candidates
+                                    ORDER BY article_id, position, admin_position, step
+                                ) AS matches
+                                WHERE staging_entities.link_table = %(locations)s
+                                  AND staging_entities.article_id = matches.article_id
+                                  AND staging_entities.position = matches.position;
+                                """, {"locations": inLocations, "countries": COUNTRY_NAMES})
+
+    # ******************************************************************************************************************
+    def _ResolveLocationsByPopulation(self, inLocations: int):
+        """
+        The set based _LocationCaseThree.  An unmatched location with several exact name matches that have a population
+        takes the one with the highest.  Does not commit.
+        :param inLocations: link_table value of the locations
+        :return: none
+        """
+
+        self._DBCursor.execute("""
+                                UPDATE staging_entities SET entity_id = matches.entity_id
+                                FROM (
+                                    SELECT name, (ARRAY_AGG(id ORDER BY population DESC))[1] AS entity_id
+                                    FROM locations
+                                    WHERE population IS NOT NULL AND name IN (
+                                        SELECT name FROM staging_entities
+                                        WHERE link_table = %(locations)s AND entity_id IS NULL)
+                                    GROUP BY name
+                                    HAVING COUNT(*) > 1
+                                ) AS matches
+                                WHERE staging_entities.link_table = %(locations)s
+                                  AND staging_entities.entity_id IS NULL
+                                  AND staging_entities.name = matches.name;
+                                """, {"locations": inLocations})
+
+    # ******************************************************************************************************************
+    def _InsertNewEntities(self, inNumber: int, inTable: str):
+        """
+        Add the names of one table that are still unmatched with a single INSERT ... SELECT, and link the article rows
+        to the new ids.  Does not commit.
+        :param inNumber: link_table value of the names
+        :param inTable: table to add them to
+        :return: none
+        """
+
+        self._DBCursor.execute(sql.SQL("""
+                                        WITH new_entities AS (
+                                            INSERT INTO {} (name)
+                                            SELECT DISTINCT name FROM staging_entities
+                                            WHERE link_table = %(number)s AND entity_id IS NULL
+                                            RETURNING id, name
+                                        )
+                                        UPDATE staging_entities SET entity_id = new_entities.id
+                                        FROM new_entities
+                                        WHERE staging_entities.link_table = %(number)s
+                                          AND staging_entities.entity_id IS NULL
+                                          AND staging_entities.name = new_entities.name;
+                                        """).format(sql.Identifier(inTable)), {"number": inNumber})
+
+    # ******************************************************************************************************************
+    def _MoveLinks(self) -> int:
+        """
+        Move the matched rows of staging_entities into the link tables with one statement per table.  Does not commit.
+        :return: number of links written
+        """
+
+        linkCount = 0
+
+        for number, (table, column) in enumerate(LINK_TABLES):
+            self._DBCursor.execute(sql.SQL("""
+                                            INSERT INTO {} (article_id, {})
+                                            SELECT article_id, entity_id FROM staging_entities
+                                            WHERE link_table = %s AND entity_id IS NOT NULL;
+                                            """).format(sql.Identifier(table), sql.Identifier(column)), (number,))
+            linkCount += self._DBCursor.rowcount
+
+        return linkCount
 
     # ******************************************************************************************************************
     def _LocationCaseTwo(self, inArticleID: int, inLocation: str, inAdminList: List[Tuple]) -> bool:
@@ -720,10 +1418,7 @@ class DBWriter(multiprocessing.Process):
 
                 # Check aliases
                 # Second check: Look in the aliases column
-                nameString = inLocation.replace("'", "''").replace('"', '\\"')
-                sqlString = "SELECT id FROM locations WHERE aliases @> '{%s}'" % nameString
-                sqlString = sqlString + " AND cc2 = %s;"
-                self._DBCursor.execute(sqlString, (tempAdmin[1],))
+                self._DBCursor.execute(self._AliasQuery("locations", ["id"], ["cc2"]), (inLocation, tempAdmin[1]))
                 self._DBConnection.commit()
 
                 if self._DBCursor.rowcount == 1:
@@ -773,6 +1468,35 @@ class DBWriter(multiprocessing.Process):
         # If we got here, we didn't find any matches.
         return False
 
+    # ******************************************************************************************************************
+    def _GazetteerMatches(self, inLocationList: list) -> dict:
+        """
+        Match an article's locations against the gazetteer snapshot, if it's turned on
+        :param inLocationList: list of locations from the article
+        :return: location name -> location id for the names the gazetteer could match
+        """
+
+        if not self._gazetteerEnabled or not inLocationList:
+            return dict()
+
+        try:
+            if self._gazetteer is None:
+                # Imported here so the writer only pulls in numpy when the gazetteer is used
+                from Gazetteer import Gazetteer
+
+                self._gazetteer = Gazetteer(self._configObject)
+                if not self._gazetteer.Load():
+                    print("DBWriter: No gazetteer snapshot, build one with --mode gazetteer.  Using the database.")
+
+            if not self._gazetteer.good:
+                return dict()
+
+            return self._gazetteer.MatchLocations(inLocationList)
+
+        except Exception as e:
+            print("Exception in DBWriter::_GazetteerMatches: {}".format(e))
+            return dict()
+
     # ******************************************************************************************************************
     def _FindCountries(self, inLocations: list) -> List[Tuple]:
         """
@@ -784,8 +1508,19 @@ class DBWriter(multiprocessing.Process):
 
         returnList = list()
 
+        # The countries table can be edited while we're running, so start over once the cache is old enough
+        if time.time() - self._countryCacheSince > COUNTRY_CACHE_SECONDS:
+            self._countryCache.clear()
+            self._countryCacheSince = time.time()
+
         try:
             for location in inLocations:
+                # Reuse what we found for this name before
+                if location in self._countryCache:
+                    if self._countryCache[location]:
+                        returnList.append(self._countryCache[location])
+                    continue
+
                 # First, Is it an exact name match?
                 self._DBCursor.execute("SELECT name, cc2 from countries where name = %s;", (location,))
                 self._DBConnection.commit()
@@ -795,13 +1530,12 @@ class DBWriter(multiprocessing.Process):
                     locationID = self._DBCursor.fetchone()
 
                     if locationID:
-                        returnList.append((locationID[0], locationID[1]))
+                        self._countryCache[location] = (locationID[0], locationID[1])
+                        returnList.append(self._countryCache[location])
                         continue
 
                 # Second check: Look in the aliases column
-                nameString = location.replace("'", "''").replace('"', '\\"')
-                sqlString = "SELECT name, cc2 FROM countries WHERE aliases @> '{%s}';" % nameString
-                self._DBCursor.execute(sqlString)
+                self._DBCursor.execute(self._AliasQuery("countries", ["name", "cc2"]), (location,))
                 self._DBConnection.commit()
 
                 if self._DBCursor.rowcount == 1:
@@ -809,7 +1543,8 @@ class DBWriter(multiprocessing.Process):
                     locationID = self._DBCursor.fetchone()
 
                     if locationID:
-                        returnList.append((locationID[0], locationID[1]))
+                        self._countryCache[location] = (locationID[0], locationID[1])
+                        returnList.append(self._countryCache[location])
                         continue
 
                 # Third check: Look for a single row that has a similarity > 0.5 (IFF there was a single result)
@@ -821,7 +1556,8 @@ class DBWriter(multiprocessing.Process):
                     locationID = self._DBCursor.fetchone()
 
                     if locationID:
-                        returnList.append((locationID[0], locationID[1]))
+                        self._countryCache[location] = (locationID[0], locationID[1])
+                        returnList.append(self._countryCache[location])
                         continue
 
                 # Fourth check.  Check similarity in the aliases column.
@@ -835,15 +1571,40 @@ class DBWriter(multiprocessing.Process):
                     locationID = self._DBCursor.fetchone()
 
                     if locationID:
-                        returnList.append((locationID[0], locationID[1]))
+                        self._countryCache[location] = (locationID[0], locationID[1])
+                        returnList.append(self._countryCache[location])
                         continue
 
+                # Not a country
+                self._countryCache[location] = None
+
         except Exception as e:
             print("Got exception in DBWriter::_FindCountries: {}".format(e))
             return list()
 
         return returnList
 
+    # ******************************************************************************************************************
+    def _AliasQuery(self, inTable: str, inColumns: List[str], inFilterColumns: List[str] = None) -> sql.Composed:
+        """
+        Builds the alias lookup query for a table.  The name is bound as a parameter (ARRAY[%s]::text[]) instead of
+        being pasted into the statement, so the statement text is the same for every name.  This lets the server cache
+        the plan, keeps names with quotes, braces or commas from breaking the query, and still uses the GIN index on
+        the aliases column.
+        :param inTable: Table to search
+        :param inColumns: Columns to return
+        :param inFilterColumns: Optional extra columns that must equal a bound parameter (ie, cc2)
+        :return: sql.Composed query.  Parameters are the name followed by one value per filter column.
+        """
+
+        query = sql.SQL("SELECT {} FROM {} WHERE aliases @> ARRAY[%s]::text[]").format(
+                sql.SQL(", ").join(sql.Identifier(column) for column in inColumns), sql.Identifier(inTable))
+
+        for column in inFilterColumns or list():
+            query = query + sql.SQL(" AND {} = %s").format(sql.Identifier(column))
+
+        return query + sql.SQL(";")
+
     # ******************************************************************************************************************
     def _GetUniqueCommon(self, inName: str, inTable: str) -> int:
         """
@@ -854,6 +1615,26 @@ class DBWriter(multiprocessing.Process):
         :return: ID of the found name, -1 otherwise
         """
 
+        # While collecting links (reprocessing a batch) the same names come up over and over
+        if self._linkBuffer is not None and (inTable, inName) in self._uniqueCache:
+            return self._uniqueCache[(inTable, inName)]
+
+        entityID = self._FindUniqueCommon(inName, inTable)
+
+        if self._linkBuffer is not None and entityID != -1:
+            self._uniqueCache[(inTable, inName)] = entityID
+
+        return entityID
+
+    # ******************************************************************************************************************
+    def _FindUniqueCommon(self, inName: str, inTable: str) -> int:
+        """
+        The database side of _GetUniqueCommon.
+        :param inName: Input name to search for
+        :param inTable: Input table name for the query
+        :return: ID of the found name, -1 otherwise
+        """
+
         try:
             # First check for exact matches
             self._DBCursor.execute(sql.SQL("SELECT id FROM {} WHERE name = %s;").format(sql.Identifier(inTable)),
@@ -867,13 +1648,8 @@ class DBWriter(multiprocessing.Process):
                 if locationID:
                     return int(locationID[0])
 
-            # Second check: look in the aliases column for an exact match unless it's locations
-            # Create the SQL string.  We're trying to shoehorn a string here so need to do it twice because psycopg2
-            # sql module does not like having @> in a string.
-            nameString = inName.replace("'", "''").replace('"', '\\"')
-            sqlString = "SELECT id FROM {} ".format(inTable)
-            sqlString = sqlString + "WHERE aliases @> '{%s}';" % nameString
-            self._DBCursor.execute(sqlString)
+            # Second check: look in the aliases column for an exact match
+            self._DBCursor.execute(self._AliasQuery(inTable, ["id"]), (inName,))
             self._DBConnection.commit()
 
             if self._DBCursor.rowcount == 1:
@@ -907,7 +1683,7 @@ class DBWriter(multiprocessing.Process):
                 if locationID:
                     return int(locationID[0])
         except Exception as e:
-            print("Exception in DBWriter::_GetUniqueCommon: {}".format(e))
+            print("Exception in DBWriter::_FindUniqueCommon: {}".format(e))
             return -1
 
         # if we made it here we didn't find anything
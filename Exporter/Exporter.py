@@ -0,0 +1,322 @@
+# coding=utf-8
+
+"""
+Exporter.py
+Describes the class that exports the articles, their entities and their locations to Parquet (or Arrow) files, so
+analysis can be done on the files instead of against the production database.
+"""
+
+import configparser
+import itertools
+import json
+import os
+import time
+from typing import List, Tuple
+import psycopg2
+from psycopg2 import sql
+from DBWriter.DBWriter import ArticleTextSQL, ENTITY_TABLES, LINK_TABLES
+
+# Entity type written for each entity table
+ENTITY_TYPES = {"people": "person", "locations": "location", "facilities": "facility", "organizations": "organization",
+                "event": "event"}
+
+
+class Exporter(object):
+    """
+    This class streams news_articles out in id order with a server-side cursor, and for each chunk of article ids writes
+    one file to each of the articles, entities and locations datasets.  The files are partitioned into directories by
+    article id, and the id of the last article exported is saved with them, so each run only exports the articles that
+    have been added since the last one.  Ids are handed out before the articles are committed, so a lower id can turn up
+    after a higher one was exported.  Each run starts SafetyLag ids back to catch those, and because a file always
+    covers the same ids, exporting it again replaces it.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        # DB Parameters
+        self._DBHost = str()
+        self._DBPort = str()
+        self._DBUser = str()
+        self._DBPassword = str()
+        self._DBTable = str()
+        self._separateText = False
+
+        # Export parameters
+        self._exportPath = "exports"
+        self._format = "parquet"
+        self._compression = "zstd"
+        self._chunkSize = 10000
+        self._partitionSize = 1000000
+        self._safetyLag = 10000
+        self._includeText = False
+
+        # Read the configuration
+        if not self._ReadConfiguration(inConfigObject):
+            self.good = False
+            return
+
+        # pyarrow is only needed for exporting, so don't make it a hard requirement for the rest of the program
+        try:
+            import pyarrow
+
+        except ImportError:
+            print("Exporter: Exporting needs the pyarrow package")
+            self.good = False
+            return
+
+        self._schemas = {"articles": pyarrow.schema([("article_id", pyarrow.int64()),
+                                                     ("title", pyarrow.string()),
+                                                     ("url", pyarrow.string()),
+                                                     ("website", pyarrow.string())] +
+                                                    ([("article_text", pyarrow.string())] if self._includeText
+                                                     else list())),
+                         "entities": pyarrow.schema([("article_id", pyarrow.int64()),
+                                                     ("entity_type", pyarrow.string()),
+                                                     ("entity_id", pyarrow.int64()),
+                                                     ("name", pyarrow.string())]),
+                         "locations": pyarrow.schema([("article_id", pyarrow.int64()),
+                                                      ("location_id", pyarrow.int64()),
+                                                      ("name", pyarrow.string()),
+                                                      ("cc2", pyarrow.string()),
+                                                      ("longitude", pyarrow.float64()),
+                                                      ("latitude", pyarrow.float64())])}
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser) -> bool:
+        """
+        Use the passed-in ConfigParser object to set ourselves up
+        :return: True if OK, False otherwise
+        """
+
+        try:
+            # Get the top level
+            DB = inConfigObject["DB"]
+
+            # Now set our member variables
+            self._DBHost = DB["DBHost"]
+            self._DBPort = DB["DBPort"]
+            self._DBUser = DB["DBUser"]
+            self._DBPassword = DB["DBPassword"]
+            self._DBTable = DB["DBTable"]
+            self._separateText = DB.getboolean("SeparateArticleText", self._separateText)
+
+            # The EXPORT section is optional, use the defaults if it is not there
+            if inConfigObject.has_section("EXPORT"):
+                EXPORT = inConfigObject["EXPORT"]
+
+                self._exportPath = EXPORT.get("Path", self._exportPath)
+                self._format = EXPORT.get("Format", self._format).lower()
+                self._compression = EXPORT.get("Compression", self._compression)
+                self._chunkSize = EXPORT.getint("ChunkSize", self._chunkSize)
+                self._partitionSize = EXPORT.getint("PartitionSize", self._partitionSize)
+                self._safetyLag = EXPORT.getint("SafetyLag", self._safetyLag)
+                self._includeText = EXPORT.getboolean("IncludeText", self._includeText)
+
+            if self._format not in ("parquet", "arrow"):
+                print("Exporter: Unknown format {}, use parquet or arrow".format(self._format))
+                return False
+
+            # Relative paths are relative to the program directory
+            self._exportPath = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                            self._exportPath)
+
+            return True
+
+        except Exception as e:
+            print("Exception in Exporter::_ReadConfiguration: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def Run(self):
+        """
+        Export every article after the last one exported, and the ones in the safety lag before it
+        :return: Nothing
+        """
+
+        if not self.good:
+            return
+
+        lastArticleID = self._ReadCheckpoint()
+
+        # Start at the beginning of a file, so the file is written again whole
+        startID = self._FileStart(max(lastArticleID - self._safetyLag, 0))
+        if lastArticleID:
+            print("Exporter: Exporting the articles from {}, the last export got to {}".format(startID, lastArticleID))
+
+        try:
+            DBConnection = psycopg2.connect(host=self._DBHost,
+                                            port=self._DBPort,
+                                            dbname=self._DBTable,
+                                            user=self._DBUser,
+                                            password=self._DBPassword)
+
+            # Nothing here writes, and a read only transaction lets a standby serve the export
+            DBConnection.set_session(readonly=True)
+
+            cursor = DBConnection.cursor(name="export_articles")
+            cursor.itersize = self._chunkSize
+            if self._includeText:
+                textColumn, textJoin = ArticleTextSQL(self._separateText)
+                cursor.execute(sql.SQL("SELECT news_articles.id, article_title, article_url, website, {} "
+                                       "FROM news_articles {} WHERE news_articles.id >= %s "
+                                       "ORDER BY news_articles.id;").format(textColumn, textJoin), (startID,))
+            else:
+                cursor.execute("SELECT id, article_title, article_url, website FROM news_articles WHERE id >= %s "
+                               "ORDER BY id;", (startID,))
+
+            linkCursor = DBConnection.cursor()
+
+            articleCount = 0
+            startTime = time.time()
+
+            for fileStart, fileRows in itertools.groupby(cursor, key=lambda row: self._FileStart(row[0])):
+                rows = list(fileRows)
+
+                self._ExportChunk(linkCursor, fileStart, rows)
+
+                lastArticleID = max(lastArticleID, rows[-1][0])
+                self._WriteCheckpoint(lastArticleID)
+
+                articleCount += len(rows)
+                elapsed = max(time.time() - startTime, 1e-6)
+                print("Exporter: {} articles, up to id {} ({:.0f} articles/second)".format(
+                    articleCount, lastArticleID, articleCount / elapsed))
+
+            # clean up
+            linkCursor.close()
+            cursor.close()
+            DBConnection.close()
+
+        except Exception as e:
+            print("Exception in Exporter::Run: {}".format(e))
+
+    # ******************************************************************************************************************
+    def _FileStart(self, inArticleID: int) -> int:
+        """
+        Find the file an article goes in.  A file covers ChunkSize ids, and is split where a partition starts.
+        :param inArticleID: article id
+        :return: first id the file covers
+        """
+
+        return max(inArticleID // self._chunkSize * self._chunkSize,
+                   inArticleID // self._partitionSize * self._partitionSize)
+
+    # ******************************************************************************************************************
+    def _ExportChunk(self, inCursor, inFileStart: int, inRows: List[Tuple]):
+        """
+        Write the files for a chunk of articles
+        :param inCursor: cursor for reading the links
+        :param inFileStart: first id the files cover, from _FileStart
+        :param inRows: rows from news_articles, in id order
+        :return: Nothing
+        """
+
+        firstID = inRows[0][0]
+        lastID = inRows[-1][0]
+
+        self._WriteFile("articles", inFileStart, inRows)
+
+        # Every kind of entity, by way of its link table
+        inCursor.execute(sql.SQL(" UNION ALL ").join(
+                         sql.SQL("SELECT links.article_id, {type}, entities.id, entities.name FROM {links} AS links "
+                                 "JOIN {entities} AS entities ON entities.id = links.{column} "
+                                 "WHERE links.article_id BETWEEN %(first)s AND %(last)s").format(
+                             type=sql.Literal(ENTITY_TYPES[entityTable]), links=sql.Identifier(linkTable),
+                             entities=sql.Identifier(entityTable), column=sql.Identifier(column))
+                         for (linkTable, column), entityTable in zip(LINK_TABLES, ENTITY_TABLES)),
+                         {"first": firstID, "last": lastID})
+        self._WriteFile("entities", inFileStart, inCursor.fetchall())
+
+        # The resolved locations with their coordinates
+        inCursor.execute("""
+                         SELECT article_locations.article_id, locations.id, locations.name, locations.cc2,
+                         ST_X(locations.the_geom), ST_Y(locations.the_geom)
+                         FROM article_locations JOIN locations ON locations.id = article_locations.location_id
+                         WHERE article_locations.article_id BETWEEN %s AND %s;
+                         """, (firstID, lastID))
+        self._WriteFile("locations", inFileStart, inCursor.fetchall())
+
+    # ******************************************************************************************************************
+    def _WriteFile(self, inDataset: str, inFileStart: int, inRows: List[Tuple]):
+        """
+        Write the rows of a chunk to a file in the dataset.  The file is named after the first id it covers, so a chunk
+        that is exported again (after a crash, or in the safety lag) replaces its old file instead of adding to it.
+        :param inDataset: articles, entities or locations
+        :param inFileStart: first id the file covers, from _FileStart
+        :param inRows: rows in the order of the dataset's schema
+        :return: Nothing
+        """
+
+        import pyarrow
+
+        schema = self._schemas[inDataset]
+        table = pyarrow.Table.from_arrays([pyarrow.array([row[index] for row in inRows], type=field.type)
+                                           for index, field in enumerate(schema)], schema=schema)
+
+        directory = os.path.join(self._exportPath, inDataset,
+                                 "article_partition={}".format(inFileStart // self._partitionSize))
+        os.makedirs(directory, exist_ok=True)
+
+        # Readers skip files starting with _, so they never see one that's half written
+        fileName = os.path.join(directory, "part-{:012d}.{}".format(inFileStart, self._format))
+        tempName = os.path.join(directory, "_part-{:012d}.{}.tmp".format(inFileStart, self._format))
+
+        if self._format == "parquet":
+            import pyarrow.parquet
+
+            pyarrow.parquet.write_table(table, tempName, compression=self._compression)
+        else:
+            import pyarrow.feather
+
+            pyarrow.feather.write_feather(table, tempName, compression=self._compression)
+
+        os.replace(tempName, fileName)
+
+    # ******************************************************************************************************************
+    def _ReadCheckpoint(self) -> int:
+        """
+        Read the id of the last article that was exported
+        :return: article id, 0 if nothing has been exported yet
+        """
+
+        try:
+            checkpointPath = os.path.join(self._exportPath, "_checkpoint.json")
+            if not os.path.exists(checkpointPath):
+                return 0
+
+            with open(checkpointPath) as checkpointFile:
+                return int(json.load(checkpointFile)["lastArticleID"])
+
+        except Exception as e:
+            print("Exception in Exporter::_ReadCheckpoint: {}".format(e))
+            return 0
+
+    # ******************************************************************************************************************
+    def _WriteCheckpoint(self, inArticleID: int):
+        """
+        Save the id of the last article that was exported.  Written to a temporary file first so a crash can't leave a
+        half written checkpoint.
+        :param inArticleID: article id
+        :return: Nothing
+        """
+
+        try:
+            checkpointPath = os.path.join(self._exportPath, "_checkpoint.json")
+            tempPath = checkpointPath + ".tmp"
+
+            with open(tempPath, "w") as checkpointFile:
+                json.dump({"lastArticleID": inArticleID}, checkpointFile)
+
+            os.replace(tempPath, checkpointPath)
+
+        except Exception as e:
+            print("Exception in Exporter::_WriteCheckpoint: {}".format(e))
@@ -0,0 +1 @@
+from .Exporter import Exporter
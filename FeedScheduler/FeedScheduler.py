@@ -0,0 +1,444 @@
+# coding=utf-8
+
+"""
+FeedScheduler.py
+Describes the class that runs the daemon mode.  It keeps one website object per subscription alive between polls and
+polls each subscription on its own interval.  Optionally the interval adapts to how often the feed actually publishes.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+import heapq
+import multiprocessing
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+import psycopg2
+from LeaseManager import LeaseManager
+import websites
+
+
+class FeedScheduler(object):
+    """
+    This class is responsible for deciding when each subscription is due and running ProcessFeed for it.  The website
+    objects (and with them the Spacy model, DB connections and problem entities) are created once and reused, so we
+    only pay the startup cost once instead of on every cron run.  The feeds are polled on a thread pool, so downloads
+    overlap, but the website objects share the model and run it under its lock one article at a time.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inQueue: multiprocessing.Queue, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inQueue: multiprocessing.Queue object the website objects push to
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        if not inQueue:
+            self.good = False
+
+            # Don't bother running if we don't have a Queue object passed in
+            return
+
+        self._queue = inQueue
+        self._configObject = inConfigObject
+
+        # DB Parameters
+        self._DBHost = str()
+        self._DBPort = str()
+        self._DBUser = str()
+        self._DBPassword = str()
+        self._DBTable = str()
+
+        # DB Objects.  The cursor is shared between the main loop and the feed threads, so use it under the lock.
+        self._DBConnection = None
+        self._DBCursor = None
+        self._DBLock = threading.Lock()
+
+        # Daemon parameters
+        self._defaultInterval = 900
+        self._jitter = 0.1
+        self._maxConcurrentFeeds = 2
+        self._refreshInterval = 3600
+
+        # Adaptive interval parameters
+        self._adaptiveIntervals = False
+        self._minInterval = 120
+        self._maxInterval = 14400
+        self._targetNewEntries = 3.0
+        self._smoothing = 0.3
+
+        # Subscriptions we know about, keyed by URL.  Values are dicts with the classname, interval, minInterval and
+        # maxInterval (all in seconds).
+        self._subscriptions = dict()  # type: Dict[str, dict]
+
+        # Per feed statistics for the adaptive intervals, keyed by URL.  The publish rate is in entries per second.
+        self._publishRates = dict()  # type: Dict[str, float]
+        self._lastPollTimes = dict()  # type: Dict[str, float]
+
+        # Website objects we have created, keyed by URL
+        self._websites = dict()
+
+        # Heap of (due time, url)
+        self._schedule = list()
+
+        # URLs currently being processed
+        self._inFlight = set()
+        self._inFlightLock = threading.Lock()
+
+        # Set when we've been asked to shut down
+        self._stopEvent = threading.Event()
+
+        # When sharding, a feed is only polled if we can get the lease on it
+        self._sharded = False
+        self._leaseManager = None
+
+        # Read the configuration
+        if not self._ReadConfiguration(inConfigObject):
+            self.good = False
+            return
+
+        if self._sharded:
+            self._leaseManager = LeaseManager(inConfigObject)
+            if not self._leaseManager.good:
+                self.good = False
+                return
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser) -> bool:
+        """
+        Use the passed-in ConfigParser object to set ourselves up
+        :return: True if OK, False otherwise
+        """
+
+        try:
+            # Get the top level
+            DB = inConfigObject["DB"]
+
+            # Now set our member variables
+            self._DBHost = DB["DBHost"]
+            self._DBPort = DB["DBPort"]
+            self._DBUser = DB["DBUser"]
+            self._DBPassword = DB["DBPassword"]
+            self._DBTable = DB["DBTable"]
+
+            # The DAEMON section is optional, use the defaults if it is not there
+            if inConfigObject.has_section("DAEMON"):
+                DAEMON = inConfigObject["DAEMON"]
+
+                self._defaultInterval = DAEMON.getint("DefaultInterval", self._defaultInterval)
+                self._jitter = DAEMON.getfloat("Jitter", self._jitter)
+                self._maxConcurrentFeeds = DAEMON.getint("MaxConcurrentFeeds", self._maxConcurrentFeeds)
+                self._refreshInterval = DAEMON.getint("RefreshInterval", self._refreshInterval)
+                self._adaptiveIntervals = DAEMON.getboolean("AdaptiveIntervals", self._adaptiveIntervals)
+                self._minInterval = DAEMON.getint("MinInterval", self._minInterval)
+                self._maxInterval = DAEMON.getint("MaxInterval", self._maxInterval)
+                self._targetNewEntries = DAEMON.getfloat("TargetNewEntries", self._targetNewEntries)
+                self._smoothing = DAEMON.getfloat("Smoothing", self._smoothing)
+
+            if inConfigObject.has_section("SHARDING"):
+                self._sharded = inConfigObject["SHARDING"].getboolean("Enabled", self._sharded)
+
+            return True
+
+        except Exception as e:
+            print("Exception in FeedScheduler::_ReadConfiguration: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def Stop(self):
+        """
+        Ask the scheduler to shut down.  Feeds already being processed are allowed to finish.  Safe to call from a
+        signal handler.
+        :return: Nothing
+        """
+
+        self._stopEvent.set()
+
+    # ******************************************************************************************************************
+    def Run(self):
+        """
+        Main loop.  Runs until Stop is called, then waits for any feeds in progress before returning.
+        :return: Nothing
+        """
+
+        if not self.good:
+            return
+
+        nextRefresh = 0.0
+
+        with ThreadPoolExecutor(max_workers=self._maxConcurrentFeeds) as executor:
+            while not self._stopEvent.is_set():
+                now = time.time()
+
+                # Pick up any new or changed subscriptions
+                if now >= nextRefresh:
+                    self._RefreshSubscriptions()
+                    nextRefresh = now + self._refreshInterval
+
+                # Start everything that is due, up to the concurrency cap.  The workers reschedule their feeds under
+                # the same lock, so the schedule is only looked at while holding it.
+                while True:
+                    with self._inFlightLock:
+                        if not self._schedule or self._schedule[0][0] > now:
+                            break
+
+                        if len(self._inFlight) >= self._maxConcurrentFeeds:
+                            break
+
+                        dueTime, url = heapq.heappop(self._schedule)
+
+                        # Dropped from the subscriptions table since it was scheduled
+                        if url not in self._subscriptions or url in self._inFlight:
+                            continue
+
+                        self._inFlight.add(url)
+
+                    executor.submit(self._PollFeed, url)
+
+                # Sleep until the next feed is due, but wake up regularly so we notice Stop and finished feeds
+                with self._inFlightLock:
+                    nextDue = self._schedule[0][0] if self._schedule else None
+
+                waitTime = 1.0
+                if nextDue is not None:
+                    waitTime = min(max(nextDue - time.time(), 0.1), 1.0)
+
+                self._stopEvent.wait(waitTime)
+
+            print("FeedScheduler: Shutting down, waiting for {} feed(s) to finish...".format(len(self._inFlight)))
+
+    # ******************************************************************************************************************
+    def _PollFeed(self, inURL: str):
+        """
+        Runs in the thread pool.  Processes the feed and schedules the next poll.
+        :param inURL: URL of the subscription to poll
+        :return: Nothing
+        """
+
+        claimed = False
+
+        try:
+            classname = self._subscriptions[inURL]["classname"]
+
+            # Another instance may have polled it already.  Allow for the jitter when deciding if it's due.
+            if self._leaseManager:
+                minimumAge = self._subscriptions[inURL]["interval"] * (1.0 - self._jitter)
+                if not self._leaseManager.Claim(inURL, minimumAge):
+                    return
+
+                claimed = True
+
+            websiteObject = self._websites.get(inURL)
+            if websiteObject is None or not websiteObject.good:
+                websiteObject = websites.WebsiteFactory((inURL, classname), self._queue, self._configObject)
+                self._websites[inURL] = websiteObject
+
+            websiteObject.ProcessFeed()
+
+            if self._adaptiveIntervals:
+                self._AdaptInterval(inURL, websiteObject)
+
+        except Exception as e:
+            print("Exception in FeedScheduler::_PollFeed for {}: {}".format(inURL, e))
+
+        finally:
+            if claimed:
+                self._leaseManager.Release([inURL])
+
+            with self._inFlightLock:
+                self._inFlight.discard(inURL)
+
+                if inURL in self._subscriptions and not self._stopEvent.is_set():
+                    heapq.heappush(self._schedule, (self._NextPollTime(inURL), inURL))
+
+    # ******************************************************************************************************************
+    def _NextPollTime(self, inURL: str) -> float:
+        """
+        Work out when to poll the subscription next.  The jitter keeps feeds with the same interval from all firing at
+        the same moment.
+        :param inURL: URL of the subscription
+        :return: time.time() value of the next poll
+        """
+
+        interval = self._subscriptions[inURL]["interval"]
+
+        return time.time() + interval * (1.0 + random.uniform(-self._jitter, self._jitter))
+
+    # ******************************************************************************************************************
+    def _AdaptInterval(self, inURL: str, inWebsiteObject):
+        """
+        Update the polling interval for a feed from what we saw on this poll.  The publish rate comes from the entry
+        timestamps in the feed when it has them, otherwise from the number of new entries since the last poll.  It is
+        smoothed so one odd poll doesn't swing the interval, and the interval is picked so that a poll finds about
+        TargetNewEntries new entries, within the subscription's bounds.
+        :param inURL: URL of the subscription
+        :param inWebsiteObject: website object that just processed the feed
+        :return: Nothing
+        """
+
+        try:
+            now = time.time()
+            subscription = self._subscriptions[inURL]
+
+            # Entries in the feed over the time from the oldest one until now.  Measuring to now rather than to the
+            # newest entry makes a feed that has gone quiet look quiet.
+            observedRate = None
+            entryTimes = inWebsiteObject.lastEntryTimes
+            if entryTimes and now > min(entryTimes):
+                observedRate = len(entryTimes) / (now - min(entryTimes))
+            elif inURL in self._lastPollTimes and now > self._lastPollTimes[inURL]:
+                observedRate = inWebsiteObject.lastNewEntries / (now - self._lastPollTimes[inURL])
+
+            self._lastPollTimes[inURL] = now
+
+            if observedRate is None:
+                return
+
+            if inURL in self._publishRates:
+                observedRate = self._smoothing * observedRate + (1.0 - self._smoothing) * self._publishRates[inURL]
+
+            self._publishRates[inURL] = observedRate
+
+            if observedRate > 0:
+                newInterval = self._targetNewEntries / observedRate
+            else:
+                newInterval = subscription["maxInterval"]
+
+            newInterval = int(min(max(newInterval, subscription["minInterval"]), subscription["maxInterval"]))
+
+            # Don't bother the database over small changes
+            if abs(newInterval - subscription["interval"]) < 0.1 * subscription["interval"]:
+                return
+
+            print("FeedScheduler: Polling {} every {} seconds (was {})".format(inURL, newInterval,
+                                                                            subscription["interval"]))
+            subscription["interval"] = newInterval
+
+            self._SaveInterval(inURL, newInterval)
+
+        except Exception as e:
+            print("Exception in FeedScheduler::_AdaptInterval for {}: {}".format(inURL, e))
+
+    # ******************************************************************************************************************
+    def _SaveInterval(self, inURL: str, inInterval: int):
+        """
+        Store the polling interval in the subscriptions table so it survives a restart
+        :param inURL: URL of the subscription
+        :param inInterval: interval in seconds
+        :return: Nothing
+        """
+
+        with self._DBLock:
+            try:
+                if not self._DBConnection and not self._CreateDBObjects():
+                    return
+
+                self._DBCursor.execute("UPDATE subscriptions SET poll_interval = %s WHERE url = %s;",
+                                       (inInterval, inURL))
+                self._DBConnection.commit()
+
+            except Exception as e:
+                print("Exception in FeedScheduler::_SaveInterval: {}".format(e))
+                self._CreateDBObjects()
+
+    # ******************************************************************************************************************
+    def _RefreshSubscriptions(self):
+        """
+        Re-read the subscriptions table.  New subscriptions are scheduled right away (with jitter), removed ones are
+        dropped once they're out of the schedule.
+        :return: Nothing
+        """
+
+        subscriptionList = self._GetSubscriptions()
+        if not subscriptionList:
+            return
+
+        # Leave out the subscriptions whose website class can't be loaded
+        errors = websites.ValidateWebsiteClasses([subscription[1] for subscription in subscriptionList])
+        for classname, error in sorted(errors.items()):
+            print("FeedScheduler: Skipping the subscriptions using {}: {}".format(classname, error))
+
+        with self._inFlightLock:
+            newSubscriptions = dict()
+
+            for url, classname, interval, minInterval, maxInterval in subscriptionList:
+                if classname in errors:
+                    continue
+
+                newSubscriptions[url] = {"classname": classname,
+                                         "interval": interval or self._defaultInterval,
+                                         "minInterval": minInterval or self._minInterval,
+                                         "maxInterval": maxInterval or self._maxInterval}
+
+            for url in newSubscriptions:
+                if url not in self._subscriptions:
+                    heapq.heappush(self._schedule, (time.time() + random.uniform(0, self._jitter * 60), url))
+
+            # Let go of the website objects for subscriptions that have been removed
+            for url in list(self._websites):
+                if url not in newSubscriptions and url not in self._inFlight:
+                    del self._websites[url]
+
+            self._subscriptions = newSubscriptions
+
+    # ******************************************************************************************************************
+    def _GetSubscriptions(self) -> List[Tuple]:
+        """
+        Gets the list of subscriptions and their polling intervals from the database
+        :return: List of (url, classname, poll_interval, min_interval, max_interval) tuples
+        """
+
+        with self._DBLock:
+            try:
+                if not self._DBConnection and not self._CreateDBObjects():
+                    return list()
+
+                self._DBCursor.execute("""
+                                        SELECT url, classname, poll_interval, min_interval, max_interval
+                                        FROM subscriptions;
+                                        """)
+                self._DBConnection.commit()
+
+                return self._DBCursor.fetchall()
+
+            except Exception as e:
+                print("Exception in FeedScheduler::_GetSubscriptions: {}".format(e))
+                self._CreateDBObjects()
+                return list()
+
+    # ******************************************************************************************************************
+    def _CreateDBObjects(self) -> bool:
+        """
+        Create (or re-create after an error) the psycopg2 connection and cursor.  Call with the DB lock held.
+        :return: True if successful, False otherwise
+        """
+
+        try:
+            if self._DBCursor:
+                self._DBCursor.close()
+            if self._DBConnection:
+                self._DBConnection.close()
+        except Exception as e:
+            print("Exception in FeedScheduler::_CreateDBObjects closing the old connection: {}".format(e))
+
+        try:
+            self._DBConnection = psycopg2.connect(host=self._DBHost,
+                                                  port=self._DBPort,
+                                                  dbname=self._DBTable,
+                                                  user=self._DBUser,
+                                                  password=self._DBPassword)
+            self._DBCursor = self._DBConnection.cursor()
+
+            return True
+
+        except Exception as e:
+            print("Exception in FeedScheduler::_CreateDBObjects: {}".format(e))
+            self._DBConnection = None
+            self._DBCursor = None
+            return False
@@ -0,0 +1 @@
+from .FeedScheduler import FeedScheduler
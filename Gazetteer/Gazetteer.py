@@ -0,0 +1,593 @@
+# coding=utf-8
+
+"""
+Gazetteer.py
+Describes the class that keeps a snapshot of the locations and countries tables in NumPy arrays, so the DB writer can
+resolve all of the locations in an article at once without a query for each name.
+"""
+
+import configparser
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Tuple
+import numpy
+import psycopg2
+
+# The arrays in a snapshot, each saved as <name>.npy
+LOCATION_ARRAYS = ["location_ids", "cc2", "population", "latitude", "longitude"]
+INDEX_ARRAYS = ["name_hashes", "name_rows", "alias_hashes", "alias_rows", "country_name_hashes", "country_name_rows",
+                "country_alias_hashes", "country_alias_rows", "country_names", "country_cc2"]
+
+# Mean radius of the earth, for the distances in ScoreLocations
+EARTH_RADIUS_KILOMETRES = 6371.0
+
+# Population whose score is 1, anything larger is capped there
+FULL_POPULATION = 10000000
+
+# Most candidate pairs ScoreLocations works on at once.  The distances are done a block of rows at a time, so an article
+# with thousands of candidates doesn't need matrices of hundreds of MB.
+PROXIMITY_BLOCK_PAIRS = 1 << 18
+
+
+# **********************************************************************************************************************
+def NameHashes(inNames: List[str]) -> numpy.ndarray:
+    """
+    64 bit hashes of names, the keys of the name indexes.  Python's own hash changes between runs, so this uses blake2b.
+    :param inNames: names
+    :return: uint64 array, one hash per name
+    """
+
+    return numpy.array([int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+                        for name in inNames], dtype=numpy.uint64)
+
+
+# **********************************************************************************************************************
+def _SortedIndex(inHashes: List[numpy.ndarray], inRows: List[numpy.ndarray]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Put a name index together from the chunks it was built in
+    :param inHashes: name hash arrays
+    :param inRows: row arrays, the row each hash belongs to
+    :return: (hashes, rows) sorted on the hashes
+    """
+
+    hashes = numpy.concatenate(inHashes) if inHashes else numpy.zeros(0, dtype=numpy.uint64)
+    rows = numpy.concatenate(inRows) if inRows else numpy.zeros(0, dtype=numpy.int32)
+
+    order = numpy.argsort(hashes, kind="stable")
+
+    return hashes[order], rows[order]
+
+
+class Gazetteer(object):
+    """
+    A snapshot of the locations (id, country code, population and coordinates) in parallel arrays, with sorted indexes
+    from the hash of each name and alias to the rows that have it, and the same for the countries.  The snapshot is
+    built from the database with Build and saved as .npy files that Load memory maps, so every process using it shares
+    one copy through the page cache and only the parts that are looked at are read in.
+
+    ResolveLocations goes through the same steps as DBWriter's location matching, for all of an article's locations in
+    a handful of array operations.  The similarity checks are left to the database, along with the names the snapshot
+    has no exact or alias match for and anything added to the locations table since the snapshot was built.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        # DB Parameters
+        self._DBHost = str()
+        self._DBPort = str()
+        self._DBUser = str()
+        self._DBPassword = str()
+        self._DBTable = str()
+
+        # Gazetteer parameters
+        self._path = "gazetteer"
+        self._chunkSize = 50000
+        self._matching = "cascade"
+
+        # ScoreLocations weights
+        self._countryWeight = 2.0
+        self._populationWeight = 1.0
+        self._proximityWeight = 2.0
+        self._aliasPenalty = 0.5
+        self._proximityKilometres = 250.0
+        self._maxCandidates = 50
+
+        # The snapshot, as array name -> array, once loaded
+        self._arrays = dict()
+
+        # Read the configuration
+        if not self._ReadConfiguration(inConfigObject):
+            self.good = False
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser) -> bool:
+        """
+        Use the passed-in ConfigParser object to set ourselves up
+        :return: True if OK, False otherwise
+        """
+
+        try:
+            # Get the top level
+            DB = inConfigObject["DB"]
+
+            # Now set our member variables
+            self._DBHost = DB["DBHost"]
+            self._DBPort = DB["DBPort"]
+            self._DBUser = DB["DBUser"]
+            self._DBPassword = DB["DBPassword"]
+            self._DBTable = DB["DBTable"]
+
+            # The GAZETTEER section is optional, use the defaults if it is not there
+            if inConfigObject.has_section("GAZETTEER"):
+                GAZETTEER = inConfigObject["GAZETTEER"]
+
+                self._path = GAZETTEER.get("Path", self._path)
+                self._chunkSize = GAZETTEER.getint("ChunkSize", self._chunkSize)
+                self._matching = GAZETTEER.get("Matching", self._matching).lower()
+                self._countryWeight = GAZETTEER.getfloat("CountryWeight", self._countryWeight)
+                self._populationWeight = GAZETTEER.getfloat("PopulationWeight", self._populationWeight)
+                self._proximityWeight = GAZETTEER.getfloat("ProximityWeight", self._proximityWeight)
+                self._aliasPenalty = GAZETTEER.getfloat("AliasPenalty", self._aliasPenalty)
+                self._proximityKilometres = GAZETTEER.getfloat("ProximityKilometres", self._proximityKilometres)
+                self._maxCandidates = GAZETTEER.getint("MaxCandidates", self._maxCandidates)
+
+            if self._matching not in ("cascade", "scored"):
+                print("Gazetteer: Unknown matching {}, use cascade or scored".format(self._matching))
+                return False
+
+            # Relative paths are relative to the program directory
+            self._path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), self._path)
+
+            return True
+
+        except Exception as e:
+            print("Exception in Gazetteer::_ReadConfiguration: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def Build(self) -> bool:
+        """
+        Build a new snapshot from the database.  It is written next to the old one and swapped in when it is complete,
+        so processes that already have the old one loaded carry on using it.
+        :return: True if the snapshot was written
+        """
+
+        if not self.good:
+            return False
+
+        startTime = time.time()
+        buildPath = self._path + ".building"
+
+        try:
+            DBConnection = psycopg2.connect(host=self._DBHost,
+                                            port=self._DBPort,
+                                            dbname=self._DBTable,
+                                            user=self._DBUser,
+                                            password=self._DBPassword)
+            DBConnection.set_session(readonly=True)
+
+            arrays = self._ReadLocations(DBConnection)
+            arrays.update(self._ReadCountries(DBConnection))
+
+            DBConnection.close()
+
+            if os.path.exists(buildPath):
+                shutil.rmtree(buildPath)
+            os.makedirs(buildPath)
+
+            for name, array in arrays.items():
+                numpy.save(os.path.join(buildPath, name + ".npy"), array)
+
+            with open(os.path.join(buildPath, "meta.json"), "w") as metaFile:
+                json.dump({"built": time.time(), "locations": int(arrays["location_ids"].size),
+                           "countries": int(arrays["country_cc2"].size)}, metaFile)
+
+            # Swap the new one in
+            oldPath = self._path + ".old"
+            if os.path.exists(oldPath):
+                shutil.rmtree(oldPath)
+            if os.path.exists(self._path):
+                os.rename(self._path, oldPath)
+            os.rename(buildPath, self._path)
+            if os.path.exists(oldPath):
+                shutil.rmtree(oldPath)
+
+            print("Gazetteer: Wrote {} locations and {} countries in {:.1f} seconds".format(
+                arrays["location_ids"].size, arrays["country_cc2"].size, time.time() - startTime))
+
+            return True
+
+        except Exception as e:
+            print("Exception in Gazetteer::Build: {}".format(e))
+            return False
+
+    # ******************************************************************************************************************
+    def _ReadLocations(self, inDBConnection) -> Dict[str, numpy.ndarray]:
+        """
+        Read the locations table into arrays, in chunks with a server-side cursor
+        :param inDBConnection: psycopg2 connection
+        :return: array name -> array
+        """
+
+        cursor = inDBConnection.cursor(name="gazetteer_locations")
+        cursor.itersize = self._chunkSize
+        cursor.execute("SELECT id, name, aliases, cc2, population, latitude, longitude FROM locations ORDER BY id;")
+
+        columns = {name: list() for name in LOCATION_ARRAYS}
+        nameHashes, nameRows, aliasHashes, aliasRows = list(), list(), list(), list()
+        rowCount = 0
+
+        while True:
+            rows = cursor.fetchmany(self._chunkSize)
+            if not rows:
+                break
+
+            locationIDs, names, aliases, cc2s, populations, latitudes, longitudes = zip(*rows)
+            rowNumbers = numpy.arange(rowCount, rowCount + len(rows), dtype=numpy.int32)
+
+            columns["location_ids"].append(numpy.array(locationIDs, dtype=numpy.int64))
+            columns["cc2"].append(numpy.array([(cc2 or str()).strip().encode("ascii", "replace") for cc2 in cc2s],
+                                              dtype="S2"))
+            columns["population"].append(numpy.array([-1 if population is None else population
+                                                      for population in populations], dtype=numpy.int64))
+            columns["latitude"].append(numpy.array(latitudes, dtype=numpy.float64))
+            columns["longitude"].append(numpy.array(longitudes, dtype=numpy.float64))
+
+            named = [index for index, name in enumerate(names) if name]
+            nameHashes.append(NameHashes([names[index] for index in named]))
+            nameRows.append(rowNumbers[named])
+
+            aliased = [(index, alias) for index, aliasList in enumerate(aliases) for alias in set(aliasList or list())
+                       if alias]
+            aliasHashes.append(NameHashes([alias for _, alias in aliased]))
+            aliasRows.append(rowNumbers[[index for index, _ in aliased]])
+
+            rowCount += len(rows)
+
+        cursor.close()
+
+        arrays = {name: numpy.concatenate(chunks) if chunks else numpy.zeros(0) for name, chunks in columns.items()}
+        arrays["name_hashes"], arrays["name_rows"] = _SortedIndex(nameHashes, nameRows)
+        arrays["alias_hashes"], arrays["alias_rows"] = _SortedIndex(aliasHashes, aliasRows)
+
+        return arrays
+
+    # ******************************************************************************************************************
+    @staticmethod
+    def _ReadCountries(inDBConnection) -> Dict[str, numpy.ndarray]:
+        """
+        Read the countries table into arrays.  It's small, so it's read in one go.
+        :param inDBConnection: psycopg2 connection
+        :return: array name -> array
+        """
+
+        cursor = inDBConnection.cursor()
+        cursor.execute("SELECT name, cc2, aliases FROM countries ORDER BY id;")
+        rows = cursor.fetchall()
+        cursor.close()
+
+        names = [name or str() for name, _, _ in rows]
+        aliased = [(index, alias) for index, (_, _, aliasList) in enumerate(rows) for alias in set(aliasList or list())
+                   if alias]
+
+        arrays = {"country_names": numpy.array(names, dtype=str),
+                  "country_cc2": numpy.array([(cc2 or str()).strip().encode("ascii", "replace") for _, cc2, _ in rows],
+                                             dtype="S2")}
+        arrays["country_name_hashes"], arrays["country_name_rows"] = _SortedIndex(
+            [NameHashes(names)], [numpy.arange(len(rows), dtype=numpy.int32)])
+        arrays["country_alias_hashes"], arrays["country_alias_rows"] = _SortedIndex(
+            [NameHashes([alias for _, alias in aliased])], [numpy.array([index for index, _ in aliased],
+                                                                        dtype=numpy.int32)])
+
+        return arrays
+
+    # ******************************************************************************************************************
+    def Load(self) -> bool:
+        """
+        Memory map the snapshot
+        :return: True if it's ready to use
+        """
+
+        if not self.good:
+            return False
+
+        try:
+            arrays = dict()
+            for name in LOCATION_ARRAYS + INDEX_ARRAYS:
+                arrays[name] = numpy.load(os.path.join(self._path, name + ".npy"), mmap_mode="r")
+
+            with open(os.path.join(self._path, "meta.json")) as metaFile:
+                meta = json.load(metaFile)
+
+            self._arrays = arrays
+
+            print("Gazetteer: Loaded {} locations built {}".format(meta["locations"],
+                                                                 time.strftime("%Y-%m-%d %H:%M",
+                                                                               time.localtime(meta["built"]))))
+            return True
+
+        except Exception as e:
+            print("Exception in Gazetteer::Load: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def _Candidates(self, inHashes: numpy.ndarray, inIndex: str) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Find every row with each name in one of the name indexes
+        :param inHashes: name hashes
+        :param inIndex: index prefix (name, alias, country_name or country_alias)
+        :return: (position of the name in inHashes, row) for every match, grouped by name
+        """
+
+        hashes = self._arrays[inIndex + "_hashes"]
+        start = numpy.searchsorted(hashes, inHashes, side="left")
+        counts = numpy.searchsorted(hashes, inHashes, side="right") - start
+
+        owners = numpy.repeat(numpy.arange(inHashes.size), counts)
+
+        # Position of each match within its name's run of the index
+        offsets = numpy.arange(owners.size) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+        return owners, numpy.asarray(self._arrays[inIndex + "_rows"][numpy.repeat(start, counts) + offsets])
+
+    # ******************************************************************************************************************
+    def FindCountries(self, inNames: List[str]) -> List[Tuple[str, str]]:
+        """
+        The names that are countries, like DBWriter::_FindCountries: a name matches if it is the name of one country,
+        or failing that an alias of one country.
+        :param inNames: location names from an article
+        :return: list of (country name, cc2), in the order of the names
+        """
+
+        if not self._arrays or not inNames:
+            return list()
+
+        hashes = NameHashes(inNames)
+        rows = numpy.full(hashes.size, -1)
+
+        for index in ("country_name", "country_alias"):
+            owners, candidates = self._Candidates(hashes, index)
+            counts = numpy.bincount(owners, minlength=hashes.size)
+
+            single = (rows == -1) & (counts == 1)
+            rows[owners[single[owners]]] = candidates[single[owners]]
+
+        return [(str(self._arrays["country_names"][row]), self._arrays["country_cc2"][row].decode("ascii"))
+                for row in rows if row != -1]
+
+    # ******************************************************************************************************************
+    def ResolveLocations(self, inNames: List[str], inAdminList: List[Tuple[str, str]] = None) -> Dict[str, int]:
+        """
+        Match the locations from an article the way DBWriter::_ProcessLocations does, in this order:
+            a single location with the name
+            a single location with the name as an alias
+            the most populous location with the name in a country named in the article (the first one named that has
+                any), if there are several with the name
+            the most populous location with the name, if several of them have a population
+        :param inNames: location names from an article
+        :param inAdminList: (name, cc2) of the countries in the article, from FindCountries if not given
+        :return: name -> location id, for the names that were matched
+        """
+
+        if not self._arrays or not inNames:
+            return dict()
+
+        names = list(dict.fromkeys(name for name in inNames if name))
+        if not names:
+            return dict()
+
+        if inAdminList is None:
+            inAdminList = self.FindCountries(names)
+
+        hashes = NameHashes(names)
+        rows = numpy.full(hashes.size, -1)
+
+        nameOwners, nameRows = self._Candidates(hashes, "name")
+        nameCounts = numpy.bincount(nameOwners, minlength=hashes.size)
+
+        aliasOwners, aliasRows = self._Candidates(hashes, "alias")
+        aliasCounts = numpy.bincount(aliasOwners, minlength=hashes.size)
+
+        # A single match on the name, then a single match on the aliases
+        single = nameCounts == 1
+        rows[nameOwners[single[nameOwners]]] = nameRows[single[nameOwners]]
+
+        single = (rows == -1) & (aliasCounts == 1)
+        rows[aliasOwners[single[aliasOwners]]] = aliasRows[single[aliasOwners]]
+
+        # The rest only apply to names with several matches.  With none, the database tries the similarity checks.
+        several = (rows == -1) & (nameCounts > 1)
+        owners, candidates = nameOwners[several[nameOwners]], nameRows[several[nameOwners]]
+        population = numpy.asarray(self._arrays["population"][candidates])
+
+        if inAdminList and owners.size:
+            # Rank each candidate by the position of its country in the article, -1 if it isn't in one of them
+            adminCodes = list(dict.fromkeys(cc2.encode("ascii", "replace") for _, cc2 in inAdminList if cc2))
+            rank = numpy.full(candidates.size, len(adminCodes))
+            candidateCodes = numpy.asarray(self._arrays["cc2"][candidates])
+            for position, code in reversed(list(enumerate(adminCodes))):
+                rank[candidateCodes == code] = position
+
+            inAdmin = rank < len(adminCodes)
+            self._PickBest(rows, owners[inAdmin], candidates[inAdmin], rank[inAdmin], population[inAdmin])
+
+        # Most populous, as long as more than one of them has a population
+        hasPopulation = (rows[owners] == -1) & (population >= 0)
+        populated = numpy.bincount(owners[hasPopulation], minlength=hashes.size) > 1
+        keep = hasPopulation & populated[owners]
+        self._PickBest(rows, owners[keep], candidates[keep], numpy.zeros(keep.sum(), dtype=int), population[keep])
+
+        locationIDs = self._arrays["location_ids"]
+
+        return {name: int(locationIDs[row]) for name, row in zip(names, rows) if row != -1}
+
+    # ******************************************************************************************************************
+    def MatchLocations(self, inNames: List[str]) -> Dict[str, int]:
+        """
+        Match the locations from an article with ResolveLocations or ScoreLocations, depending on the Matching setting
+        :param inNames: location names from an article
+        :return: name -> location id, for the names that were matched
+        """
+
+        if self._matching == "scored":
+            return self.ScoreLocations(inNames)
+
+        return self.ResolveLocations(inNames)
+
+    # ******************************************************************************************************************
+    def ScoreLocations(self, inNames: List[str], inAdminList: List[Tuple[str, str]] = None) -> Dict[str, int]:
+        """
+        Match the locations from an article by scoring every candidate place for every name together, instead of
+        working through the names one at a time.  A candidate scores for
+            being in a country named in the article (CountryWeight)
+            its population, on a log scale up to FULL_POPULATION (PopulationWeight)
+            being near the likely places for the other names (ProximityWeight), where each other name contributes its
+                closest candidate, weighted by how likely that candidate is from the first two scores, with the
+                contribution falling off over ProximityKilometres
+        and loses AliasPenalty if it only matched on an alias.  Alias matches are only candidates for names with no
+        place of that name, and each name keeps its MaxCandidates most populous candidates.  The highest score wins, so
+        a name with a single candidate always gets it and is a fixed point for the others.
+        :param inNames: location names from an article
+        :param inAdminList: (name, cc2) of the countries in the article, from FindCountries if not given
+        :return: name -> location id, for the names with any candidates.  The rest are left to the database.
+        """
+
+        if not self._arrays or not inNames:
+            return dict()
+
+        names = list(dict.fromkeys(name for name in inNames if name))
+        if not names:
+            return dict()
+
+        if inAdminList is None:
+            inAdminList = self.FindCountries(names)
+
+        hashes = NameHashes(names)
+
+        nameOwners, nameRows = self._Candidates(hashes, "name")
+        aliasOwners, aliasRows = self._Candidates(hashes, "alias")
+
+        # Aliases only count for the names no place has
+        aliasOnly = numpy.bincount(nameOwners, minlength=hashes.size)[aliasOwners] == 0
+        owners = numpy.concatenate([nameOwners, aliasOwners[aliasOnly]])
+        candidates = numpy.concatenate([nameRows, aliasRows[aliasOnly]])
+        isAlias = numpy.concatenate([numpy.zeros(nameOwners.size, dtype=bool), numpy.ones(aliasOnly.sum(), dtype=bool)])
+
+        if not owners.size:
+            return dict()
+
+        population = numpy.asarray(self._arrays["population"][candidates])
+
+        # Group the candidates by name, most populous first, and keep the first MaxCandidates of each
+        order = numpy.lexsort((-population, owners))
+        owners, candidates, isAlias, population = owners[order], candidates[order], isAlias[order], population[order]
+
+        starts = numpy.flatnonzero(numpy.r_[True, owners[1:] != owners[:-1]])
+        positions = numpy.arange(owners.size) - numpy.repeat(starts, numpy.diff(numpy.r_[starts, owners.size]))
+        keep = positions < self._maxCandidates
+
+        owners, candidates, isAlias, population = owners[keep], candidates[keep], isAlias[keep], population[keep]
+        starts = numpy.flatnonzero(numpy.r_[True, owners[1:] != owners[:-1]])
+
+        # Country and population
+        adminCodes = numpy.array([cc2.encode("ascii", "replace") for _, cc2 in inAdminList if cc2], dtype="S2")
+        inAdmin = numpy.isin(numpy.asarray(self._arrays["cc2"][candidates]), adminCodes)
+        populationScore = numpy.clip(numpy.log10(numpy.maximum(population, 0) + 1) / numpy.log10(FULL_POPULATION + 1),
+                                     0.0, 1.0)
+
+        prior = (self._countryWeight * inAdmin + self._populationWeight * populationScore -
+                 self._aliasPenalty * isAlias)
+
+        # How likely each candidate is for its name, from the prior alone
+        likelihood = numpy.exp(prior - numpy.repeat(numpy.maximum.reduceat(prior, starts),
+                                                    numpy.diff(numpy.r_[starts, owners.size])))
+        likelihood /= numpy.repeat(numpy.add.reduceat(likelihood, starts), numpy.diff(numpy.r_[starts, owners.size]))
+
+        # Proximity, from the distances between every pair of candidates, a block of rows at a time
+        proximity = numpy.zeros(owners.size)
+        if starts.size > 1 and self._proximityWeight:
+            latitude = numpy.radians(numpy.asarray(self._arrays["latitude"][candidates]))
+            longitude = numpy.radians(numpy.asarray(self._arrays["longitude"][candidates]))
+            blockRows = max(PROXIMITY_BLOCK_PAIRS // owners.size, 1)
+
+            for blockStart in range(0, owners.size, blockRows):
+                block = slice(blockStart, blockStart + blockRows)
+
+                a = (numpy.sin((latitude[block, None] - latitude[None, :]) / 2.0) ** 2 +
+                     numpy.cos(latitude[block, None]) * numpy.cos(latitude[None, :]) *
+                     numpy.sin((longitude[block, None] - longitude[None, :]) / 2.0) ** 2)
+                distance = 2.0 * EARTH_RADIUS_KILOMETRES * numpy.arcsin(numpy.sqrt(numpy.clip(a, 0.0, 1.0)))
+
+                # Places without coordinates and the other candidates for the same name don't support anything
+                support = numpy.nan_to_num(numpy.exp(-distance / self._proximityKilometres)) * likelihood[None, :]
+                support[owners[block, None] == owners[None, :]] = 0.0
+
+                # Best support from each of the other names, averaged over them
+                proximity[block] = numpy.maximum.reduceat(support, starts, axis=1).sum(axis=1) / (starts.size - 1)
+
+        score = prior + self._proximityWeight * proximity
+
+        order = numpy.lexsort((-score, owners))
+        firstOwners, first = numpy.unique(owners[order], return_index=True)
+
+        locationIDs = self._arrays["location_ids"]
+
+        return {names[owner]: int(locationIDs[row]) for owner, row in zip(firstOwners, candidates[order][first])}
+
+    # ******************************************************************************************************************
+    def Describe(self, inLocationID: int) -> Tuple[str, float, float]:
+        """
+        Look up a location in the snapshot
+        :param inLocationID: location id
+        :return: (cc2, latitude, longitude), or None if it isn't in the snapshot
+        """
+
+        if not self._arrays:
+            return None
+
+        locationIDs = self._arrays["location_ids"]
+        row = int(numpy.searchsorted(locationIDs, inLocationID))
+        if row >= locationIDs.size or locationIDs[row] != inLocationID:
+            return None
+
+        return (self._arrays["cc2"][row].decode("ascii"), float(self._arrays["latitude"][row]),
+                float(self._arrays["longitude"][row]))
+
+    # ******************************************************************************************************************
+    @staticmethod
+    def _PickBest(inRows: numpy.ndarray, inOwners: numpy.ndarray, inCandidates: numpy.ndarray, inRank: numpy.ndarray,
+                  inPopulation: numpy.ndarray):
+        """
+        For each name, pick the candidate with the lowest rank and then the highest population
+        :param inRows: row chosen for each name, -1 if there isn't one yet.  The -1 entries are filled in place.
+        :param inOwners: name of each candidate
+        :param inCandidates: row of each candidate
+        :param inRank: rank of each candidate
+        :param inPopulation: population of each candidate
+        :return: none
+        """
+
+        unresolved = inRows[inOwners] == -1
+        if not unresolved.any():
+            return
+
+        owners, candidates = inOwners[unresolved], inCandidates[unresolved]
+
+        # lexsort sorts on the last key first
+        order = numpy.lexsort((-inPopulation[unresolved], inRank[unresolved], owners))
+        firstOwners, first = numpy.unique(owners[order], return_index=True)
+
+        inRows[firstOwners] = candidates[order][first]
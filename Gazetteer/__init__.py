@@ -0,0 +1 @@
+from .Gazetteer import Gazetteer
@@ -0,0 +1,294 @@
+# coding=utf-8
+
+"""
+LeaseManager.py
+Describes the class that hands out subscriptions to extractor instances on different machines.  A subscription is
+claimed with a lease that expires, so two instances never process the same feed at once and the feeds of an instance
+that dies are picked up by the others once its leases run out.
+"""
+
+import configparser
+import datetime
+import os
+import socket
+import threading
+from typing import List, Tuple
+import psycopg2
+
+
+class LeaseManager(object):
+    """
+    This class claims subscriptions in the subscriptions table with SELECT ... FOR UPDATE SKIP LOCKED, so instances
+    claiming at the same time skip over each other's rows instead of waiting on them.  A claim sets lease_owner and
+    lease_expires, and last_polled so the other instances know the feed has been done recently.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        # DB Parameters
+        self._DBHost = str()
+        self._DBPort = str()
+        self._DBUser = str()
+        self._DBPassword = str()
+        self._DBTable = str()
+
+        # DB Objects.  The daemon claims from several threads, so use them under the lock.
+        self._DBConnection = None
+        self._DBCursor = None
+        self._DBLock = threading.Lock()
+
+        # Sharding parameters
+        self._leaseSeconds = 1800
+        self._repollAfter = 300
+        self._batchSize = 10
+        self._workerID = "{}:{}".format(socket.gethostname(), os.getpid())
+
+        # Read the configuration
+        if not self._ReadConfiguration(inConfigObject):
+            self.good = False
+            return
+
+        with self._DBLock:
+            if not self._CreateDBObjects():
+                self.good = False
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser) -> bool:
+        """
+        Use the passed-in ConfigParser object to set ourselves up
+        :return: True if OK, False otherwise
+        """
+
+        try:
+            # Get the top level
+            DB = inConfigObject["DB"]
+
+            # Now set our member variables
+            self._DBHost = DB["DBHost"]
+            self._DBPort = DB["DBPort"]
+            self._DBUser = DB["DBUser"]
+            self._DBPassword = DB["DBPassword"]
+            self._DBTable = DB["DBTable"]
+
+            if inConfigObject.has_section("SHARDING"):
+                SHARDING = inConfigObject["SHARDING"]
+
+                self._leaseSeconds = SHARDING.getint("LeaseSeconds", self._leaseSeconds)
+                self._repollAfter = SHARDING.getint("RepollAfter", self._repollAfter)
+                self._batchSize = SHARDING.getint("BatchSize", self._batchSize)
+                self._workerID = SHARDING.get("WorkerID", fallback=str()) or self._workerID
+
+            return True
+
+        except Exception as e:
+            print("Exception in LeaseManager::_ReadConfiguration: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def ClaimBatch(self, inPolledBefore: datetime.datetime = None) -> List[Tuple]:
+        """
+        Claim up to BatchSize subscriptions that nobody holds a lease on and that haven't been polled in the last
+        RepollAfter seconds.  The ones that have waited longest go first.
+        :param inPolledBefore: only claim subscriptions last polled before this (from DatabaseTime), so a run that takes
+                               longer than RepollAfter doesn't come back round to the feeds it started with
+        :return: list of (url, classname) tuples
+        """
+
+        with self._DBLock:
+            try:
+                if not self._DBConnection and not self._CreateDBObjects():
+                    return list()
+
+                self._DBCursor.execute("""
+                                        UPDATE subscriptions
+                                        SET lease_owner = %s,
+                                            lease_expires = NOW() + %s * INTERVAL '1 second',
+                                            last_polled = NOW()
+                                        WHERE id IN (SELECT id FROM subscriptions
+                                                     WHERE (lease_expires IS NULL OR lease_expires < NOW())
+                                                     AND (last_polled IS NULL OR
+                                                          (last_polled < NOW() - %s * INTERVAL '1 second' AND
+                                                           (%s::timestamptz IS NULL OR last_polled < %s)))
+                                                     ORDER BY last_polled NULLS FIRST
+                                                     LIMIT %s
+                                                     FOR UPDATE SKIP LOCKED)
+                                        RETURNING url, classname;
+                                        """, (self._workerID, self._leaseSeconds, self._repollAfter,
+                                              inPolledBefore, inPolledBefore, self._batchSize))
+                claimed = self._DBCursor.fetchall()
+                self._DBConnection.commit()
+
+                return claimed
+
+            except Exception as e:
+                print("Exception in LeaseManager::ClaimBatch: {}".format(e))
+                self._CreateDBObjects()
+                return list()
+
+    # ******************************************************************************************************************
+    def Claim(self, inURL: str, inMinimumAge: float) -> bool:
+        """
+        Try to claim a single subscription.  Fails if another instance holds the lease or polled it less than
+        inMinimumAge seconds ago.
+        :param inURL: URL of the subscription
+        :param inMinimumAge: seconds since the last poll before it can be polled again
+        :return: True if we got the lease
+        """
+
+        with self._DBLock:
+            try:
+                if not self._DBConnection and not self._CreateDBObjects():
+                    return False
+
+                self._DBCursor.execute("""
+                                        UPDATE subscriptions
+                                        SET lease_owner = %s,
+                                            lease_expires = NOW() + %s * INTERVAL '1 second',
+                                            last_polled = NOW()
+                                        WHERE id IN (SELECT id FROM subscriptions
+                                                     WHERE url = %s
+                                                     AND (lease_expires IS NULL OR lease_expires < NOW() OR
+                                                          lease_owner = %s)
+                                                     AND (last_polled IS NULL OR
+                                                          last_polled < NOW() - %s * INTERVAL '1 second')
+                                                     FOR UPDATE SKIP LOCKED)
+                                        RETURNING id;
+                                        """, (self._workerID, self._leaseSeconds, inURL, self._workerID,
+                                              inMinimumAge))
+                claimed = self._DBCursor.fetchone() is not None
+                self._DBConnection.commit()
+
+                return claimed
+
+            except Exception as e:
+                print("Exception in LeaseManager::Claim for {}: {}".format(inURL, e))
+                self._CreateDBObjects()
+                return False
+
+    # ******************************************************************************************************************
+    def DatabaseTime(self) -> datetime.datetime:
+        """
+        The database's clock, so times compared against last_polled don't depend on this machine's clock
+        :return: the current time on the database server, None on error
+        """
+
+        with self._DBLock:
+            try:
+                if not self._DBConnection and not self._CreateDBObjects():
+                    return None
+
+                self._DBCursor.execute("SELECT NOW();")
+                now = self._DBCursor.fetchone()[0]
+                self._DBConnection.commit()
+
+                return now
+
+            except Exception as e:
+                print("Exception in LeaseManager::DatabaseTime: {}".format(e))
+                self._CreateDBObjects()
+                return None
+
+    # ******************************************************************************************************************
+    def Renew(self, inURLs: List[str]):
+        """
+        Push our leases on the subscriptions out by another LeaseSeconds
+        :param inURLs: URLs of the subscriptions
+        :return: Nothing
+        """
+
+        if not inURLs:
+            return
+
+        with self._DBLock:
+            try:
+                if not self._DBConnection and not self._CreateDBObjects():
+                    return
+
+                self._DBCursor.execute("""
+                                        UPDATE subscriptions SET lease_expires = NOW() + %s * INTERVAL '1 second'
+                                        WHERE url = ANY(%s) AND lease_owner = %s;
+                                        """, (self._leaseSeconds, list(inURLs), self._workerID))
+                self._DBConnection.commit()
+
+            except Exception as e:
+                print("Exception in LeaseManager::Renew: {}".format(e))
+                self._CreateDBObjects()
+
+    # ******************************************************************************************************************
+    def RenewUntil(self, inURLs: List[str], inStopEvent: threading.Event):
+        """
+        Keep renewing the leases every third of LeaseSeconds until the event is set, so a batch that takes longer than
+        LeaseSeconds isn't taken over by another instance part way through.  Meant to run in its own thread.
+        :param inURLs: URLs of the subscriptions
+        :param inStopEvent: set when the batch is finished
+        :return: Nothing
+        """
+
+        while not inStopEvent.wait(max(self._leaseSeconds / 3.0, 1.0)):
+            self.Renew(inURLs)
+
+    # ******************************************************************************************************************
+    def Release(self, inURLs: List[str]):
+        """
+        Give up our leases on the subscriptions once we're done with them
+        :param inURLs: URLs of the subscriptions
+        :return: Nothing
+        """
+
+        if not inURLs:
+            return
+
+        with self._DBLock:
+            try:
+                if not self._DBConnection and not self._CreateDBObjects():
+                    return
+
+                self._DBCursor.execute("""
+                                        UPDATE subscriptions SET lease_owner = NULL, lease_expires = NULL
+                                        WHERE url = ANY(%s) AND lease_owner = %s;
+                                        """, (list(inURLs), self._workerID))
+                self._DBConnection.commit()
+
+            except Exception as e:
+                print("Exception in LeaseManager::Release: {}".format(e))
+                self._CreateDBObjects()
+
+    # ******************************************************************************************************************
+    def _CreateDBObjects(self) -> bool:
+        """
+        Create (or re-create after an error) the psycopg2 connection and cursor.  Call with the DB lock held.
+        :return: True if successful, False otherwise
+        """
+
+        try:
+            if self._DBCursor:
+                self._DBCursor.close()
+            if self._DBConnection:
+                self._DBConnection.close()
+        except Exception as e:
+            print("Exception in LeaseManager::_CreateDBObjects closing the old connection: {}".format(e))
+
+        try:
+            self._DBConnection = psycopg2.connect(host=self._DBHost,
+                                                  port=self._DBPort,
+                                                  dbname=self._DBTable,
+                                                  user=self._DBUser,
+                                                  password=self._DBPassword)
+            self._DBCursor = self._DBConnection.cursor()
+
+            return True
+
+        except Exception as e:
+            print("Exception in LeaseManager::_CreateDBObjects: {}".format(e))
+            self._DBConnection = None
+            self._DBCursor = None
+            return False
@@ -0,0 +1 @@
+from .LeaseManager import LeaseManager
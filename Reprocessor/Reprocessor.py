@@ -0,0 +1,292 @@
+# coding=utf-8
+
+"""
+Reprocessor.py
+Describes the class that re-runs the entity extraction over articles already in the database, for when _FixText, the
+problem entities or the Spacy model change.
+"""
+
+import configparser
+import json
+import multiprocessing
+import os
+import time
+from typing import List, Tuple
+import psycopg2
+from psycopg2 import sql
+from DBWriter import DBWriter
+from DBWriter.DBWriter import ArticleTextSQL
+import websites
+from websites import ExtractedArticle, WebsiteBase
+from websites.HTMLArchive import HTMLArchive
+
+
+class Reprocessor(object):
+    """
+    This class streams the stored article text out of news_articles in chunks with a server-side cursor, runs the NLP
+    over each chunk with Spacy's pipe, and replaces the article links for the chunk.  The id of the last finished chunk
+    is saved to a checkpoint file so an interrupted run picks up where it left off.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self, inQueue: multiprocessing.Queue, inConfigObject: configparser.ConfigParser):
+        """
+        Perform our specific setup
+        :param inQueue: multiprocessing.Queue object (needed by the website object, nothing is put on it)
+        :param inConfigObject: Configuration object to read from
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        # DB Parameters
+        self._DBHost = str()
+        self._DBPort = str()
+        self._DBUser = str()
+        self._DBPassword = str()
+        self._DBTable = str()
+        self._separateText = False
+
+        # Reprocessing parameters
+        self._chunkSize = 500
+        self._NLPProcesses = 2
+        self._batchSize = 50
+        self._applyFixText = False
+        self._checkpointPath = "reprocess_checkpoint.json"
+        self._fromArchive = False
+
+        # Archive settings, for re-extracting the text from the archived pages
+        self._archivePath = "html_archive"
+        self._archiveSegmentSize = 256
+
+        # Read the configuration
+        if not self._ReadConfiguration(inConfigObject):
+            self.good = False
+            return
+
+        # Does the NLP.  It's a plain WebsiteBase since we never download anything.
+        self._websiteObject = WebsiteBase(inQueue, inConfigObject, str())
+
+        # Does the entity matching and writing.  It runs in this process, so it is never started.
+        self._dbWriter = DBWriter(inQueue, inConfigObject)
+
+        if not self._websiteObject.good or not self._dbWriter.good:
+            self.good = False
+            return
+
+        self._queue = inQueue
+        self._configObject = inConfigObject
+
+        # Website objects for the archived pages, as classname -> object
+        self._websiteObjects = dict()
+
+        self._htmlArchive = None
+        if self._fromArchive:
+            self._htmlArchive = HTMLArchive(self._archivePath, self._archiveSegmentSize)
+            if not self._htmlArchive.good:
+                self.good = False
+
+    # ******************************************************************************************************************
+    def _ReadConfiguration(self, inConfigObject: configparser.ConfigParser) -> bool:
+        """
+        Use the passed-in ConfigParser object to set ourselves up
+        :return: True if OK, False otherwise
+        """
+
+        try:
+            # Get the top level
+            DB = inConfigObject["DB"]
+
+            # Now set our member variables
+            self._DBHost = DB["DBHost"]
+            self._DBPort = DB["DBPort"]
+            self._DBUser = DB["DBUser"]
+            self._DBPassword = DB["DBPassword"]
+            self._DBTable = DB["DBTable"]
+            self._separateText = DB.getboolean("SeparateArticleText", self._separateText)
+
+            # The REPROCESS section is optional, use the defaults if it is not there
+            if inConfigObject.has_section("REPROCESS"):
+                REPROCESS = inConfigObject["REPROCESS"]
+
+                self._chunkSize = REPROCESS.getint("ChunkSize", self._chunkSize)
+                self._NLPProcesses = REPROCESS.getint("NLPProcesses", self._NLPProcesses)
+                self._batchSize = REPROCESS.getint("BatchSize", self._batchSize)
+                self._applyFixText = REPROCESS.getboolean("ApplyFixText", self._applyFixText)
+                self._checkpointPath = REPROCESS.get("CheckpointPath", self._checkpointPath)
+                self._fromArchive = REPROCESS.getboolean("FromArchive", self._fromArchive)
+
+            if inConfigObject.has_section("ARCHIVE"):
+                ARCHIVE = inConfigObject["ARCHIVE"]
+
+                self._archivePath = ARCHIVE.get("Path", self._archivePath)
+                self._archiveSegmentSize = ARCHIVE.getint("SegmentSizeMB", self._archiveSegmentSize)
+
+            # Relative paths are relative to the program directory
+            programDirectory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+            self._checkpointPath = os.path.join(programDirectory, self._checkpointPath)
+            self._archivePath = os.path.join(programDirectory, self._archivePath)
+            self._archiveSegmentSize *= 1024 * 1024
+
+            return True
+
+        except Exception as e:
+            print("Exception in Reprocessor::_ReadConfiguration: {}".format(e))
+            self.good = False
+            return False
+
+    # ******************************************************************************************************************
+    def Run(self):
+        """
+        Reprocess every article after the checkpoint
+        :return: Nothing
+        """
+
+        if not self.good:
+            return
+
+        lastArticleID = self._ReadCheckpoint()
+        if lastArticleID:
+            print("Reprocessor: Resuming after article {}".format(lastArticleID))
+
+        try:
+            # The named cursor needs its own connection, since a commit would close it and the writer commits a lot
+            DBConnection = psycopg2.connect(host=self._DBHost,
+                                            port=self._DBPort,
+                                            dbname=self._DBTable,
+                                            user=self._DBUser,
+                                            password=self._DBPassword)
+
+            cursor = DBConnection.cursor(name="reprocess_articles")
+            cursor.itersize = self._chunkSize
+            cursor.execute(sql.SQL("SELECT news_articles.id, article_url, {} FROM news_articles {} "
+                                   "WHERE news_articles.id > %s ORDER BY news_articles.id;").format(
+                                   *ArticleTextSQL(self._separateText)), (lastArticleID,))
+
+            articleCount = 0
+            startTime = time.time()
+
+            while True:
+                rows = cursor.fetchmany(self._chunkSize)
+                if not rows:
+                    break
+
+                if not self._ProcessChunk(rows):
+                    print("Reprocessor: Stopping, the chunk after article {} failed".format(lastArticleID))
+                    break
+
+                lastArticleID = rows[-1][0]
+                self._WriteCheckpoint(lastArticleID)
+
+                articleCount += len(rows)
+                elapsed = max(time.time() - startTime, 1e-6)
+                print("Reprocessor: {} articles, up to id {} ({:.0f} articles/minute)".format(
+                    articleCount, lastArticleID, articleCount * 60.0 / elapsed))
+
+            # clean up
+            cursor.close()
+            DBConnection.close()
+
+        except Exception as e:
+            print("Exception in Reprocessor::Run: {}".format(e))
+
+    # ******************************************************************************************************************
+    def _ProcessChunk(self, inRows: List[Tuple]) -> bool:
+        """
+        Run the NLP over a chunk of articles and replace their links
+        :param inRows: list of (id, article_url, article_text) tuples
+        :return: True if the chunk was written
+        """
+
+        articles = list()
+        updateText = self._applyFixText
+
+        for articleID, articleURL, articleText in inRows:
+            article = ExtractedArticle()
+            article.articleID = articleID
+            article.articleURL = articleURL
+            article.articleText = articleText or str()
+
+            archivedText = self._TextFromArchive(articleURL)
+            if archivedText:
+                article.articleText = archivedText
+                updateText = True
+            elif self._applyFixText and article.articleText:
+                article.articleText = self._websiteObject._FixText(article.articleText)
+
+            articles.append(article)
+
+        entityList = self._websiteObject.GetEntitiesBatch([article.articleText for article in articles],
+                                                          self._NLPProcesses, self._batchSize)
+
+        for article, entities in zip(articles, entityList):
+            article.AddEntities(entities)
+
+        self._dbWriter.RewriteEntries(articles, updateText)
+
+        return self._dbWriter.good
+
+    # ******************************************************************************************************************
+    def _TextFromArchive(self, inURL: str) -> str:
+        """
+        Run the current parser over the archived page for an article
+        :param inURL: article URL
+        :return: the article text, empty if we're not using the archive or the page isn't in it
+        """
+
+        if not self._htmlArchive or not inURL:
+            return str()
+
+        try:
+            classname = self._htmlArchive.GetClassname(inURL)
+            if not classname:
+                return str()
+
+            websiteObject = self._websiteObjects.get(classname)
+            if websiteObject is None:
+                websiteObject = websites.WebsiteFactory((inURL, classname), self._queue, self._configObject)
+                self._websiteObjects[classname] = websiteObject
+
+            return websiteObject._ExtractText(self._htmlArchive.Get(inURL))
+
+        except Exception as e:
+            print("Exception in Reprocessor::_TextFromArchive for {}: {}".format(inURL, e))
+            return str()
+
+    # ******************************************************************************************************************
+    def _ReadCheckpoint(self) -> int:
+        """
+        Read the id of the last article that was finished
+        :return: article id, 0 if there is no checkpoint
+        """
+
+        try:
+            if not os.path.exists(self._checkpointPath):
+                return 0
+
+            with open(self._checkpointPath) as checkpointFile:
+                return int(json.load(checkpointFile)["lastArticleID"])
+
+        except Exception as e:
+            print("Exception in Reprocessor::_ReadCheckpoint: {}".format(e))
+            return 0
+
+    # ******************************************************************************************************************
+    def _WriteCheckpoint(self, inArticleID: int):
+        """
+        Save the id of the last article that was finished.  Written to a temporary file first so a crash can't leave a
+        half written checkpoint.
+        :param inArticleID: article id
+        :return: Nothing
+        """
+
+        try:
+            tempPath = self._checkpointPath + ".tmp"
+
+            with open(tempPath, "w") as checkpointFile:
+                json.dump({"lastArticleID": inArticleID}, checkpointFile)
+
+            os.replace(tempPath, self._checkpointPath)
+
+        except Exception as e:
+            print("Exception in Reprocessor::_WriteCheckpoint: {}".format(e))
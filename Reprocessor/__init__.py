@@ -0,0 +1 @@
+from .Reprocessor import Reprocessor
@@ -0,0 +1,6 @@
+--
+-- Per-subscription polling interval (in seconds) used by the daemon mode.  NULL means use the DAEMON DefaultInterval
+-- from config.ini.
+--
+
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS poll_interval integer;
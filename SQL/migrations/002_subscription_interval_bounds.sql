@@ -0,0 +1,8 @@
+--
+-- Bounds for the adaptive polling interval used by the daemon mode, in seconds.  NULL means use the DAEMON MinInterval
+-- and MaxInterval from config.ini.  When adaptive intervals are on, the daemon writes its current estimate back into
+-- poll_interval.
+--
+
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS min_interval integer;
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS max_interval integer;
@@ -0,0 +1,9 @@
+--
+-- High-water mark for each subscription.  When WEBSITEBASE UseHighWaterMark is on, feed processing stops at the first
+-- entry that is older than last_seen_published or has the last_seen_guid, except for a full sweep every
+-- FullSweepInterval seconds (tracked in last_full_sweep).
+--
+
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS last_seen_published timestamp with time zone;
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS last_seen_guid text;
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS last_full_sweep timestamp with time zone;
@@ -0,0 +1,19 @@
+--
+-- Canonical URL and text fingerprint for each article, plus the near-duplicate index.  Used when DEDUP Enabled is on.
+-- The 64 bit SimHash is split into four 16 bit bands; articles within 3 bits of each other share at least one band.
+--
+
+ALTER TABLE public.news_articles ADD COLUMN IF NOT EXISTS canonical_url text;
+ALTER TABLE public.news_articles ADD COLUMN IF NOT EXISTS simhash bigint;
+
+CREATE INDEX IF NOT EXISTS idx_news_articles_article_url ON public.news_articles USING btree (article_url);
+CREATE INDEX IF NOT EXISTS idx_news_articles_canonical_url ON public.news_articles USING btree (canonical_url);
+
+CREATE TABLE IF NOT EXISTS public.article_simhash_bands (
+    article_id bigint NOT NULL REFERENCES public.news_articles(id),
+    band smallint NOT NULL,
+    band_value integer NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_article_simhash_bands_band ON public.article_simhash_bands USING btree (band, band_value);
+CREATE INDEX IF NOT EXISTS idx_article_simhash_bands_article_id ON public.article_simhash_bands USING btree (article_id);
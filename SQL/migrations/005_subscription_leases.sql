@@ -0,0 +1,11 @@
+--
+-- Leases on subscriptions for running extractor instances on more than one machine.  When SHARDING Enabled is on, an
+-- instance claims a subscription by setting lease_owner and lease_expires with SELECT ... FOR UPDATE SKIP LOCKED.
+-- last_polled is set when it is claimed so the other instances know it has been done.
+--
+
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS lease_owner text;
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS lease_expires timestamp with time zone;
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS last_polled timestamp with time zone;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_lease ON public.subscriptions (lease_expires, last_polled);
@@ -0,0 +1,25 @@
+--
+-- Work queue of discovered articles for the discover and extract modes.  Discovery adds the new URLs from the feeds as
+-- pending.  Extraction workers claim them with SELECT ... FOR UPDATE SKIP LOCKED (status processing, with a lease),
+-- hand them to the DB writer (status queued) and the writer marks them done once the article is stored.  Failures go
+-- back to pending with next_attempt pushed out exponentially, until max attempts when they are marked failed.  Rows
+-- in processing or queued whose lease has expired belonged to a worker that died and are claimed again.
+--
+
+CREATE TABLE IF NOT EXISTS public.pending_articles (
+    id bigserial PRIMARY KEY,
+    article_url text NOT NULL UNIQUE,
+    article_title text,
+    website text,
+    classname text NOT NULL,
+    status text NOT NULL DEFAULT 'pending',
+    attempts integer NOT NULL DEFAULT 0,
+    next_attempt timestamp with time zone NOT NULL DEFAULT NOW(),
+    lease_owner text,
+    lease_expires timestamp with time zone,
+    last_error text,
+    discovered timestamp with time zone NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_pending_articles_due ON public.pending_articles (status, next_attempt);
+CREATE INDEX IF NOT EXISTS idx_pending_articles_lease ON public.pending_articles (status, lease_expires);
@@ -0,0 +1,6 @@
+--
+-- NLP profile for each subscription.  nlp_profile names a section NLP:<name> in config.ini that sets the Spacy model and
+-- pipeline used for the subscription's articles.  NULL (or empty) uses the global NLP section.
+--
+
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS nlp_profile text;
@@ -0,0 +1,41 @@
+--
+-- Indexes for the article link tables, which only have their primary keys in the shipped schema.  Each link is indexed
+-- both ways round on (article_id, entity id) and (entity id, article_id), so finding the entities of an article, the
+-- articles of an entity and the joins in article_locations_view are index only scans.  The writer's
+-- DELETE ... WHERE article_id = ANY(...) when reprocessing uses the first one.
+--
+-- The indexes are built CONCURRENTLY so the extractor can keep writing, which means this file can't be run inside a
+-- transaction.  If a build is interrupted it leaves an INVALID index behind that IF NOT EXISTS will skip, drop it and
+-- run the file again.
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_people_article_id
+    ON public.article_people USING btree (article_id, people_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_people_people_id
+    ON public.article_people USING btree (people_id, article_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_locations_article_id
+    ON public.article_locations USING btree (article_id, location_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_locations_location_id
+    ON public.article_locations USING btree (location_id, article_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_facilities_article_id
+    ON public.article_facilities USING btree (article_id, facility_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_facilities_facility_id
+    ON public.article_facilities USING btree (facility_id, article_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_organizations_article_id
+    ON public.article_organizations USING btree (article_id, organization_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_organizations_organization_id
+    ON public.article_organizations USING btree (organization_id, article_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_events_article_id
+    ON public.article_events USING btree (article_id, event_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_article_events_event_id
+    ON public.article_events USING btree (event_id, article_id);
+
+ANALYZE public.article_people;
+ANALYZE public.article_locations;
+ANALYZE public.article_facilities;
+ANALYZE public.article_organizations;
+ANALYZE public.article_events;
@@ -0,0 +1,47 @@
+--
+-- Moves the article text out of news_articles into its own table, keyed by the article id.  news_articles is then
+-- narrow enough that the URL lookups, the dedup checks and the joins from the link tables touch a fraction of the
+-- pages, and the text (which is almost always long enough to be compressed and stored out of line) is only read by the
+-- reprocessor and the exporter.  Used when DB SeparateArticleText is on.
+--
+-- The text is copied over in batches of ids, committing after each, so it can run with the extractor stopped or
+-- running.  Run it after turning SeparateArticleText on so nothing new is written to news_articles.article_text.  The
+-- readers look in both places, so it can also be stopped and run again later.  Needs PostgreSQL 11 or later for the
+-- COMMIT inside the DO block, and psql must not be run with --single-transaction.
+--
+-- The emptied column is left in place.  The plain VACUUM at the end lets the space be reused, run VACUUM FULL (or
+-- pg_repack) on news_articles in a maintenance window to give it back to the operating system.
+--
+
+CREATE TABLE IF NOT EXISTS public.news_article_texts (
+    article_id bigint PRIMARY KEY,
+    article_text text
+);
+
+DO $$
+DECLARE
+    batch_size CONSTANT bigint := 50000;
+    low bigint;
+    high bigint;
+BEGIN
+    SELECT MIN(id), MAX(id) INTO low, high FROM public.news_articles WHERE article_text IS NOT NULL;
+
+    WHILE low <= high LOOP
+        -- Text already in news_article_texts was written later, by the reprocessor, so it wins
+        INSERT INTO public.news_article_texts (article_id, article_text)
+        SELECT id, article_text FROM public.news_articles
+        WHERE id >= low AND id < low + batch_size AND article_text IS NOT NULL
+        ON CONFLICT (article_id) DO NOTHING;
+
+        UPDATE public.news_articles SET article_text = NULL
+        WHERE id >= low AND id < low + batch_size AND article_text IS NOT NULL;
+
+        COMMIT;
+
+        low := low + batch_size;
+    END LOOP;
+END
+$$;
+
+VACUUM ANALYZE public.news_articles;
+ANALYZE public.news_article_texts;
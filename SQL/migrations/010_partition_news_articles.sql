@@ -0,0 +1,181 @@
+--
+-- Converts news_articles and news_article_texts to tables partitioned on ranges of the article id.  Each partition has
+-- its own indexes, so they stay small enough to be cached however large the archive gets, new rows only ever touch the
+-- newest partition, and old partitions can be moved to other tablespaces, detached or dumped on their own.
+--
+-- The existing table is not copied.  It is renamed and attached as the first partition, covering every id up to the
+-- next multiple of the partition size past the highest id handed out, and empty partitions are added after it.  The
+-- foreign keys from the link tables and article_simhash_bands are added back against the partitioned table NOT VALID
+-- and then validated, which scans the link tables without blocking writes to them.
+--
+-- This takes an exclusive lock on news_articles while it runs (attaching the old table has to scan it once), so stop
+-- the extractor first.  Needs PostgreSQL 12 or later and migrations 004 and 009.  Running it again does nothing.
+--
+-- Partitions have to exist before the ids reach them.  Rows past the last partition go to the default partition
+-- rather than failing, but a partition can't be added over rows sitting there, so run
+--     SELECT public.add_id_partitions('public.news_articles', 10000000);
+--     SELECT public.add_id_partitions('public.news_article_texts', 10000000);
+-- from cron, often enough that the extractor never gets more than a partition ahead of it.
+--
+-- Lookups that aren't by id (article_url, canonical_url) check every partition's index, so keep the partitions large
+-- enough that there are tens of them rather than thousands.
+--
+
+CREATE OR REPLACE FUNCTION public.add_id_partitions(parent regclass, partition_size bigint, ahead integer DEFAULT 2)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    parent_name name;
+    parent_schema name;
+    key_column name;
+    default_partition regclass;
+    stray boolean;
+    highest bigint;
+    low bigint;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    SELECT relname, nspname INTO parent_name, parent_schema
+    FROM pg_class JOIN pg_namespace ON pg_namespace.oid = relnamespace
+    WHERE pg_class.oid = parent;
+
+    SELECT attname INTO key_column
+    FROM pg_partitioned_table JOIN pg_attribute ON attrelid = partrelid AND attnum = partattrs[0]
+    WHERE partrelid = parent;
+
+    IF key_column IS NULL THEN
+        RAISE EXCEPTION '% is not partitioned', parent;
+    END IF;
+
+    -- Carry on from the upper bound of the last range partition
+    SELECT MAX(substring(pg_get_expr(relpartbound, oid) FROM 'TO \(''?(-?[0-9]+)''?\)')::bigint) INTO low
+    FROM pg_class WHERE oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = parent);
+
+    SELECT oid INTO default_partition
+    FROM pg_class
+    WHERE oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = parent)
+      AND pg_get_expr(relpartbound, oid) = 'DEFAULT';
+
+    IF default_partition IS NOT NULL THEN
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s)', default_partition) INTO stray;
+        IF stray THEN
+            RAISE EXCEPTION '% has rows in it, move them out before adding partitions', default_partition;
+        END IF;
+    END IF;
+
+    EXECUTE format('SELECT COALESCE(MAX(%I), 0) FROM %s', key_column, parent) INTO highest;
+
+    WHILE low < highest + ahead * partition_size LOOP
+        partition_name := format('%s_p%s', parent_name, low);
+
+        EXECUTE format('CREATE TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%s) TO (%s)',
+                       parent_schema, partition_name, parent, low, low + partition_size);
+
+        low := low + partition_size;
+        created := created + 1;
+    END LOOP;
+
+    RETURN created;
+END
+$$;
+
+DO $$
+DECLARE
+    partition_size CONSTANT bigint := 10000000;
+    boundary bigint;
+    link record;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'public.news_articles'::regclass) = 'p' THEN
+        RAISE NOTICE 'news_articles is already partitioned';
+        RETURN;
+    END IF;
+
+    LOCK TABLE public.news_articles IN ACCESS EXCLUSIVE MODE;
+
+    -- The bulk writer takes ids from the sequence before it writes the articles, so go past those too
+    SELECT (GREATEST(COALESCE(MAX(id), 0), (SELECT last_value FROM public.news_articles_id_seq)) / partition_size + 1)
+           * partition_size
+    INTO boundary FROM public.news_articles;
+
+    -- The foreign keys would stay pointing at the old table, so drop them and add them back at the end
+    FOR link IN SELECT conrelid::regclass AS link_table, conname
+                FROM pg_constraint
+                WHERE contype = 'f' AND confrelid = 'public.news_articles'::regclass LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', link.link_table, link.conname);
+    END LOOP;
+
+    -- Free up the names for the partitioned table and its indexes
+    ALTER TABLE public.news_articles RENAME TO news_articles_p0;
+    ALTER INDEX public.news_articles_pkey RENAME TO news_articles_p0_pkey;
+    ALTER INDEX IF EXISTS public.idx_news_articles_article_url RENAME TO idx_news_articles_p0_article_url;
+    ALTER INDEX IF EXISTS public.idx_news_articles_canonical_url RENAME TO idx_news_articles_p0_canonical_url;
+
+    -- Same as the primary key, and a partitioned table can't have it anyway
+    ALTER TABLE public.news_articles_p0 DROP CONSTRAINT IF EXISTS news_articles_id_key;
+
+    CREATE TABLE public.news_articles (LIKE public.news_articles_p0 INCLUDING DEFAULTS) PARTITION BY RANGE (id);
+    ALTER SEQUENCE public.news_articles_id_seq OWNED BY public.news_articles.id;
+
+    -- These pick up the matching indexes on the old table when it's attached instead of building new ones
+    ALTER TABLE public.news_articles ADD CONSTRAINT news_articles_pkey PRIMARY KEY (id);
+    CREATE INDEX idx_news_articles_article_url ON public.news_articles USING btree (article_url);
+    CREATE INDEX idx_news_articles_canonical_url ON public.news_articles USING btree (canonical_url);
+
+    EXECUTE format('ALTER TABLE public.news_articles ATTACH PARTITION public.news_articles_p0 '
+                   'FOR VALUES FROM (MINVALUE) TO (%s)', boundary);
+
+    -- The view was bound to the old table when it was created
+    CREATE OR REPLACE VIEW public.article_locations_view AS
+     SELECT news_articles.id,
+        news_articles.article_title AS title,
+        news_articles.article_url AS url,
+        locations.name AS location_name,
+        locations.cc2,
+        locations.the_geom
+       FROM ((public.news_articles
+         JOIN public.article_locations ON ((news_articles.id = article_locations.article_id)))
+         JOIN public.locations ON ((article_locations.location_id = locations.id)));
+
+    -- Same again for the article text, on the same boundaries so an article and its text are in matching partitions
+    ALTER TABLE public.news_article_texts RENAME TO news_article_texts_p0;
+    ALTER INDEX public.news_article_texts_pkey RENAME TO news_article_texts_p0_pkey;
+
+    CREATE TABLE public.news_article_texts (LIKE public.news_article_texts_p0 INCLUDING DEFAULTS)
+        PARTITION BY RANGE (article_id);
+    ALTER TABLE public.news_article_texts ADD CONSTRAINT news_article_texts_pkey PRIMARY KEY (article_id);
+
+    EXECUTE format('ALTER TABLE public.news_article_texts ATTACH PARTITION public.news_article_texts_p0 '
+                   'FOR VALUES FROM (MINVALUE) TO (%s)', boundary);
+
+    PERFORM public.add_id_partitions('public.news_articles', partition_size);
+    PERFORM public.add_id_partitions('public.news_article_texts', partition_size);
+
+    CREATE TABLE public.news_articles_default PARTITION OF public.news_articles DEFAULT;
+    CREATE TABLE public.news_article_texts_default PARTITION OF public.news_article_texts DEFAULT;
+
+    -- Put the foreign keys back against the partitioned table, checked below without the exclusive lock
+    ALTER TABLE public.article_people ADD CONSTRAINT article_people_article_id_fkey
+        FOREIGN KEY (article_id) REFERENCES public.news_articles(id) NOT VALID;
+    ALTER TABLE public.article_locations ADD CONSTRAINT article_locations_article_id_fkey
+        FOREIGN KEY (article_id) REFERENCES public.news_articles(id) NOT VALID;
+    ALTER TABLE public.article_facilities ADD CONSTRAINT article_facilities_article_id_fkey
+        FOREIGN KEY (article_id) REFERENCES public.news_articles(id) NOT VALID;
+    ALTER TABLE public.article_organizations ADD CONSTRAINT article_organizations_article_id_fkey
+        FOREIGN KEY (article_id) REFERENCES public.news_articles(id) NOT VALID;
+    ALTER TABLE public.article_events ADD CONSTRAINT article_events_article_id_fkey
+        FOREIGN KEY (article_id) REFERENCES public.news_articles(id) NOT VALID;
+    ALTER TABLE public.article_simhash_bands ADD CONSTRAINT article_simhash_bands_article_id_fkey
+        FOREIGN KEY (article_id) REFERENCES public.news_articles(id) NOT VALID;
+END
+$$;
+
+ALTER TABLE public.article_people VALIDATE CONSTRAINT article_people_article_id_fkey;
+ALTER TABLE public.article_locations VALIDATE CONSTRAINT article_locations_article_id_fkey;
+ALTER TABLE public.article_facilities VALIDATE CONSTRAINT article_facilities_article_id_fkey;
+ALTER TABLE public.article_organizations VALIDATE CONSTRAINT article_organizations_article_id_fkey;
+ALTER TABLE public.article_events VALIDATE CONSTRAINT article_events_article_id_fkey;
+ALTER TABLE public.article_simhash_bands VALIDATE CONSTRAINT article_simhash_bands_article_id_fkey;
+
+ANALYZE public.news_articles;
+ANALYZE public.news_article_texts;
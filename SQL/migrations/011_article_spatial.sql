@@ -0,0 +1,64 @@
+--
+-- A summary of the resolved locations of each article, so "articles near X" and heat maps are index lookups on one
+-- narrow table instead of joins from article_locations to locations.  Used when SPATIAL Enabled is on, the DB writer
+-- replaces an article's row whenever its links are written.
+--
+--   centroid          the centre of the article's locations
+--   centroid_geohash  geohash of the centroid, for prefix searches and for grouping on a prefix for heat maps
+--   bbox              bounding box of the article's locations (a point when there is only one)
+--   geohashes         geohash of every location, for "mentions anywhere in these cells" with &&
+--
+-- The backfill at the end uses geohash precision 5 (cells of about 5km), change it to match GeohashPrecision if you
+-- set that to something else.  It works through the articles in batches of ids, committing after each, so it needs
+-- PostgreSQL 11 or later and psql must not be run with --single-transaction.
+--
+
+CREATE TABLE IF NOT EXISTS public.article_spatial (
+    article_id bigint PRIMARY KEY REFERENCES public.news_articles(id),
+    location_count integer NOT NULL,
+    centroid public.geometry(Point, 4326),
+    centroid_geohash text,
+    bbox public.geometry(Geometry, 4326),
+    geohashes text[] NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_article_spatial_centroid ON public.article_spatial USING gist (centroid);
+CREATE INDEX IF NOT EXISTS idx_article_spatial_bbox ON public.article_spatial USING gist (bbox);
+CREATE INDEX IF NOT EXISTS idx_article_spatial_centroid_geohash
+    ON public.article_spatial USING btree (centroid_geohash text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_article_spatial_geohashes ON public.article_spatial USING gin (geohashes);
+
+DO $$
+DECLARE
+    batch_size CONSTANT bigint := 50000;
+    geohash_precision CONSTANT integer := 5;
+    low bigint;
+    high bigint;
+BEGIN
+    SELECT MIN(id), MAX(id) INTO low, high FROM public.news_articles;
+
+    WHILE low <= high LOOP
+        INSERT INTO public.article_spatial (article_id, location_count, centroid, centroid_geohash, bbox, geohashes)
+        SELECT article_id, location_count, centroid, ST_GeoHash(centroid, geohash_precision), bbox, geohashes
+        FROM (
+            SELECT article_locations.article_id,
+                   COUNT(DISTINCT locations.id) AS location_count,
+                   ST_Centroid(ST_Collect(locations.the_geom)) AS centroid,
+                   ST_Envelope(ST_Collect(locations.the_geom)) AS bbox,
+                   ARRAY_AGG(DISTINCT ST_GeoHash(locations.the_geom, geohash_precision)) AS geohashes
+            FROM public.article_locations
+            JOIN public.locations ON locations.id = article_locations.location_id
+            WHERE article_locations.article_id >= low AND article_locations.article_id < low + batch_size
+              AND locations.the_geom IS NOT NULL
+            GROUP BY article_locations.article_id
+        ) AS summary
+        ON CONFLICT (article_id) DO NOTHING;
+
+        COMMIT;
+
+        low := low + batch_size;
+    END LOOP;
+END
+$$;
+
+ANALYZE public.article_spatial;
@@ -0,0 +1,6 @@
+--
+-- The subscription each pending article was discovered in, so the extract mode can process it with the subscription's
+-- NLP profile.  Articles discovered before this migration have NULL and use the global NLP section.
+--
+
+ALTER TABLE public.pending_articles ADD COLUMN IF NOT EXISTS subscription_url text;
@@ -0,0 +1,30 @@
+--
+-- Trigram indexes on the entity names.  When the writer flushes a batch in bulk mode it matches all of the names the
+-- exact and alias checks missed in one join, using name % name AND SIMILARITY(name, name) > 0.5.  The % operator can
+-- use these indexes (the default pg_trgm.similarity_threshold of 0.3 is below 0.5, so it never drops a match), where
+-- SIMILARITY() on its own has to compare every name against every row of the table.
+--
+-- The indexes are built CONCURRENTLY so the extractor can keep writing, which means this file can't be run inside a
+-- transaction.  If a build is interrupted it leaves an INVALID index behind that IF NOT EXISTS will skip, drop it and
+-- run the file again.
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_people_name_trgm
+    ON public.people USING gin (name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_locations_name_trgm
+    ON public.locations USING gin (name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facilities_name_trgm
+    ON public.facilities USING gin (name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_organizations_name_trgm
+    ON public.organizations USING gin (name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_event_name_trgm
+    ON public.event USING gin (name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_countries_name_trgm
+    ON public.countries USING gin (name gin_trgm_ops);
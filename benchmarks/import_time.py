@@ -0,0 +1,181 @@
+# coding=utf-8
+
+"""
+import_time.py
+Checks how long the modules each kind of process starts with take to import (using python -X importtime), and that
+they don't pull in the heavy dependencies they don't need.  It also creates a website object the way the discover mode
+does, to check that doesn't load Spacy.  That needs the database in config.ini and is skipped without it.  Exits with 1
+if a module is over its budget or imports something it shouldn't, so it can be run before committing to catch
+regressions.
+
+    python benchmarks/import_time.py [--runs N] [--scale X]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Dependencies that are slow to import and only needed in some processes
+HEAVY_MODULES = ["spacy", "thinc", "numpy", "feedparser", "fuzzywuzzy", "requests", "bs4", "lxml", "aiohttp",
+                 "asyncpg", "pyarrow"]
+
+# Module to import: (budget in milliseconds, modules it must not import)
+TARGETS = {"websites": (150.0, HEAVY_MODULES),
+           "DBWriter": (150.0, HEAVY_MODULES),
+           "ArticleQueue": (50.0, HEAVY_MODULES + ["psycopg2"]),
+           "AsyncEngine": (150.0, HEAVY_MODULES),
+           "newsextractor": (250.0, HEAVY_MODULES)}
+
+# Budget in milliseconds for creating a website object for the discover mode, and the modules it must not import
+DISCOVER_BUDGET = (500.0, ["spacy", "thinc", "numpy"])
+
+# Run in a fresh interpreter.  Prints whether the object was created, the milliseconds it took and the imported modules.
+DISCOVER_CODE = """
+import sys
+import time
+from configparser import ConfigParser
+startTime = time.perf_counter()
+import websites
+configObject = ConfigParser()
+configObject.read("config.ini")
+websiteObject = websites.WebsiteFactory(("https://feeds.bbci.co.uk/news/rss.xml", "BBCWebsite"), [None],
+                                        configObject)
+print(int(websiteObject.good), (time.perf_counter() - startTime) * 1000.0, " ".join(sys.modules))
+"""
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+# **********************************************************************************************************************
+def ImportTime(inModule: str) -> Tuple[float, List[str], str]:
+    """
+    Import the module in a fresh interpreter and read back the -X importtime report
+    :param inModule: module to import
+    :return: (cumulative import time in milliseconds, names of everything imported, error output if the import failed)
+    """
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(inModule)],
+                            cwd=ROOT_PATH, capture_output=True, text=True)
+
+    cumulative = 0.0
+    imported = list()
+    errors = list()
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            errors.append(line)
+            continue
+
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+
+        name = fields[2].rstrip()
+        imported.append(name.strip())
+
+        # Only the module itself is at the top level of the report
+        if name.strip() == inModule and len(name) - len(name.lstrip()) == 1:
+            cumulative = int(fields[1]) / 1000.0
+
+    return cumulative, imported, "\n".join(errors) if result.returncode else str()
+
+
+# **********************************************************************************************************************
+def CheckTarget(inModule: str, inBudget: float, inForbidden: List[str], inRuns: int) -> bool:
+    """
+    Time a module and check it against its budget
+    :param inModule: module to import
+    :param inBudget: budget in milliseconds
+    :param inForbidden: top level packages it must not import
+    :param inRuns: number of runs, the fastest is used
+    :return: True if it passed
+    """
+
+    times = list()
+    imported = list()
+
+    for run in range(inRuns):
+        cumulative, imported, error = ImportTime(inModule)
+        if error:
+            print("{:<16} FAILED to import:\n{}".format(inModule, error))
+            return False
+
+        times.append(cumulative)
+
+    fastest = min(times)
+    heavy = sorted({name.split(".")[0] for name in imported} & set(inForbidden))
+
+    passed = fastest <= inBudget and not heavy
+
+    print("{:<16} {:8.1f} ms (budget {:.1f} ms){}{}".format(inModule, fastest, inBudget,
+                                                           "" if passed else "  FAILED",
+                                                           "  imports {}".format(", ".join(heavy)) if heavy else ""))
+
+    return passed
+
+
+# **********************************************************************************************************************
+def CheckDiscoverWebsite(inBudget: float, inForbidden: List[str], inRuns: int) -> bool:
+    """
+    Time creating a website object for the discover mode, which only reads the feed and never needs the model
+    :param inBudget: budget in milliseconds
+    :param inForbidden: top level packages it must not import
+    :param inRuns: number of runs, the fastest is used
+    :return: True if it passed or was skipped
+    """
+
+    times = list()
+    imported = list()
+
+    for run in range(inRuns):
+        result = subprocess.run([sys.executable, "-c", DISCOVER_CODE], cwd=ROOT_PATH, capture_output=True, text=True)
+        if result.returncode:
+            print("{:<16} FAILED to create:\n{}".format("discover website", result.stderr))
+            return False
+
+        good, elapsed, modules = result.stdout.strip().splitlines()[-1].split(" ", 2)
+        if good != "1":
+            print("{:<16} skipped, the website object couldn't be created (is the database up?)".format(
+                  "discover website"))
+            return True
+
+        times.append(float(elapsed))
+        imported = modules.split()
+
+    fastest = min(times)
+    heavy = sorted({name.split(".")[0] for name in imported} & set(inForbidden))
+
+    passed = fastest <= inBudget and not heavy
+
+    print("{:<16} {:8.1f} ms (budget {:.1f} ms){}{}".format("discover website", fastest, inBudget,
+                                                           "" if passed else "  FAILED",
+                                                           "  imports {}".format(", ".join(heavy)) if heavy else ""))
+
+    return passed
+
+
+# **********************************************************************************************************************
+def ParseArguments() -> argparse.Namespace:
+    """
+    Parse the command line
+    :return: argparse Namespace
+    """
+
+    parser = argparse.ArgumentParser(description="Check the import time of the modules each process starts with")
+    parser.add_argument("--runs", type=int, default=5, help="number of runs per module, the fastest is used")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the budgets (for slow machines)")
+
+    return parser.parse_args()
+
+
+# **********************************************************************************************************************
+if __name__ == '__main__':
+    arguments = ParseArguments()
+
+    results = [CheckTarget(module, budget * arguments.scale, forbidden, arguments.runs)
+               for module, (budget, forbidden) in TARGETS.items()]
+    results.append(CheckDiscoverWebsite(DISCOVER_BUDGET[0] * arguments.scale, DISCOVER_BUDGET[1], arguments.runs))
+
+    sys.exit(0 if all(results) else 1)
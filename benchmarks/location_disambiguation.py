@@ -0,0 +1,175 @@
+# coding=utf-8
+
+"""
+location_disambiguation.py
+Compares the two ways the gazetteer matches an article's locations for speed and accuracy: the cascade (the same rules
+as the location queries in DBWriter) and the co-location scoring.  The corpus is a JSON lines file of articles with
+their location names and, for the names worth checking, the country code and coordinates of the right place.  A match
+is right if it is in that country and within --tolerance kilometres of the coordinates.  It needs a gazetteer snapshot
+built with --mode gazetteer.
+
+    python benchmarks/location_disambiguation.py [--corpus FILE] [--runs N] [--tolerance KM] [--verbose]
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from configparser import ConfigParser
+from typing import Callable, Dict, List, Tuple
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+from Gazetteer import Gazetteer
+from Gazetteer.Gazetteer import EARTH_RADIUS_KILOMETRES
+
+
+# **********************************************************************************************************************
+def ReadCorpus(inCorpusPath: str) -> List[dict]:
+    """
+    Read the labelled articles
+    :param inCorpusPath: JSON lines file, one {"title", "locations", "expected"} object per article
+    :return: list of articles
+    """
+
+    with open(inCorpusPath, encoding="utf-8") as corpusFile:
+        return [json.loads(line) for line in corpusFile if line.strip()]
+
+
+# **********************************************************************************************************************
+def Distance(inLatitude1: float, inLongitude1: float, inLatitude2: float, inLongitude2: float) -> float:
+    """
+    Great circle distance
+    :return: kilometres
+    """
+
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (inLatitude1, inLongitude1, inLatitude2,
+                                                                      inLongitude2))
+
+    a = (math.sin((latitude2 - latitude1) / 2.0) ** 2 +
+         math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2.0) ** 2)
+
+    return 2.0 * EARTH_RADIUS_KILOMETRES * math.asin(math.sqrt(min(a, 1.0)))
+
+
+# **********************************************************************************************************************
+def RunMethod(inMethod: Callable, inArticles: List[dict], inRuns: int) -> Tuple[float, List[Dict[str, int]]]:
+    """
+    Match the locations of every article
+    :param inMethod: Gazetteer.ResolveLocations or Gazetteer.ScoreLocations
+    :param inArticles: corpus
+    :param inRuns: number of runs, the fastest is used
+    :return: (seconds for the corpus, name -> location id for each article)
+    """
+
+    fastest = None
+    matches = list()
+
+    for run in range(inRuns):
+        startTime = time.perf_counter()
+        matches = [inMethod(article["locations"]) for article in inArticles]
+        elapsed = time.perf_counter() - startTime
+
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+
+    return fastest, matches
+
+
+# **********************************************************************************************************************
+def Check(inGazetteer: Gazetteer, inArticles: List[dict], inMatches: List[Dict[str, int]], inTolerance: float,
+          inLabel: str, inVerbose: bool) -> Tuple[int, int, int]:
+    """
+    Check the matches against the expected places
+    :param inGazetteer: loaded gazetteer, to look up the matched locations
+    :param inArticles: corpus
+    :param inMatches: name -> location id for each article
+    :param inTolerance: kilometres a match can be from the expected coordinates
+    :param inLabel: method name, for the verbose output
+    :param inVerbose: print each wrong or missing match
+    :return: (labelled names matched, labelled names matched to the right place, labelled names)
+    """
+
+    matched, correct, labelled = 0, 0, 0
+
+    for article, matches in zip(inArticles, inMatches):
+        for name, (cc2, latitude, longitude) in article["expected"].items():
+            labelled += 1
+
+            if name not in matches:
+                if inVerbose:
+                    print("  {:<8} {:<40} {:<14} not matched".format(inLabel, article["title"][:40], name))
+                continue
+
+            matched += 1
+            found = inGazetteer.Describe(matches[name])
+
+            if found and found[0] == cc2 and Distance(latitude, longitude, found[1], found[2]) <= inTolerance:
+                correct += 1
+            elif inVerbose:
+                print("  {:<8} {:<40} {:<14} got {} expected {} {:.2f},{:.2f}".format(
+                      inLabel, article["title"][:40], name, found, cc2, latitude, longitude))
+
+    return matched, correct, labelled
+
+
+# **********************************************************************************************************************
+def ParseArguments() -> argparse.Namespace:
+    """
+    Parse the command line
+    :return: argparse Namespace
+    """
+
+    parser = argparse.ArgumentParser(description="Compare the cascade and the co-location scoring for matching "
+                                                 "locations")
+    parser.add_argument("--corpus", default=os.path.join(ROOT_PATH, "benchmarks", "corpus", "locations.jsonl"),
+                        help="JSON lines file of labelled articles")
+    parser.add_argument("--config", default=os.path.join(ROOT_PATH, "config.ini"), help="config file")
+    parser.add_argument("--runs", type=int, default=5, help="number of runs per method, the fastest is used")
+    parser.add_argument("--tolerance", type=float, default=100.0,
+                        help="kilometres a match can be from the expected coordinates")
+    parser.add_argument("--verbose", action="store_true", help="list the wrong and missing matches")
+
+    return parser.parse_args()
+
+
+# **********************************************************************************************************************
+if __name__ == '__main__':
+    arguments = ParseArguments()
+
+    configObject = ConfigParser()
+    configObject.read(arguments.config)
+
+    articles = ReadCorpus(arguments.corpus)
+    if not articles:
+        print("No articles in {}".format(arguments.corpus))
+        sys.exit(1)
+
+    gazetteer = Gazetteer(configObject)
+    if not gazetteer.Load():
+        print("No gazetteer snapshot, build one with python newsextractor.py --mode gazetteer")
+        sys.exit(1)
+
+    names = sum(len(article["locations"]) for article in articles)
+    print("{} articles, {} location names, {} labelled\n".format(
+          len(articles), names, sum(len(article["expected"]) for article in articles)))
+
+    methods = [("cascade", gazetteer.ResolveLocations), ("scored", gazetteer.ScoreLocations)]
+    results = list()
+
+    for label, method in methods:
+        elapsed, matches = RunMethod(method, articles, arguments.runs)
+        results.append((label, elapsed) + Check(gazetteer, articles, matches, arguments.tolerance, label,
+                                                arguments.verbose))
+
+    print("\n{:<10} {:>12} {:>8} {:>9} {:>9} {:>9}".format("method", "articles/s", "speedup", "matched", "correct",
+                                                           "accuracy"))
+
+    referenceTime = results[0][1]
+
+    for label, elapsed, matched, correct, labelled in results:
+        print("{:<10} {:>12.0f} {:>7.1f}x {:>9} {:>9} {:>8.1%}".format(label, len(articles) / elapsed,
+                                                                      referenceTime / elapsed, matched, correct,
+                                                                      correct / labelled if labelled else 1.0))
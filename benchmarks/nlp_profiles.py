@@ -0,0 +1,179 @@
+# coding=utf-8
+
+"""
+nlp_profiles.py
+Compares the NLP profiles in config.ini for speed and accuracy.  Each profile runs over a corpus of article texts, and
+the entities it finds (the labels we keep, plus the problem entities) are compared against the ones the reference
+profile finds, so you can see how much a faster model or a shorter pipeline gives up.
+
+    python benchmarks/nlp_profiles.py [profile ...] [--reference NAME] [--corpus DIR] [--runs N]
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from configparser import ConfigParser
+from typing import List, Set, Tuple
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+from websites.WebsiteBase import DisabledPipes, GOOD_LABELS, LoadModel, ReadNLPProfile, UpdateEntityRuler
+
+
+# **********************************************************************************************************************
+def ReadCorpus(inCorpusPath: str) -> List[str]:
+    """
+    Read every .txt file in the corpus directory
+    :param inCorpusPath: directory of article texts
+    :return: list of texts, sorted by file name
+    """
+
+    texts = list()
+
+    for fileName in sorted(os.listdir(inCorpusPath)):
+        if fileName.endswith(".txt"):
+            with open(os.path.join(inCorpusPath, fileName), encoding="utf-8") as textFile:
+                texts.append(textFile.read())
+
+    return texts
+
+
+# **********************************************************************************************************************
+def ReadProblemEntities(inPath: str) -> List[Tuple]:
+    """
+    Read the problem entities from the csv that's loaded into the problem_entities table
+    :param inPath: path to problem_entities.csv
+    :return: list of (entity_name, entity_spacy_label)
+    """
+
+    with open(inPath, encoding="utf-8", newline="") as csvFile:
+        return [(row["entity_name"], row["entity_spacy_label"]) for row in csv.DictReader(csvFile)]
+
+
+# **********************************************************************************************************************
+def RunProfile(inNLP, inProfile: dict, inTexts: List[str], inProblemEntities: List[Tuple],
+               inRuns: int) -> Tuple[float, List[Set]]:
+    """
+    Run the corpus through a profile
+    :param inNLP: the profile's model
+    :param inProfile: profile from ReadNLPProfile
+    :param inTexts: corpus
+    :param inProblemEntities: list of (entity_name, entity_spacy_label)
+    :param inRuns: number of runs, the fastest is used
+    :return: (seconds for the corpus, set of (label, text) entities for each text)
+    """
+
+    disabled = DisabledPipes(inNLP, inProfile)
+
+    # Warm up, the first call sets up a lot of things lazily
+    inNLP(inTexts[0], disable=disabled)
+
+    fastest = None
+    docs = list()
+
+    for run in range(inRuns):
+        startTime = time.perf_counter()
+        docs = list(inNLP.pipe(inTexts, disable=disabled))
+        elapsed = time.perf_counter() - startTime
+
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+
+    entities = list()
+    for text, doc in zip(inTexts, docs):
+        found = {(entity.label_, entity.text.strip()) for entity in doc.ents if entity.label_ in GOOD_LABELS}
+
+        # Without the EntityRuler the website objects look for the problem entities in the text
+        if not inProfile["entityRuler"]:
+            found |= {(label, entity) for entity, label in inProblemEntities if entity in text}
+
+        entities.append(found)
+
+    return fastest, entities
+
+
+# **********************************************************************************************************************
+def Compare(inEntities: List[Set], inReference: List[Set]) -> Tuple[float, float, float]:
+    """
+    Score entities against the reference profile's
+    :param inEntities: set of (label, text) for each text
+    :param inReference: set of (label, text) for each text from the reference profile
+    :return: (precision, recall, F1)
+    """
+
+    matched = sum(len(found & reference) for found, reference in zip(inEntities, inReference))
+    found = sum(len(entities) for entities in inEntities)
+    expected = sum(len(entities) for entities in inReference)
+
+    precision = matched / found if found else 1.0
+    recall = matched / expected if expected else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    return precision, recall, f1
+
+
+# **********************************************************************************************************************
+def ParseArguments() -> argparse.Namespace:
+    """
+    Parse the command line
+    :return: argparse Namespace
+    """
+
+    parser = argparse.ArgumentParser(description="Compare the speed and accuracy of the NLP profiles")
+    parser.add_argument("profiles", nargs="*", help="profiles to compare (the NLP:<name> sections of config.ini)")
+    parser.add_argument("--reference", default=str(), help="profile to compare against, the NLP section by default")
+    parser.add_argument("--corpus", default=os.path.join(ROOT_PATH, "benchmarks", "corpus"),
+                        help="directory of .txt article texts")
+    parser.add_argument("--config", default=os.path.join(ROOT_PATH, "config.ini"), help="config file")
+    parser.add_argument("--problem-entities", default=os.path.join(ROOT_PATH, "SQL", "problem_entities.csv"),
+                        help="problem entities csv")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs per profile, the fastest is used")
+
+    return parser.parse_args()
+
+
+# **********************************************************************************************************************
+if __name__ == '__main__':
+    arguments = ParseArguments()
+
+    configObject = ConfigParser()
+    configObject.read(arguments.config)
+
+    texts = ReadCorpus(arguments.corpus)
+    if not texts:
+        print("No .txt files in {}".format(arguments.corpus))
+        sys.exit(1)
+
+    problemEntities = ReadProblemEntities(arguments.problem_entities)
+    words = sum(len(text.split()) for text in texts)
+
+    profileNames = [arguments.reference] + [name for name in arguments.profiles if name != arguments.reference]
+    profiles = [ReadNLPProfile(configObject, name) for name in profileNames]
+
+    # Load everything first.  Profiles share models, and the EntityRuler has to be in place before the pipes to disable
+    # are worked out.
+    models = [LoadModel(profile["model"]) for profile in profiles]
+    for model, profile in zip(models, profiles):
+        if profile["entityRuler"]:
+            UpdateEntityRuler(model, problemEntities)
+
+    print("{} texts, {} words\n".format(len(texts), words))
+    print("{:<12} {:<18} {:<6} {:<6} {:>10} {:>8} {:>10} {:>8} {:>8}".format("profile", "model", "pipe", "ruler",
+                                                                           "words/s", "speedup", "precision",
+                                                                           "recall", "F1"))
+
+    referenceTime, referenceEntities = None, None
+
+    for name, model, profile in zip(profileNames, models, profiles):
+        elapsed, entities = RunProfile(model, profile, texts, problemEntities, arguments.runs)
+
+        if referenceTime is None:
+            referenceTime, referenceEntities = elapsed, entities
+
+        precision, recall, f1 = Compare(entities, referenceEntities)
+
+        print("{:<12} {:<18} {:<6} {:<6} {:>10.0f} {:>7.1f}x {:>10.3f} {:>8.3f} {:>8.3f}".format(
+              name or "(global)", profile["model"], profile["pipeline"], "yes" if profile["entityRuler"] else "no",
+              words / elapsed, referenceTime / elapsed, precision, recall, f1))
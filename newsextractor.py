@@ -5,15 +5,24 @@ newsextractor.py
 Main driver program that creates the queue and subprocesses
 """
 
+import argparse
 from configparser import ConfigParser
-import multiprocessing
 import os
+import signal
 import sys
+import threading
 from typing import List
 import time
 import psycopg2
 import websites
+from ArticleQueue import ArticleQueue
+from ArticleWorker import ArticleWorker
 from DBWriter import DBWriter
+from AsyncEngine import AsyncFeedEngine
+from Exporter import Exporter
+from FeedScheduler import FeedScheduler
+from LeaseManager import LeaseManager
+from Reprocessor import Reprocessor
 
 
 # **********************************************************************************************************************
@@ -73,8 +82,8 @@ def AddPoisonPill():
         # Create the poison pill
         killArticle.articleText = "EXITCALLED"
 
-        # Place the poison pill on the queue
-        articleQueue.put(killArticle)
+        # Place the poison pill on the queue.  This has to get through, so wait for as long as it takes.
+        articleQueue.put(killArticle, timeout=None)
 
         return
     except Exception as e:
@@ -83,43 +92,352 @@ def AddPoisonPill():
 
 
 # **********************************************************************************************************************
-if __name__ == '__main__':
+def ParseArguments() -> argparse.Namespace:
+    """
+    Parse the command line
+    :return: argparse Namespace
+    """
+
+    parser = argparse.ArgumentParser(description="Website news article scraper and geospatial enabler")
+    parser.add_argument("--mode", choices=["once", "async", "daemon", "reprocess", "discover", "extract", "export",
+                                           "gazetteer"],
+                        default="once",
+                        help="once: process each subscription in turn (default).  async: fetch every feed and "
+                             "article concurrently and run the NLP in a process pool.  daemon: keep running and poll "
+                             "each subscription on its own interval until SIGTERM.  reprocess: re-run the entity "
+                             "extraction over the articles already in the database.  discover: add the new articles "
+                             "in the feeds to pending_articles.  extract: process the articles in pending_articles.  "
+                             "export: write the articles added since the last export to Parquet files.  "
+                             "gazetteer: build the snapshot of the locations used to match locations in memory.")
+    parser.add_argument("--list-websites", action="store_true",
+                        help="list the website classes that can be used and check the class names in the "
+                             "subscriptions table, then exit")
+
+    return parser.parse_args()
+
+
+# **********************************************************************************************************************
+def ValidateSubscriptions(inURLList: List) -> List:
+    """
+    Check that the website class of every subscription can be loaded, so a typo in the subscriptions table shows up
+    at startup instead of halfway through a run
+    :param inURLList: list of (url, classname) tuples
+    :return: the subscriptions whose class is OK
+    """
+
+    errors = websites.ValidateWebsiteClasses([classname for url, classname in inURLList])
+
+    for classname, error in sorted(errors.items()):
+        print("newsextractor: Skipping the subscriptions using {}: {}".format(classname, error))
+
+    return [(url, classname) for url, classname in inURLList if classname not in errors]
+
+
+# **********************************************************************************************************************
+def ListWebsites(inConfigObject: ConfigParser):
+    """
+    Print the website classes we can find and check the subscriptions against them
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    print("Website classes:")
+    for classname in websites.ListWebsiteClasses():
+        print("    {}".format(classname))
+
+    urlList = GetSubscriptions(inConfigObject)
+    validList = ValidateSubscriptions(urlList)
+
+    print("{} of {} subscriptions have a usable website class".format(len(validList), len(urlList)))
+
+
+# **********************************************************************************************************************
+def RunOnce(inURLList: List, inConfigObject: ConfigParser):
+    """
+    Process each subscription one after the other
+    :param inURLList: list of (url, classname) tuples
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    for url in inURLList:
+        websiteObject = websites.WebsiteFactory(url, articleQueue, inConfigObject)
+        websiteObject.ProcessFeed()
+
+
+# **********************************************************************************************************************
+def RunDiscover(inURLList: List, inConfigObject: ConfigParser):
+    """
+    Add the new articles in each subscription to pending_articles for the extract mode
+    :param inURLList: list of (url, classname) tuples
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    for url in inURLList:
+        websiteObject = websites.WebsiteFactory(url, articleQueue, inConfigObject)
+        websiteObject.DiscoverFeed()
+
+
+# **********************************************************************************************************************
+def RunExtract(inConfigObject: ConfigParser):
+    """
+    Process the articles in pending_articles until there are none left that are due (or until SIGTERM or SIGINT if
+    EXTRACT IdleWait is set)
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    articleWorker = ArticleWorker(articleQueue, inConfigObject)
+    if not articleWorker.good:
+        print("newsextractor: Unable to start the article worker.")
+        return
+
+    def StopHandler(inSignal, inFrame):
+        print("newsextractor: Got signal {}, finishing the current article...".format(inSignal))
+        articleWorker.Stop()
+
+    signal.signal(signal.SIGTERM, StopHandler)
+    signal.signal(signal.SIGINT, StopHandler)
+
+    articleWorker.Run()
+
+
+# **********************************************************************************************************************
+def RunAsync(inURLList: List, inConfigObject: ConfigParser):
+    """
+    Process all of the subscriptions concurrently on an asyncio event loop
+    :param inURLList: list of (url, classname) tuples
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    asyncEngine = AsyncFeedEngine(articleQueue, inConfigObject)
+    if not asyncEngine.good:
+        print("newsextractor: Unable to start the async engine.")
+        return
+
+    asyncEngine.Run(inURLList)
+
+
+# **********************************************************************************************************************
+def RunSharded(inMode: str, inConfigObject: ConfigParser):
+    """
+    Claim batches of subscriptions from the database and process them until there are none left that are due.  Other
+    instances running against the same database claim their own batches.  Only feeds last polled before the run
+    started are claimed, so a run that takes longer than RepollAfter still finishes, and the leases are renewed while
+    a batch is being processed.
+    :param inMode: once, async or discover
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    leaseManager = LeaseManager(inConfigObject)
+    if not leaseManager.good:
+        print("newsextractor: Unable to start the lease manager.")
+        return
+
+    runStart = leaseManager.DatabaseTime()
+    if runStart is None:
+        print("newsextractor: Unable to read the time from the database.")
+        return
+
+    # One engine and worker pool for every batch, so the workers only load the models once.  Started before the
+    # renewer threads so the forked workers don't inherit them.
+    asyncEngine = None
+    if inMode == "async":
+        asyncEngine = AsyncFeedEngine(articleQueue, inConfigObject)
+        if not asyncEngine.Start():
+            print("newsextractor: Unable to start the async engine.")
+            return
+
     try:
-        localtime = time.asctime(time.localtime(time.time()))
-        print("Local current time :", localtime)
+        while True:
+            urlList = leaseManager.ClaimBatch(runStart)
+            if not urlList:
+                break
+
+            urls = [url for url, classname in urlList]
+            stopRenewing = threading.Event()
+            renewer = threading.Thread(target=leaseManager.RenewUntil, args=(urls, stopRenewing), daemon=True)
+            renewer.start()
+
+            try:
+                if inMode == "async":
+                    asyncEngine.Run(urlList)
+                elif inMode == "discover":
+                    RunDiscover(urlList, inConfigObject)
+                else:
+                    RunOnce(urlList, inConfigObject)
+            finally:
+                stopRenewing.set()
+                renewer.join()
+                leaseManager.Release(urls)
+    finally:
+        if asyncEngine:
+            asyncEngine.Stop()
 
-        # Create our queue object
-        articleQueue = multiprocessing.Queue()
 
-        # Create our configuration object
-        # Get the base directory for this file
-        plugin_path = os.path.dirname(os.path.realpath(__file__))
+# **********************************************************************************************************************
+def RunDaemon(inConfigObject: ConfigParser):
+    """
+    Keep polling the subscriptions until we get SIGTERM or SIGINT
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
 
-        # Now create the object and read in the config.ini
-        configObject = ConfigParser()
-        configObject.read(plugin_path + "/config.ini")
+    feedScheduler = FeedScheduler(articleQueue, inConfigObject)
+    if not feedScheduler.good:
+        print("newsextractor: Unable to start the feed scheduler.")
+        return
+
+    def StopHandler(inSignal, inFrame):
+        print("newsextractor: Got signal {}, finishing the feeds in progress...".format(inSignal))
+        feedScheduler.Stop()
 
-        # Get the list of subscriptions and their objects that we need to process
-        urlList = GetSubscriptions(configObject)
+    signal.signal(signal.SIGTERM, StopHandler)
+    signal.signal(signal.SIGINT, StopHandler)
+
+    feedScheduler.Run()
+
+
+# **********************************************************************************************************************
+def RunReprocess(inConfigObject: ConfigParser):
+    """
+    Re-run the entity extraction over the stored articles
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    reprocessor = Reprocessor(articleQueue, inConfigObject)
+    if not reprocessor.good:
+        print("newsextractor: Unable to start the reprocessor.")
+        return
+
+    reprocessor.Run()
+
+
+# **********************************************************************************************************************
+def RunExport(inConfigObject: ConfigParser):
+    """
+    Export the articles added since the last export
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    exporter = Exporter(inConfigObject)
+    if not exporter.good:
+        print("newsextractor: Unable to start the exporter.")
+        return
+
+    exporter.Run()
+
+
+# **********************************************************************************************************************
+def RunGazetteer(inConfigObject: ConfigParser):
+    """
+    Build the gazetteer snapshot from the locations table
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    # Imported here since it needs numpy, which nothing else in this process does
+    from Gazetteer import Gazetteer
+
+    gazetteer = Gazetteer(inConfigObject)
+    if not gazetteer.good or not gazetteer.Build():
+        print("newsextractor: Unable to build the gazetteer.")
+
+
+# **********************************************************************************************************************
+def RunFeeds(inMode: str, inConfigObject: ConfigParser):
+    """
+    Process the subscriptions with the DB writer running in its own process.  Discovery only writes to
+    pending_articles, so it doesn't need the writer.
+    :param inMode: once, async, daemon, discover or extract
+    :param inConfigObject: global config object
+    :return: Nothing
+    """
+
+    # Get the list of subscriptions and their objects that we need to process.  Extraction works from
+    # pending_articles instead.
+    urlList = list()
+    if inMode != "extract":
+        urlList = ValidateSubscriptions(GetSubscriptions(inConfigObject))
 
         # If we do not have a list of URLS to process, just exit
         if not urlList:
             print("newsextractor: No list of subscriptions.  Exiting...")
             sys.exit(-1)
 
-        # Create and start the DB Writer
-        dbWriter = DBWriter(articleQueue, configObject)
-        dbWriter.start()
+    # In the long running modes the writer has to outlive a SIGTERM sent to the whole process group so it can drain
+    # the queue.  It inherits these dispositions and stops when it gets the poison pill.
+    if inMode in ["daemon", "extract"]:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-        # Start processing
-        for url in urlList:
-            websiteObject = websites.WebsiteFactory(url, articleQueue, configObject)
-            websiteObject.ProcessFeed()
+    # Create and start the DB Writer
+    dbWriter = None
+    if inMode != "discover":
+        dbWriter = DBWriter(articleQueue, inConfigObject)
+        dbWriter.start()
 
+    # Start processing.  When sharding, the subscriptions are claimed from the database a batch at a time.
+    sharded = inConfigObject.has_section("SHARDING") and inConfigObject["SHARDING"].getboolean("Enabled", False)
+
+    if inMode == "daemon":
+        RunDaemon(inConfigObject)
+    elif inMode == "extract":
+        RunExtract(inConfigObject)
+    elif sharded:
+        RunSharded(inMode, inConfigObject)
+    elif inMode == "async":
+        RunAsync(urlList, inConfigObject)
+    elif inMode == "discover":
+        RunDiscover(urlList, inConfigObject)
+    else:
+        RunOnce(urlList, inConfigObject)
+
+    if dbWriter:
         AddPoisonPill()
 
         dbWriter.join()
 
+        articleQueue.ReportMetrics()
+
+
+# **********************************************************************************************************************
+if __name__ == '__main__':
+    try:
+        arguments = ParseArguments()
+
+        localtime = time.asctime(time.localtime(time.time()))
+        print("Local current time :", localtime)
+
+        # Create our configuration object
+        # Get the base directory for this file
+        plugin_path = os.path.dirname(os.path.realpath(__file__))
+
+        # Now create the object and read in the config.ini
+        configObject = ConfigParser()
+        configObject.read(plugin_path + "/config.ini")
+
+        # Create our queue object
+        articleQueue = ArticleQueue(configObject)
+
+        # Reprocessing and exporting work on what is already in the database, so they don't need the subscriptions or the
+        # writer
+        if arguments.list_websites:
+            ListWebsites(configObject)
+        elif arguments.mode == "reprocess":
+            RunReprocess(configObject)
+        elif arguments.mode == "export":
+            RunExport(configObject)
+        elif arguments.mode == "gazetteer":
+            RunGazetteer(configObject)
+        else:
+            RunFeeds(arguments.mode, configObject)
+
         localtime = time.asctime(time.localtime(time.time()))
         print("Local current time :", localtime)
 
@@ -7,11 +7,112 @@ Describes the class responsible for parsing BBC News articles
 
 import multiprocessing
 import configparser
-import requests
+import re
+from urllib.parse import urlparse, urlunparse
 from bs4 import BeautifulSoup
+from .Registry import RegisterWebsite
 from .WebsiteBase import WebsiteBase
 
 
+class _StoryBodyTarget(object):
+    """
+    lxml parser target that collects the text of the story body as the page is parsed, leaving out the same parts
+    _ExtractText does.  A page can have more than one story body, so the text of all of them is collected.
+    """
+
+    # ******************************************************************************************************************
+    def __init__(self):
+        """
+        Instance constructor
+        """
+
+        # Text of the story body, one entry per text node
+        self._strings = list()
+
+        # Pieces of the text node we're in the middle of.  The parser can hand a text node over in more than one go.
+        self._text = list()
+
+        # Number of elements open in the story body (including it), 0 when we're not in it
+        self._depth = 0
+
+        # Number of elements open in a part of the story body we're leaving out, 0 when we're not in one
+        self._skipDepth = 0
+
+    # ******************************************************************************************************************
+    @staticmethod
+    def _IsSkipped(inTag: str, inAttributes) -> bool:
+        """
+        Check if an element is one of the ones _ExtractText removes
+        :param inTag: tag name
+        :param inAttributes: attributes of the element
+        :return: True if its contents should be left out
+        """
+
+        classes = inAttributes.get("class", str()).split()
+
+        return inTag in ("figure", "script", "style") or \
+            (inTag == "div" and "social-embed" in classes) or \
+            (inTag == "ul" and "story-body__unordered-list" in classes) or \
+            (inTag == "a" and "story-body__link-external" in classes)
+
+    # ******************************************************************************************************************
+    def _FlushText(self):
+        """
+        Finish the current text node
+        """
+
+        text = "".join(self._text).strip()
+        if text:
+            self._strings.append(text)
+
+        self._text = list()
+
+    # ******************************************************************************************************************
+    def start(self, tag, attrib):
+        self._FlushText()
+
+        if not self._depth:
+            if tag == "div" and "story-body__inner" in attrib.get("class", str()).split():
+                self._depth = 1
+            return
+
+        self._depth += 1
+
+        if self._skipDepth:
+            self._skipDepth += 1
+        elif self._IsSkipped(tag, attrib):
+            self._skipDepth = 1
+
+    # ******************************************************************************************************************
+    def end(self, tag):
+        self._FlushText()
+
+        if not self._depth:
+            return
+
+        self._depth -= 1
+
+        if self._skipDepth:
+            self._skipDepth -= 1
+
+    # ******************************************************************************************************************
+    def data(self, data):
+        if self._depth and not self._skipDepth:
+            self._text.append(data)
+
+    # ******************************************************************************************************************
+    def comment(self, text):
+        # Comments aren't part of the text, but they do separate the text on either side of them
+        self._FlushText()
+
+    # ******************************************************************************************************************
+    def close(self) -> str:
+        self._FlushText()
+
+        return " ".join(self._strings)
+
+
+@RegisterWebsite([r"(www\.)?bbc\.co\.uk", r"(www\.)?bbc\.com"])
 class BBCWebsite(WebsiteBase):
     """
     This class contains the logic necessary to parse BBC News articles
@@ -29,19 +130,34 @@ class BBCWebsite(WebsiteBase):
         super().__init__(inQueue, inConfigObject, inURL)
 
     # ******************************************************************************************************************
-    def _ParseArticle(self, inURL: str) -> str:
+    @classmethod
+    def CanonicalizeURL(cls, inURL: str) -> str:
+        """
+        BBC stories show up under both bbc.com and bbc.co.uk and under different section names (/news/uk-12345678 vs
+        /news/world-europe-12345678).  The number at the end is the story id, so reduce the path to just that.
+        :param inURL: article URL
+        :return: canonical URL
         """
-        Method to take the input URL, download the text, strip out the tags, and return the raw text
-        :param inURL: URL to download
+
+        parsedURL = urlparse(super().CanonicalizeURL(inURL))
+
+        host = re.sub(r"bbc\.com$", "bbc.co.uk", parsedURL.netloc)
+
+        path = re.sub(r"^/news/(?:[a-z0-9-]+-)?(\d{6,})$", r"/news/\1", parsedURL.path)
+
+        return urlunparse((parsedURL.scheme, host, path, str(), parsedURL.query, str()))
+
+    # ******************************************************************************************************************
+    def _ExtractText(self, inContent: bytes) -> str:
+        """
+        Method to take the downloaded page, strip out the tags, and return the raw text
+        :param inContent: raw page content
         :return: string containing the processed text
         """
 
         try:
-            # Get the webpage
-            myRequest = requests.get(inURL)
-
             # Create our BeautifulSoup object
-            mySoup = BeautifulSoup(myRequest.content, "lxml")
+            mySoup = BeautifulSoup(inContent, "lxml")
 
             # Strip out the tags we don't want
             for tEntity in mySoup(['figure', 'script']):
@@ -73,6 +189,42 @@ class BBCWebsite(WebsiteBase):
             # Return the full article text
             return returnText
         except Exception as e:
-            print("Exception in BBCWebsite::_ParseArticle: {}".format(e))
+            print("Exception in BBCWebsite::_ExtractText: {}".format(e))
+            self.good = False
+            return str()
+
+    # ******************************************************************************************************************
+    def _ExtractTextStream(self, inChunks, inEncoding: str) -> str:
+        """
+        Parse the page with lxml as it downloads, keeping only the text of the story bodies.  There's no telling which
+        story body is the last, so the whole page is read.  Gives the same text as _ExtractText without holding the
+        page or a tree of it in memory.
+        :param inChunks: iterator over the raw page content in chunks
+        :param inEncoding: character set from the Content-Type header, None to go by the page
+        :return: string containing the processed text
+        """
+
+        try:
+            from lxml import etree
+
+            target = _StoryBodyTarget()
+            parser = etree.HTMLParser(target=target, encoding=inEncoding)
+
+            fed = False
+            for chunk in inChunks:
+                if not chunk:
+                    continue
+
+                parser.feed(chunk)
+                fed = True
+
+            if not fed:
+                return str()
+
+            # Fix some issues that result from pulling the tags and help Spacy along in general
+            return self._FixText(parser.close())
+
+        except Exception as e:
+            print("Exception in BBCWebsite::_ExtractTextStream: {}".format(e))
             self.good = False
             return str()
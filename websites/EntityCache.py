@@ -0,0 +1,128 @@
+# coding=utf-8
+
+"""
+EntityCache.py
+Describes the on-disk cache of NLP results, keyed by a hash of the article text and the settings that produced them.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import DefaultDict
+
+
+class EntityCache(object):
+    """
+    This class stores the entity dictionary from WebsiteBase._GetEntities in a SQLite file so unchanged articles don't
+    have to go through Spacy again.  When the cache grows past its maximum size the least recently used entries are
+    dropped.
+    """
+
+    # How many inserts between checks of the cache size
+    _evictionCheckInterval = 100
+
+    # ******************************************************************************************************************
+    def __init__(self, inPath: str, inMaxEntries: int):
+        """
+        Open (or create) the cache file
+        :param inPath: path to the SQLite file
+        :param inMaxEntries: maximum number of entries to keep
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        self._maxEntries = inMaxEntries
+        self._insertsSinceCheck = 0
+
+        # Website objects in the daemon can be used from different threads over time
+        self._lock = threading.Lock()
+
+        try:
+            self._connection = sqlite3.connect(inPath, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL;")
+            self._connection.execute("""
+                                     CREATE TABLE IF NOT EXISTS entities (
+                                         key TEXT PRIMARY KEY,
+                                         entities TEXT NOT NULL,
+                                         last_used REAL NOT NULL
+                                     );
+                                     """)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_entities_last_used ON entities (last_used);")
+            self._connection.commit()
+
+        except Exception as e:
+            print("Exception in EntityCache::__init__: {}".format(e))
+            self._connection = None
+            self.good = False
+
+    # ******************************************************************************************************************
+    def Get(self, inKey: str) -> DefaultDict[str, list]:
+        """
+        Look up the entities for a key
+        :param inKey: cache key
+        :return: defaultdict(list) of the entities, None if not cached
+        """
+
+        if not self.good:
+            return None
+
+        try:
+            with self._lock:
+                row = self._connection.execute("SELECT entities FROM entities WHERE key = ?;", (inKey,)).fetchone()
+                if not row:
+                    return None
+
+                self._connection.execute("UPDATE entities SET last_used = ? WHERE key = ?;", (time.time(), inKey))
+                self._connection.commit()
+
+            return defaultdict(list, json.loads(row[0]))
+
+        except Exception as e:
+            print("Exception in EntityCache::Get: {}".format(e))
+            return None
+
+    # ******************************************************************************************************************
+    def Put(self, inKey: str, inEntities: DefaultDict[str, list]):
+        """
+        Store the entities for a key
+        :param inKey: cache key
+        :param inEntities: entity dictionary from _GetEntities
+        :return: Nothing
+        """
+
+        if not self.good:
+            return
+
+        try:
+            with self._lock:
+                self._connection.execute("INSERT OR REPLACE INTO entities (key, entities, last_used) VALUES (?, ?, ?);",
+                                         (inKey, json.dumps(inEntities), time.time()))
+                self._connection.commit()
+
+                self._insertsSinceCheck += 1
+                if self._insertsSinceCheck >= self._evictionCheckInterval:
+                    self._insertsSinceCheck = 0
+                    self._Evict()
+
+        except Exception as e:
+            print("Exception in EntityCache::Put: {}".format(e))
+
+    # ******************************************************************************************************************
+    def _Evict(self):
+        """
+        Drop the least recently used entries if we're over the maximum size.  Call with the lock held.
+        :return: Nothing
+        """
+
+        count = self._connection.execute("SELECT COUNT(*) FROM entities;").fetchone()[0]
+        if count <= self._maxEntries:
+            return
+
+        self._connection.execute("""
+                                 DELETE FROM entities WHERE key IN
+                                 (SELECT key FROM entities ORDER BY last_used LIMIT ?);
+                                 """, (count - self._maxEntries,))
+        self._connection.commit()
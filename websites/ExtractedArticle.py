@@ -19,6 +19,12 @@ class ExtractedArticle(object):
         self.articleText = str()  # Holds the cleaned up full text of the article.
         self.articleURL = str()  # URL for the article.
         self.website = str()  # Website that the article is under (i.e., www.bbc.com).
+        self.canonicalURL = str()  # URL with tracking parameters, AMP variants, etc. stripped, used to find duplicates.
+        self.fingerprint = None  # SimHash of the article text, used to find republished copies of the same story.
+        self.articleID = None  # Database id, only set for articles that are already stored (ie, when reprocessing).
+        self.pendingID = None  # Id in pending_articles, only set for articles from the extract mode.
+        self.duplicate = False  # Set when the text turns out to be a copy of an article we already have.
+        self.skipped = False  # Set when the queue stayed full and the article wasn't pushed.  It should be tried again.
 
         # Extracted information
         self.locations = list()  # List of locations pulled from the article.
@@ -26,3 +32,18 @@ class ExtractedArticle(object):
         self.people = list()  # List of people extracted from the article.
         self.organizations = list()  # List of organizations extracted from the article.
         self.events = list()  # List of events extracted from the article.
+
+    # ******************************************************************************************************************
+    def AddEntities(self, inEntities: dict):
+        """
+        Add the entities found by the NLP to the article
+        :param inEntities: dictionary of entity lists keyed by Spacy label, from WebsiteBase._GetEntities
+        :return: Nothing
+        """
+
+        self.locations.extend(inEntities.get("GPE", list()))
+        self.facilities.extend(inEntities.get("FACILITY", list()))
+        self.facilities.extend(inEntities.get("FAC", list()))
+        self.people.extend(inEntities.get("PERSON", list()))
+        self.organizations.extend(inEntities.get("ORG", list()))
+        self.events.extend(inEntities.get("EVENT", list()))
@@ -0,0 +1,86 @@
+# coding=utf-8
+
+"""
+Fingerprint.py
+Functions for fingerprinting article text so that republished copies of the same story can be found.
+"""
+
+import hashlib
+import re
+from typing import List
+
+# Number of bits in the fingerprint and the number of bands it is split into for the near-duplicate index.  Two
+# fingerprints within (FINGERPRINT_BANDS - 1) bits of each other are guaranteed to share at least one band exactly.
+FINGERPRINT_BITS = 64
+FINGERPRINT_BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // FINGERPRINT_BANDS
+
+# Number of words in each shingle
+SHINGLE_SIZE = 3
+
+_wordRegex = re.compile(r"\w+")
+
+
+# **********************************************************************************************************************
+def SimHash(inText: str) -> int:
+    """
+    Compute the 64 bit SimHash of the text.  Texts that differ by a few words give fingerprints that differ by a few
+    bits, unlike a normal hash.
+    :param inText: article text
+    :return: fingerprint as a signed 64 bit integer (so it fits in a Postgres bigint), None if there is no text
+    """
+
+    words = _wordRegex.findall(inText.lower())
+    if not words:
+        return None
+
+    shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))]
+
+    counts = [0] * FINGERPRINT_BITS
+
+    for shingle in shingles:
+        shingleHash = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+
+        for bit in range(FINGERPRINT_BITS):
+            if shingleHash & (1 << bit):
+                counts[bit] += 1
+            else:
+                counts[bit] -= 1
+
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        if counts[bit] > 0:
+            fingerprint |= 1 << bit
+
+    # Store as signed so it fits in a bigint
+    if fingerprint >= 1 << (FINGERPRINT_BITS - 1):
+        fingerprint -= 1 << FINGERPRINT_BITS
+
+    return fingerprint
+
+
+# **********************************************************************************************************************
+def HammingDistance(inFingerprint1: int, inFingerprint2: int) -> int:
+    """
+    Number of bits that differ between two fingerprints
+    :param inFingerprint1: first fingerprint
+    :param inFingerprint2: second fingerprint
+    :return: number of differing bits
+    """
+
+    mask = (1 << FINGERPRINT_BITS) - 1
+
+    return bin((inFingerprint1 & mask) ^ (inFingerprint2 & mask)).count("1")
+
+
+# **********************************************************************************************************************
+def FingerprintBands(inFingerprint: int) -> List[int]:
+    """
+    Split the fingerprint into bands for the near-duplicate index
+    :param inFingerprint: fingerprint from SimHash
+    :return: list of FINGERPRINT_BANDS band values, in band order
+    """
+
+    bandMask = (1 << BAND_BITS) - 1
+
+    return [(inFingerprint >> (band * BAND_BITS)) & bandMask for band in range(FINGERPRINT_BANDS)]
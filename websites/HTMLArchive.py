@@ -0,0 +1,282 @@
+# coding=utf-8
+
+"""
+HTMLArchive.py
+Describes the local archive of downloaded article pages.  Pages are zstd compressed and appended to segment files, with
+an index of where each page is, so the parsers can be re-run without going back to the network.
+"""
+
+import fcntl
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Tuple
+
+# zstandard is only needed for the archive, so don't make it a hard requirement for the rest of the program
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class HTMLArchive(object):
+    """
+    This class stores raw pages in append-only segment files in a directory.  Each page is compressed as its own zstd
+    frame so it can be read back on its own, and a SQLite index maps the URL to the segment, offset and length.  Reads go
+    through an mmap of the segment so looking up a page doesn't read the rest of the file.  Several processes can write
+    to the same archive; appends are serialized with a lock file.
+    """
+
+    _indexName = "index.sqlite"
+    _lockName = "archive.lock"
+    _segmentFormat = "segment_{:06d}.zst"
+
+    # ******************************************************************************************************************
+    def __init__(self, inPath: str, inSegmentSize: int, inCompressionLevel: int = 3):
+        """
+        Open (or create) the archive
+        :param inPath: archive directory
+        :param inSegmentSize: size in bytes after which a new segment file is started
+        :param inCompressionLevel: zstd compression level
+        """
+
+        # Flag to check if we created OK.
+        self.good = True
+
+        self._path = inPath
+        self._segmentSize = inSegmentSize
+        self._compressionLevel = inCompressionLevel
+
+        # Open maps of the segments we've read from, as segment -> mmap
+        self._segmentMaps: Dict[int, mmap.mmap] = dict()
+
+        # Website objects in the daemon can be used from different threads over time
+        self._lock = threading.Lock()
+
+        self._connection = None
+        self._lockFile = None
+
+        if zstandard is None:
+            print("HTMLArchive: zstandard is required for the HTML archive.")
+            self.good = False
+            return
+
+        try:
+            os.makedirs(self._path, exist_ok=True)
+
+            self._lockFile = open(os.path.join(self._path, self._lockName), "a")
+
+            self._connection = sqlite3.connect(os.path.join(self._path, self._indexName), timeout=30,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL;")
+            self._connection.execute("""
+                                     CREATE TABLE IF NOT EXISTS pages (
+                                         url TEXT PRIMARY KEY,
+                                         classname TEXT NOT NULL,
+                                         segment INTEGER NOT NULL,
+                                         offset INTEGER NOT NULL,
+                                         length INTEGER NOT NULL,
+                                         fetched REAL NOT NULL
+                                     );
+                                     """)
+            self._connection.commit()
+
+            self._compressor = zstandard.ZstdCompressor(level=self._compressionLevel)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+        except Exception as e:
+            print("Exception in HTMLArchive::__init__: {}".format(e))
+            self.good = False
+
+    # ******************************************************************************************************************
+    def __del__(self):
+        """
+        Close the maps and files
+        :return: None
+        """
+
+        try:
+            for segmentMap in self._segmentMaps.values():
+                segmentMap.close()
+
+            if self._connection:
+                self._connection.close()
+
+            if self._lockFile:
+                self._lockFile.close()
+        except Exception as e:
+            print("Exception in HTMLArchive::__del__: {}".format(e))
+
+    # ******************************************************************************************************************
+    def Has(self, inURL: str) -> bool:
+        """
+        Check if a page is in the archive
+        :param inURL: page URL
+        :return: True if it is archived
+        """
+
+        with self._lock:
+            return self._Lookup(inURL) is not None
+
+    # ******************************************************************************************************************
+    def Get(self, inURL: str) -> bytes:
+        """
+        Read a page back from the archive
+        :param inURL: page URL
+        :return: the raw page content, None if it is not archived
+        """
+
+        if not self.good:
+            return None
+
+        try:
+            with self._lock:
+                location = self._Lookup(inURL)
+                if location is None:
+                    return None
+
+                segment, offset, length = location
+                segmentMap = self._MapSegment(segment, offset + length)
+                frame = segmentMap[offset:offset + length]
+
+            return self._decompressor.decompress(frame)
+
+        except Exception as e:
+            print("Exception in HTMLArchive::Get for {}: {}".format(inURL, e))
+            return None
+
+    # ******************************************************************************************************************
+    def Put(self, inURL: str, inClassname: str, inContent: bytes) -> bool:
+        """
+        Append a page to the archive.  A page that is already archived is left alone.
+        :param inURL: page URL
+        :param inClassname: website class that parses the page
+        :param inContent: raw page content
+        :return: True if the page was written
+        """
+
+        if not self.good or not inContent:
+            return False
+
+        try:
+            frame = self._compressor.compress(inContent)
+
+            with self._lock:
+                # Other processes append to the same segments
+                fcntl.flock(self._lockFile, fcntl.LOCK_EX)
+
+                try:
+                    if self._Lookup(inURL) is not None:
+                        return False
+
+                    segment = self._CurrentSegment()
+
+                    with open(self._SegmentPath(segment), "ab") as segmentFile:
+                        offset = segmentFile.tell()
+                        segmentFile.write(frame)
+                        segmentFile.flush()
+                        os.fsync(segmentFile.fileno())
+
+                    self._connection.execute("""
+                                             INSERT INTO pages (url, classname, segment, offset, length, fetched)
+                                             VALUES (?, ?, ?, ?, ?, ?);
+                                             """, (inURL, inClassname, segment, offset, len(frame), time.time()))
+                    self._connection.commit()
+
+                finally:
+                    fcntl.flock(self._lockFile, fcntl.LOCK_UN)
+
+            return True
+
+        except Exception as e:
+            print("Exception in HTMLArchive::Put for {}: {}".format(inURL, e))
+            return False
+
+    # ******************************************************************************************************************
+    def GetClassname(self, inURL: str) -> str:
+        """
+        Get the website class a page was archived under
+        :param inURL: page URL
+        :return: class name, None if it is not archived
+        """
+
+        if not self.good:
+            return None
+
+        try:
+            with self._lock:
+                row = self._connection.execute("SELECT classname FROM pages WHERE url = ?;", (inURL,)).fetchone()
+
+            return row[0] if row else None
+
+        except Exception as e:
+            print("Exception in HTMLArchive::GetClassname for {}: {}".format(inURL, e))
+            return None
+
+    # ******************************************************************************************************************
+    def _Lookup(self, inURL: str) -> Tuple:
+        """
+        Find where a page is stored.  Call with the lock held.
+        :param inURL: page URL
+        :return: (segment, offset, length), None if it is not archived
+        """
+
+        if not self.good:
+            return None
+
+        row = self._connection.execute("SELECT segment, offset, length FROM pages WHERE url = ?;",
+                                       (inURL,)).fetchone()
+
+        return tuple(row) if row else None
+
+    # ******************************************************************************************************************
+    def _CurrentSegment(self) -> int:
+        """
+        Get the segment to append to, moving on to a new one once the current one is full.  Call with the file lock held.
+        :return: segment number
+        """
+
+        row = self._connection.execute("SELECT MAX(segment) FROM pages;").fetchone()
+        segment = row[0] if row[0] is not None else 0
+
+        segmentPath = self._SegmentPath(segment)
+        if os.path.exists(segmentPath) and os.path.getsize(segmentPath) >= self._segmentSize:
+            segment += 1
+
+        return segment
+
+    # ******************************************************************************************************************
+    def _MapSegment(self, inSegment: int, inMinimumSize: int) -> mmap.mmap:
+        """
+        Get a read-only map of a segment.  The segment being appended to grows, so it is mapped again if the page is
+        past the end of the old map.  Call with the lock held.
+        :param inSegment: segment number
+        :param inMinimumSize: size the map needs to cover
+        :return: the map
+        """
+
+        segmentMap = self._segmentMaps.get(inSegment)
+        if segmentMap is not None and len(segmentMap) >= inMinimumSize:
+            return segmentMap
+
+        if segmentMap is not None:
+            segmentMap.close()
+
+        with open(self._SegmentPath(inSegment), "rb") as segmentFile:
+            segmentMap = mmap.mmap(segmentFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._segmentMaps[inSegment] = segmentMap
+
+        return segmentMap
+
+    # ******************************************************************************************************************
+    def _SegmentPath(self, inSegment: int) -> str:
+        """
+        Path to a segment file
+        :param inSegment: segment number
+        :return: path
+        """
+
+        return os.path.join(self._path, self._segmentFormat.format(inSegment))
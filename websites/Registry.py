@@ -0,0 +1,198 @@
+# coding=utf-8
+
+"""
+Registry.py
+The registry of website classes.  Classes are found by name the first time they are asked for (from the websites
+package, or from the entry points other packages install) and kept, and they can register the hosts their articles
+come from so an article can be routed to the right class whatever feed it was in.
+"""
+
+from importlib import import_module
+import os
+import pkgutil
+import re
+import threading
+from typing import Dict, List, Pattern, Tuple
+from urllib.parse import urlparse
+
+# Entry point group other packages can use to add website classes
+ENTRY_POINT_GROUP = "newsarticleextractor.websites"
+
+# Website classes by name
+_websiteClasses = dict()  # type: Dict[str, type]
+
+# (compiled host pattern, class name) in the order they were registered
+_hostRoutes = list()  # type: List[Tuple[Pattern, str]]
+
+# Entry points by name, read the first time a class isn't found in the package
+_entryPoints = None
+
+# Set once every class has been loaded so all of the host routes are known
+_allLoaded = False
+
+_registryLock = threading.RLock()
+
+
+# **********************************************************************************************************************
+def RegisterWebsite(inHosts: List[str] = None):
+    """
+    Class decorator that registers a website class, optionally with regular expressions for the article hosts it
+    handles.  The host patterns have to match the whole host name.
+    :param inHosts: list of host name patterns
+    :return: the decorator
+    """
+
+    def Decorator(inClass: type) -> type:
+        with _registryLock:
+            _websiteClasses[inClass.__name__] = inClass
+
+            for host in inHosts or list():
+                _hostRoutes.append((re.compile(host, re.IGNORECASE), inClass.__name__))
+
+        return inClass
+
+    return Decorator
+
+
+# **********************************************************************************************************************
+def GetWebsiteClass(inClassName: str) -> type:
+    """
+    Return the class (not an instance) for the class name.  The first time a name is asked for it is looked for in the
+    websites package and then in the entry points, after that it comes out of the registry.
+    :param inClassName: name of the class
+    :return: the class
+    """
+
+    with _registryLock:
+        websiteClass = _websiteClasses.get(inClassName)
+        if websiteClass is not None:
+            return websiteClass
+
+        websiteClass = _LoadWebsiteClass(inClassName)
+
+        # Classes that don't use the decorator get registered here
+        _websiteClasses[inClassName] = websiteClass
+
+        return websiteClass
+
+
+# **********************************************************************************************************************
+def _LoadWebsiteClass(inClassName: str) -> type:
+    """
+    Import the class from the module of the same name in the websites package, or from an entry point
+    :param inClassName: name of the class
+    :return: the class
+    """
+
+    from websites.WebsiteBase import WebsiteBase
+
+    try:
+        websiteClass = getattr(import_module("." + inClassName, package="websites"), inClassName)
+
+    except ModuleNotFoundError as e:
+        # Only fall back to the entry points if it's the website module itself that's missing, not something it imports
+        if e.name != "websites." + inClassName:
+            raise
+
+        entryPoint = _GetEntryPoints().get(inClassName)
+        if entryPoint is None:
+            raise ImportError("No website class named {} in the websites package or the {} entry points".format(
+                              inClassName, ENTRY_POINT_GROUP)) from e
+
+        websiteClass = entryPoint.load()
+
+    if not isinstance(websiteClass, type) or not issubclass(websiteClass, WebsiteBase):
+        raise ImportError("{} is not a WebsiteBase subclass".format(inClassName))
+
+    return websiteClass
+
+
+# **********************************************************************************************************************
+def _GetEntryPoints() -> dict:
+    """
+    Read the website entry points that are installed.  Call with the registry lock held.
+    :return: entry points by name
+    """
+
+    global _entryPoints
+
+    if _entryPoints is None:
+        try:
+            from importlib.metadata import entry_points
+
+            installed = entry_points()
+            if hasattr(installed, "select"):
+                installed = installed.select(group=ENTRY_POINT_GROUP)
+            else:
+                installed = installed.get(ENTRY_POINT_GROUP, list())
+
+            _entryPoints = {entryPoint.name: entryPoint for entryPoint in installed}
+
+        except Exception as e:
+            print("Exception in Registry::_GetEntryPoints: {}".format(e))
+            _entryPoints = dict()
+
+    return _entryPoints
+
+
+# **********************************************************************************************************************
+def RouteURL(inURL: str, inDefaultClassName: str) -> str:
+    """
+    Find the class for an article from its host.  The first call loads every website class so that all of their host
+    patterns are registered.
+    :param inURL: article URL
+    :param inDefaultClassName: class to use if no registered host matches (usually the subscription's)
+    :return: class name
+    """
+
+    global _allLoaded
+
+    if not _allLoaded:
+        ListWebsiteClasses()
+        _allLoaded = True
+
+    host = urlparse(inURL).hostname or str()
+
+    with _registryLock:
+        for pattern, className in _hostRoutes:
+            if pattern.fullmatch(host):
+                return className
+
+    return inDefaultClassName
+
+
+# **********************************************************************************************************************
+def ValidateWebsiteClasses(inClassNames: List[str]) -> Dict[str, str]:
+    """
+    Load each class name and report the ones that can't be used
+    :param inClassNames: class names to check, ie from the subscriptions table
+    :return: error message by class name for the ones that failed, empty if they're all good
+    """
+
+    errors = dict()
+
+    for className in set(inClassNames):
+        try:
+            GetWebsiteClass(className)
+        except Exception as e:
+            errors[className] = "{}: {}".format(type(e).__name__, e)
+
+    return errors
+
+
+# **********************************************************************************************************************
+def ListWebsiteClasses() -> List[str]:
+    """
+    Names of all of the website classes we can find: the ones in the websites package, the entry points and anything
+    else that has been registered.  This loads every one of them, so it's for listing and checking, not for startup.
+    :return: sorted list of class names
+    """
+
+    with _registryLock:
+        classNames = set(_websiteClasses) | set(_GetEntryPoints())
+
+    for moduleInfo in pkgutil.iter_modules([os.path.dirname(os.path.realpath(__file__))]):
+        classNames.add(moduleInfo.name)
+
+    return sorted(className for className in classNames
+                  if className != "WebsiteBase" and not ValidateWebsiteClasses([className]))
@@ -5,17 +5,316 @@
 Describes the base class for all of the derived website classes
 """
 
-from collections import defaultdict
+import calendar
+from collections import defaultdict, deque
 import configparser
+import hashlib
+import json
 import multiprocessing
+import os
+import queue
+import sys
 from typing import List, DefaultDict, Tuple
-from urllib.parse import urlparse
-import spacy
-from fuzzywuzzy import fuzz
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 import psycopg2
-import feedparser
+from websites.EntityCache import EntityCache
 from websites.ExtractedArticle import ExtractedArticle
+from websites.HTMLArchive import HTMLArchive
+from websites.Registry import GetWebsiteClass, RouteURL
+from websites.Fingerprint import SimHash, HammingDistance, FingerprintBands, FINGERPRINT_BANDS
 import re
+import threading
+import time
+
+
+# Spacy, feedparser, fuzzywuzzy and requests are imported where they're used rather than up here.  Spacy in particular
+# pulls in thinc and numpy and takes a long time to import, and processes like the DB writer that only need
+# ExtractedArticle shouldn't have to pay for it.
+
+# Spacy model used when nothing else is configured
+DEFAULT_MODEL_NAME = "en_core_web_lg"
+
+# Name of the EntityRuler component seeded from the problem_entities table
+ENTITY_RULER_NAME = "problem_entities"
+
+# Spacy labels we're interested in
+GOOD_LABELS = ["PERSON", "FACILITY", "FAC", "ORG", "GPE", "EVENT"]
+
+# Spacy models already loaded in this process, keyed by name.  Loading a model is slow and the large model takes a lot of
+# memory, so every website object in the process shares the same copy.
+_loadedModels = dict()
+_loadedModelsLock = threading.Lock()
+
+# A Spacy Language object isn't safe to run from several threads at once (the daemon polls feeds on a thread pool), so
+# each loaded model is run under its own lock, keyed by id of the model
+_modelLocks = dict()
+
+# Hash of the problem entities compiled into the EntityRuler of each loaded model, keyed by id of the model
+_entityRulerSignatures = dict()
+
+# Spacy 3 only adds components by factory name.  This factory hands over a ruler that was built outside the pipeline,
+# keyed by id of the model.
+ENTITY_RULER_FACTORY = "prebuilt_problem_entities"
+_builtEntityRulers = dict()
+
+
+# **********************************************************************************************************************
+def LoadModel(inModelName: str, inSharedVectorsPath: str = str()):
+    """Load a Spacy model once per process.
+
+    :param inModelName: name of the Spacy model to load
+    :param inSharedVectorsPath: directory to keep a memory-mapped copy of the word vectors in, empty to keep them in
+        ordinary memory
+    :return: the loaded Spacy Language object
+    """
+
+    with _loadedModelsLock:
+        if inModelName not in _loadedModels:
+            import spacy
+
+            nlp = spacy.load(inModelName)
+
+            if inSharedVectorsPath:
+                _ShareVectors(nlp, inModelName, inSharedVectorsPath)
+
+            _loadedModels[inModelName] = nlp
+            _modelLocks[id(nlp)] = threading.Lock()
+
+        return _loadedModels[inModelName]
+
+
+# **********************************************************************************************************************
+def _ShareVectors(inNLP, inModelName: str, inSharedVectorsPath: str):
+    """Swap the word vectors of a model for a read-only memory map of the same array.
+
+    The vectors are most of the memory of the large models.  Mapped from a file, they live in the page cache and every
+    process using the model (forked NLP workers, or separate extract workers on the same machine) shares the one copy.
+    The file is written the first time the model is loaded.
+
+    :param inNLP: the loaded Spacy Language object
+    :param inModelName: name of the model, used for the file name
+    :param inSharedVectorsPath: directory to keep the file in
+    :return: Nothing
+    """
+
+    try:
+        import numpy
+
+        vectors = inNLP.vocab.vectors
+        if not isinstance(vectors.data, numpy.ndarray) or not vectors.data.size:
+            return
+
+        vectorsFile = os.path.join(inSharedVectorsPath, "{}-{}.npy".format(inModelName,
+                                                                          inNLP.meta.get("version", "unknown")))
+
+        if not os.path.exists(vectorsFile):
+            os.makedirs(inSharedVectorsPath, exist_ok=True)
+
+            # Write to a temporary file first so another process never maps a half written one
+            tempFile = "{}.{}.tmp".format(vectorsFile, os.getpid())
+            with open(tempFile, "wb") as outFile:
+                numpy.save(outFile, vectors.data)
+            os.replace(tempFile, vectorsFile)
+
+        sharedData = numpy.load(vectorsFile, mmap_mode="r")
+        if sharedData.shape != vectors.data.shape or sharedData.dtype != vectors.data.dtype:
+            print("WebsiteBase::_ShareVectors: {} doesn't match the model, delete it to rebuild it".format(vectorsFile))
+            return
+
+        vectors.data = sharedData
+
+    except Exception as e:
+        print("Exception in WebsiteBase::_ShareVectors: {}".format(e))
+
+
+# **********************************************************************************************************************
+def ReadNLPProfile(inConfigObject: configparser.ConfigParser, inProfileName: str = str()) -> dict:
+    """Read the NLP settings for a profile.
+
+    The global settings are in the NLP section of the config.  A profile is a section called NLP:<name> (ie NLP:fast),
+    and anything it doesn't set comes from the global settings.  An empty or unknown name gets the global settings.
+
+    :param inConfigObject: global config object
+    :param inProfileName: name of the profile, ie from the nlp_profile column of the subscription
+    :return: dict with name, model, pipeline (full or ner) and entityRuler
+    """
+
+    profile = {"name": str(), "model": DEFAULT_MODEL_NAME, "pipeline": "full", "entityRuler": True}
+
+    sections = ["NLP"]
+    if inProfileName:
+        if inConfigObject.has_section("NLP:" + inProfileName):
+            sections.append("NLP:" + inProfileName)
+            profile["name"] = inProfileName
+        else:
+            print("WebsiteBase::ReadNLPProfile: No NLP:{} section in the config, using the global settings".format(
+                  inProfileName))
+
+    for section in sections:
+        if not inConfigObject.has_section(section):
+            continue
+
+        NLP = inConfigObject[section]
+
+        profile["model"] = NLP.get("Model", fallback=str()) or profile["model"]
+        profile["pipeline"] = NLP.get("Pipeline", fallback=str()).lower() or profile["pipeline"]
+        profile["entityRuler"] = NLP.getboolean("UseEntityRuler", profile["entityRuler"])
+
+    if profile["pipeline"] not in ("full", "ner"):
+        print("WebsiteBase::ReadNLPProfile: Unknown pipeline {}, using full".format(profile["pipeline"]))
+        profile["pipeline"] = "full"
+
+    return profile
+
+
+# **********************************************************************************************************************
+def NLPProfileNames(inConfigObject: configparser.ConfigParser) -> List[str]:
+    """Get the names of the NLP profiles in the config.
+
+    :param inConfigObject: global config object
+    :return: list of profile names, starting with the empty name of the global settings
+    """
+
+    return [str()] + [section[len("NLP:"):] for section in inConfigObject.sections() if section.startswith("NLP:")]
+
+
+# **********************************************************************************************************************
+def DisabledPipes(inNLP, inProfile: dict) -> List[str]:
+    """Get the pipeline components to turn off when running a model for a profile.
+
+    Every profile using a model shares one copy of it, so instead of loading it with components left out the unused
+    ones are disabled on each call.  The NER-only pipeline skips the tagger and parser, which Spacy 2's NER doesn't
+    need and which take most of the time.
+
+    :param inNLP: the loaded Spacy Language object
+    :param inProfile: profile from ReadNLPProfile
+    :return: list of component names
+    """
+
+    disabled = list()
+
+    for pipeName in inNLP.pipe_names:
+        if pipeName == ENTITY_RULER_NAME:
+            if not inProfile["entityRuler"]:
+                disabled.append(pipeName)
+
+        elif inProfile["pipeline"] == "ner" and pipeName != "ner":
+            disabled.append(pipeName)
+
+    return disabled
+
+
+# **********************************************************************************************************************
+def UpdateEntityRuler(inNLP, inProblemEntities: List[Tuple]):
+    """Compile the problem entities into an EntityRuler in front of the NER of a model.
+
+    Spacy's NER keeps the entities the ruler found, so the problem entities come out labelled the way the
+    problem_entities table says, on token boundaries, in the same pass as everything else.  The ruler is shared by
+    everything in the process using the model and is only rebuilt when the list of problem entities changes.  The new
+    ruler is built away from the model and swapped in under the model's lock, so other threads using the model never see
+    it half built.
+
+    :param inNLP: the loaded Spacy Language object
+    :param inProblemEntities: list of (entity_name, entity_spacy_label) from problem_entities
+    :return: Nothing
+    """
+
+    signature = hashlib.sha256(json.dumps(sorted(inProblemEntities)).encode("utf-8")).hexdigest()
+
+    with _loadedModelsLock:
+        hasRuler = ENTITY_RULER_NAME in inNLP.pipe_names
+        if hasRuler and _entityRulerSignatures.get(id(inNLP)) == signature:
+            return
+
+        import spacy
+        from spacy.pipeline import EntityRuler
+
+        patterns = [{"label": label, "pattern": entity} for entity, label in inProblemEntities]
+
+        # add_patterns runs the phrases through the ruler's Language object and switches components off while it does.
+        # Give it one with just the model's tokenizer so the shared model isn't touched until the swap.
+        tokenizerNLP = spacy.blank(inNLP.lang, vocab=inNLP.vocab)
+        tokenizerNLP.tokenizer = inNLP.tokenizer
+
+        spacy3 = int(spacy.__version__.split(".")[0]) >= 3
+        if spacy3:
+            ruler = EntityRuler(tokenizerNLP, ENTITY_RULER_NAME, overwrite_ents=True)
+        else:
+            ruler = EntityRuler(tokenizerNLP, overwrite_ents=True)
+        ruler.add_patterns(patterns)
+
+        before = "ner" if "ner" in inNLP.pipe_names else None
+
+        with _modelLocks.setdefault(id(inNLP), threading.Lock()):
+            if spacy3:
+                from spacy.language import Language
+
+                # Spacy 3 only adds components by factory name, so a factory hands over the ruler we built
+                if not Language.has_factory(ENTITY_RULER_FACTORY):
+                    Language.factory(ENTITY_RULER_FACTORY, func=lambda nlp, name: _builtEntityRulers.pop(id(nlp)))
+
+                _builtEntityRulers[id(inNLP)] = ruler
+
+                if hasRuler:
+                    inNLP.replace_pipe(ENTITY_RULER_NAME, ENTITY_RULER_FACTORY)
+                else:
+                    inNLP.add_pipe(ENTITY_RULER_FACTORY, name=ENTITY_RULER_NAME, before=before)
+
+            elif hasRuler:
+                inNLP.replace_pipe(ENTITY_RULER_NAME, ruler)
+            else:
+                inNLP.add_pipe(ruler, name=ENTITY_RULER_NAME, before=before)
+
+        _entityRulerSignatures[id(inNLP)] = signature
+
+
+# **********************************************************************************************************************
+def ProcessMemory() -> dict:
+    """Get the memory use of this process in MB.
+
+    On Linux the resident memory is split into what is shared with other processes (the copy-on-write pages of a forked
+    parent, memory-mapped files) and what is private to this one.  PSS is the resident memory with each shared page
+    divided between the processes sharing it, so adding up the PSS of the workers gives their real total.
+
+    :return: dict with rss, and pss, shared and private where they are available
+    """
+
+    memory = dict()
+
+    try:
+        with open("/proc/self/smaps_rollup") as smapsFile:
+            fields = dict()
+            for line in smapsFile:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+
+        memory["rss"] = fields.get("Rss", 0.0)
+        memory["pss"] = fields.get("Pss", 0.0)
+        memory["shared"] = fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0)
+        memory["private"] = fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+
+    except OSError:
+        # Not Linux (or an old kernel), fall back to the peak resident size
+        try:
+            import resource
+
+            maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            memory["rss"] = maxRSS / (1024.0 * 1024.0) if sys.platform == "darwin" else maxRSS / 1024.0
+
+        except ImportError:
+            pass
+
+    return memory
+
+
+# Where long texts can be split for the NLP: after a line break, then after the end of a sentence, then at any space
+_paragraphBreaks = re.compile(r"(?<=\n)")
+_sentenceBreaks = re.compile(r"(?<=[.!?]\s)|(?<=[.!?][\"')\]]\s)")
+
+# Query parameters that only track where a click came from and don't change the article
+_trackingParameters = re.compile(r"^(utm_\w+|at_\w+|ns_\w+|fbclid|gclid|dclid|msclkid|mc_cid|mc_eid|ocid|cmpid|xtor|"
+                                 r"amp|outputtype)$", re.IGNORECASE)
 
 
 class WebsiteBase(object):
@@ -24,6 +323,11 @@ class WebsiteBase(object):
     some common functionality for all classes.
     """
 
+    # (canonical URL, fingerprint) of the articles queued recently by any website object in this process.  These catch
+    # duplicates that the DBWriter hasn't written yet.
+    _recentFingerprints = deque(maxlen=1000)
+    _recentFingerprintsLock = threading.Lock()
+
     # ******************************************************************************************************************
     def __init__(self, inQueue: multiprocessing.Queue, inConfigObject: configparser.ConfigParser, inURL: str):
         """Initializer
@@ -41,7 +345,7 @@ class WebsiteBase(object):
         self.good = True
 
         # Spacy labels we're interested in
-        self._goodLabels = ["PERSON", "FACILITY", "FAC", "ORG", "GPE", "EVENT"]
+        self._goodLabels = list(GOOD_LABELS)
 
         # Save the global queue
         if not inQueue:
@@ -50,10 +354,18 @@ class WebsiteBase(object):
             # Don't bother running if we don't have a Queue object passed in
             return
 
-        self._NLP = spacy.load("en_core_web_lg")
+        # Spacy model and pipeline, set from the NLP profile of the subscription by UseNLPProfile and loaded by _LoadNLP
+        self._nlpProfile = ReadNLPProfile(inConfigObject)
+        self._modelName = self._nlpProfile["model"]
+        self._NLP = None
+        self._NLPLock = None
+        self._disabledPipes = list()
 
         self._queue = inQueue
 
+        # Kept for creating the website objects that routed articles are handed to
+        self._configObject = inConfigObject
+
         # DB Parameters
         self._DBHost = str()
         self._DBPort = str()
@@ -85,8 +397,39 @@ class WebsiteBase(object):
         # Feed items parsed from the RSS link
         self._feedItems = list()
 
-        # Problem entities we need to manually search for
-        self._problemEntities = self._GetProblemEntities()
+        # Statistics from the last read of the feed.  The daemon uses these to adapt the polling interval.
+        self.lastFeedEntries = 0
+        self.lastNewEntries = 0
+        self.lastEntryTimes = list()
+
+        # Newest entry in the feed as (published time, guid, was this a full sweep).  Saved to the subscription once the
+        # feed is processed.
+        self._pendingHighWaterMark = None
+
+        # Entries from the last read of the feed, to hold the high-water mark back behind articles that failed
+        self._lastEntries = list()
+
+        # Problem entities Spacy has trouble with.  These go into the EntityRuler (or are searched for in the text if it
+        # is turned off), and are re-read every ProblemEntitiesRefresh seconds in case the table changed.
+        self._problemEntities = self._GetProblemEntities() or list()
+        self._problemEntitiesChecked = time.time()
+
+        # Website objects for articles routed to another class by their host, keyed by class name
+        self._routedParsers = dict()
+
+        # Cache of NLP results so unchanged articles skip Spacy
+        self._entityCache = None
+        self._entityCacheSalt = str()
+        if self._entityCacheEnabled:
+            self._entityCache = EntityCache(self._entityCachePath, self._entityCacheMaxEntries)
+
+        # Pick the model for the subscription.  It isn't loaded until there's an article to process.
+        self.UseNLPProfile(self._GetSubscriptionNLPProfile())
+
+        # Archive of the downloaded pages so the parsers can be re-run without the network
+        self._htmlArchive = None
+        if self._archiveEnabled:
+            self._htmlArchive = HTMLArchive(self._archivePath, self._archiveSegmentSize, self._archiveCompressionLevel)
 
     # ******************************************************************************************************************
     def __del__(self):
@@ -134,6 +477,80 @@ class WebsiteBase(object):
             # Similiarity percentage to go by
             self._fuzzy_ratio = int(WEBSITEBASEOBJ["FuzzyRatio"])
 
+            # Stop reading the feed at the last entry we saw, with a full pass every FullSweepInterval seconds
+            self._useHighWaterMark = WEBSITEBASEOBJ.getboolean("UseHighWaterMark", False)
+            self._fullSweepInterval = WEBSITEBASEOBJ.getint("FullSweepInterval", 86400)
+
+            # Hand each article to the website class registered for its host, if there is one
+            self._routeByHost = WEBSITEBASEOBJ.getboolean("RouteByHost", False)
+
+            # Extract the text while the page downloads, for the classes that can
+            self._streamArticles = WEBSITEBASEOBJ.getboolean("StreamArticles", False)
+            self._streamChunkSize = WEBSITEBASEOBJ.getint("StreamChunkSize", 16384)
+
+            # Duplicate detection by canonical URL and text fingerprint
+            self._dedupEnabled = False
+            self._nearDuplicateDistance = 3
+            if inConfigObject.has_section("DEDUP"):
+                DEDUP = inConfigObject["DEDUP"]
+
+                self._dedupEnabled = DEDUP.getboolean("Enabled", self._dedupEnabled)
+                self._nearDuplicateDistance = DEDUP.getint("NearDuplicateDistance", self._nearDuplicateDistance)
+
+            # The band index only finds the fingerprints within FINGERPRINT_BANDS - 1 bits
+            if self._nearDuplicateDistance > FINGERPRINT_BANDS - 1:
+                print("WebsiteBase: NearDuplicateDistance can be at most {}, using that".format(FINGERPRINT_BANDS - 1))
+                self._nearDuplicateDistance = FINGERPRINT_BANDS - 1
+
+            # On-disk cache of NLP results.  Relative paths are relative to the program directory.
+            self._entityCacheEnabled = False
+            self._entityCachePath = "entity_cache.sqlite"
+            self._entityCacheMaxEntries = 100000
+            if inConfigObject.has_section("ENTITYCACHE"):
+                ENTITYCACHE = inConfigObject["ENTITYCACHE"]
+
+                self._entityCacheEnabled = ENTITYCACHE.getboolean("Enabled", self._entityCacheEnabled)
+                self._entityCachePath = ENTITYCACHE.get("Path", self._entityCachePath)
+                self._entityCacheMaxEntries = ENTITYCACHE.getint("MaxEntries", self._entityCacheMaxEntries)
+
+            self._entityCachePath = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                                 self._entityCachePath)
+
+            # Archive of the raw pages.  In replay mode pages are read from the archive instead of being downloaded.
+            self._archiveEnabled = False
+            self._archivePath = "html_archive"
+            self._archiveSegmentSize = 256
+            self._archiveCompressionLevel = 3
+            self._archiveReplay = False
+            if inConfigObject.has_section("ARCHIVE"):
+                ARCHIVE = inConfigObject["ARCHIVE"]
+
+                self._archiveEnabled = ARCHIVE.getboolean("Enabled", self._archiveEnabled)
+                self._archivePath = ARCHIVE.get("Path", self._archivePath)
+                self._archiveSegmentSize = ARCHIVE.getint("SegmentSizeMB", self._archiveSegmentSize)
+                self._archiveCompressionLevel = ARCHIVE.getint("CompressionLevel", self._archiveCompressionLevel)
+                self._archiveReplay = ARCHIVE.getboolean("Replay", self._archiveReplay)
+
+            self._archivePath = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                             self._archivePath)
+            self._archiveSegmentSize *= 1024 * 1024
+
+            # Memory-mapped word vectors shared between processes.  Relative paths are relative to the program directory.
+            self._sharedVectorsPath = str()
+            self._problemEntitiesRefresh = 300
+            self._chunkCharacters = 10000
+            if inConfigObject.has_section("NLP"):
+                NLP = inConfigObject["NLP"]
+
+                self._chunkCharacters = NLP.getint("ChunkCharacters", self._chunkCharacters)
+
+                self._sharedVectorsPath = NLP.get("SharedVectorsPath", self._sharedVectorsPath)
+                self._problemEntitiesRefresh = NLP.getint("ProblemEntitiesRefresh", self._problemEntitiesRefresh)
+
+            if self._sharedVectorsPath:
+                self._sharedVectorsPath = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                                       self._sharedVectorsPath)
+
             return True
         except Exception as e:
             print("Got exception {}".format(e))
@@ -186,10 +603,10 @@ class WebsiteBase(object):
 
             self._DBConnection = psycopg2.connect(host=self._DBHost,
                                                   port=self._DBPort,
-                                                  dbname=self._DBHost,
+                                                  dbname=self._DBTable,
                                                   user=self._DBUser,
                                                   password=self._DBPassword)
-            self.cursor = self._DBConnection.cursor()
+            self._DBCursor = self._DBConnection.cursor()
             return True
         except Exception as e:
             print("WebsiteBase::_ResetSQLConnection exception: {}".format(e))
@@ -207,47 +624,232 @@ class WebsiteBase(object):
         returnList = list()
 
         try:
+            import feedparser
+
             # First process the RSS feed using feedparser
             print("Using URL: {}".format(self._url))
             myFeedParser = feedparser.parse(self._url)
 
+            self.lastFeedEntries = len(myFeedParser.entries)
+            self.lastNewEntries = 0
+            self.lastEntryTimes = [entryTime for entryTime in map(self.EntryTime, myFeedParser.entries) if entryTime]
+            self._lastEntries = myFeedParser.entries
+
+            markTime, markGUID, fullSweep = None, None, True
+            if self._useHighWaterMark:
+                markTime, markGUID, fullSweep = self._GetHighWaterMark()
+                self._pendingHighWaterMark = self._NewestEntry(myFeedParser.entries) + (fullSweep,)
+
             # Now for each link, check if it's already in the database before we add it to the return list.
             for entry in myFeedParser.entries:
 
+                # Feeds are newest first, so once we get to the last entry we saw the rest are old.  The full sweep
+                # catches anything that was updated out of order.
+                if not fullSweep:
+                    if markGUID and entry.get("id", entry.link) == markGUID:
+                        break
+
+                    entryTime = self.EntryTime(entry)
+                    if markTime and entryTime and entryTime < markTime:
+                        break
+
                 # Grab the url
                 checkURL = entry.link
-                self._DBCursor.execute("SELECT id FROM news_articles WHERE article_url = %s", (checkURL,))
+                if self._dedupEnabled:
+                    self._DBCursor.execute("SELECT id FROM news_articles WHERE article_url = %s OR canonical_url = %s",
+                                           (checkURL, self.CanonicalizeURL(checkURL)))
+                else:
+                    self._DBCursor.execute("SELECT id FROM news_articles WHERE article_url = %s", (checkURL,))
                 self._DBConnection.commit()
 
                 if self._DBCursor.fetchone():
                     continue
                 else:
-                    # Create the wrapper object
-                    extractedArticle = ExtractedArticle()
+                    returnList.append(self.ArticleFromEntry(entry))
 
-                    extractedArticle.articleTitle = entry.title
-                    extractedArticle.articleURL = checkURL
-                    extractedArticle.website = urlparse(checkURL).netloc
-
-                    returnList.append(extractedArticle)
+            self.lastNewEntries = len(returnList)
 
             return returnList
 
         except Exception as e:
+            # The list is only part of the feed, so the high-water mark can't move past the rest
+            self._pendingHighWaterMark = None
             self._ResetSQLConnection()
             self.good = False
             return returnList
 
+    # ******************************************************************************************************************
+    @classmethod
+    def ArticleFromEntry(cls, inEntry) -> ExtractedArticle:
+        """Create the wrapper object for a feed entry.
+
+        This does not need a live object, so the async engine can call it on the class without loading a model.
+        :param inEntry: feedparser entry
+        :return: ExtractedArticle with the title, URL and website filled in
+        """
+
+        extractedArticle = ExtractedArticle()
+
+        extractedArticle.articleTitle = inEntry.title
+        extractedArticle.articleURL = inEntry.link
+        extractedArticle.canonicalURL = cls.CanonicalizeURL(inEntry.link)
+        extractedArticle.website = urlparse(inEntry.link).netloc
+
+        return extractedArticle
+
+    # ******************************************************************************************************************
+    @classmethod
+    def CanonicalizeURL(cls, inURL: str) -> str:
+        """Reduce a URL to a canonical form.
+
+        Strips the things that make the same article show up under different URLs: tracking parameters, fragments,
+        AMP variants, http vs https and trailing slashes.  Children can override this to add rules for their website,
+        the result is only used to find duplicates and is never downloaded.
+        :param inURL: article URL
+        :return: canonical URL
+        """
+
+        parsedURL = urlparse(inURL.strip())
+
+        host = parsedURL.netloc.lower()
+        host = re.sub(r":(80|443)$", "", host)
+        if host.startswith("amp."):
+            host = host[4:]
+
+        path = "/".join(segment for segment in parsedURL.path.split("/") if segment != "amp")
+        path = re.sub(r"\.amp$", "", path)
+        path = path.rstrip("/") or "/"
+
+        query = urlencode(sorted((key, value) for key, value in parse_qsl(parsedURL.query, keep_blank_values=True)
+                                 if not _trackingParameters.match(key)))
+
+        return urlunparse(("https", host, path, str(), query, str()))
+
+    # ******************************************************************************************************************
+    @staticmethod
+    def EntryTime(inEntry) -> float:
+        """Get the time a feed entry was published.
+
+        :param inEntry: feedparser entry
+        :return: seconds since the epoch, or None if the feed doesn't give a usable date
+        """
+
+        entryTime = inEntry.get("published_parsed") or inEntry.get("updated_parsed")
+        if not entryTime:
+            return None
+
+        return float(calendar.timegm(entryTime))
+
+    # ******************************************************************************************************************
+    def _FetchArticle(self, inURL: str) -> bytes:
+        """Download the article.
+
+        Children can override this if the website needs anything special (headers, cookies, etc) to get the page.
+        :param inURL: URL to download
+        :return: raw page content
+        """
+
+        import requests
+
+        myRequest = requests.get(inURL)
+
+        return myRequest.content
+
+    # ******************************************************************************************************************
+    def _FetchArticleStream(self, inURL: str):
+        """Start downloading the article without reading the body.
+
+        Children that override _FetchArticle should override this as well.
+        :param inURL: URL to download
+        :return: requests Response opened with stream=True, to be used in a with statement
+        """
+
+        import requests
+
+        return requests.get(inURL, stream=True)
+
+    # ******************************************************************************************************************
+    def _GetPage(self, inURL: str) -> bytes:
+        """Get the raw page for an article.
+
+        Reads the page from the archive in replay mode, otherwise downloads it and archives it if the archive is on.
+        :param inURL: URL of the article
+        :return: raw page content, empty if it is not available
+        """
+
+        if self._htmlArchive and self._archiveReplay:
+            content = self._htmlArchive.Get(inURL)
+            if content is None:
+                print("WebsiteBase::_GetPage: {} is not in the archive".format(inURL))
+                return bytes()
+
+            return content
+
+        content = self._FetchArticle(inURL)
+        self._ArchivePage(inURL, content)
+
+        return content
+
+    # ******************************************************************************************************************
+    def _ArchivePage(self, inURL: str, inContent: bytes):
+        """Save a downloaded page to the archive, if it is on.
+
+        :param inURL: URL of the article
+        :param inContent: raw page content
+        :return: Nothing
+        """
+
+        if self._htmlArchive and not self._archiveReplay:
+            self._htmlArchive.Put(inURL, type(self).__name__, inContent)
+
+    # ******************************************************************************************************************
+    def _ExtractText(self, inContent: bytes) -> str:
+        """Extract the article text from the downloaded page.
+
+        This method must be overridden in the child classes.  It does the job of stripping the page down and returning
+        text that can then be passed to Spacy.
+        :param inContent: raw page content
+        :return: Text output for Spacy
+        """
+        raise NotImplementedError("Subclass must implement abstract method")
+
+    # ******************************************************************************************************************
+    def _ExtractTextStream(self, inChunks, inEncoding: str) -> str:
+        """Extract the article text from the page as it downloads.
+
+        Children can override this to parse the chunks as they come in and stop reading once they have the article.
+        By default the whole page is read and handed to _ExtractText.
+        :param inChunks: iterator over the raw page content in chunks
+        :param inEncoding: character set from the Content-Type header, None if it didn't say
+        :return: Text output for Spacy
+        """
+
+        return self._ExtractText(b"".join(inChunks))
+
     # ******************************************************************************************************************
     def _ParseArticle(self, inURL: str) -> str:
         """Parse the scraped article.
 
-        This method must be overridden in the child classes.  It does the job of scraping the article and returning text
-        that can then be passed to Spacy.
+        Downloads the article and hands the content to _ExtractText.  With StreamArticles on (and the archive off, since
+        that needs the whole page) the download is handed to _ExtractTextStream instead, which can stop reading once it
+        has the article.
         :param inURL: URL to process
         :return: Text output for Spacy
         """
-        raise NotImplementedError("Subclass must implement abstract method")
+
+        try:
+            if self._streamArticles and not self._htmlArchive:
+                with self._FetchArticleStream(inURL) as response:
+                    charset = re.search(r"charset=[\"']?([\w.:-]+)", response.headers.get("Content-Type", str()))
+
+                    return self._ExtractTextStream(response.iter_content(self._streamChunkSize),
+                                                   charset.group(1) if charset else None)
+
+            return self._ExtractText(self._GetPage(inURL))
+        except Exception as e:
+            print("Exception in WebsiteBase::_ParseArticle: {}".format(e))
+            self.good = False
+            return str()
 
     # ******************************************************************************************************************
     def _CheckSimilarity(self, inText1: str, inText2: str) -> bool:
@@ -264,6 +866,8 @@ class WebsiteBase(object):
             return False
 
         try:
+            from fuzzywuzzy import fuzz
+
             ratio = fuzz.partial_ratio(inText1, inText2)
 
             if ratio >= self._fuzzy_ratio:
@@ -284,22 +888,158 @@ class WebsiteBase(object):
         :return: defaultdict(list) of the extracted entities.
         """
 
-        # Define our return dictionary
-        returnDict = defaultdict(list)
-        foundIt = False
-
         # If we didn't get anything passed in, return an empty defaultdict
         if not inText:
-            return returnDict
+            return defaultdict(list)
+
+        self._LoadNLP()
+        self._CheckProblemEntities()
+
+        # If we've seen this exact text with the same settings before, we already know the answer
+        cacheKey = None
+        if self._entityCache:
+            cacheKey = self._EntityCacheKey(inText)
+            cachedDict = self._entityCache.Get(cacheKey)
+            if cachedDict is not None:
+                return cachedDict
 
-        # Perform the NLP
-        tEntities = self._NLP(inText)
+        # Perform the NLP.  pipe is lazy, so the docs are collected while we hold the model's lock.
+        chunks = self._SplitText(inText)
+        with self._NLPLock:
+            if len(chunks) == 1:
+                tDocs = [self._NLP(inText, disable=self._disabledPipes)]
+            else:
+                tDocs = list(self._NLP.pipe(chunks, disable=self._disabledPipes))
 
-        # First check for problem entities
-        returnDict = self._ProcessProblemEntities(inText, returnDict)
+        returnDict = self._EntitiesFromDocs(inText, tDocs)
+
+        if cacheKey:
+            self._entityCache.Put(cacheKey, returnDict)
+
+        return returnDict
+
+    # ******************************************************************************************************************
+    def GetEntitiesBatch(self, inTexts: List[str], inProcesses: int = 1,
+                         inBatchSize: int = 50) -> List[DefaultDict[str, list]]:
+        """Retrieve the detected NLP entities for many texts at once.
+
+        Same as _GetEntities, but the texts that aren't in the entity cache go through Spacy's pipe so they can be
+        batched and spread over several processes.  Used for reprocessing stored articles.
+        :param inTexts: list of article texts
+        :param inProcesses: number of processes for Spacy to use
+        :param inBatchSize: number of texts per Spacy batch
+        :return: list of defaultdict(list) of the extracted entities, in the same order as inTexts
+        """
+
+        self._LoadNLP()
+        self._CheckProblemEntities()
+
+        returnList = [defaultdict(list) for _ in inTexts]
+        cacheKeys = [None] * len(inTexts)
+        toProcess = list()
+
+        for index, text in enumerate(inTexts):
+            if not text:
+                continue
+
+            if self._entityCache:
+                cacheKeys[index] = self._EntityCacheKey(text)
+                cachedDict = self._entityCache.Get(cacheKeys[index])
+                if cachedDict is not None:
+                    returnList[index] = cachedDict
+                    continue
+
+            toProcess.append(index)
+
+        # Long texts are split into chunks, and the chunks of each text are put back together as they come out
+        chunks = [(index, chunk) for index in toProcess for chunk in self._SplitText(inTexts[index])]
+
+        with self._NLPLock:
+            tDocs = self._NLP.pipe((chunk for index, chunk in chunks), n_process=inProcesses, batch_size=inBatchSize,
+                                   disable=self._disabledPipes)
+
+            textDocs = list()
+            for chunkNumber, ((index, chunk), tDoc) in enumerate(zip(chunks, tDocs)):
+                textDocs.append(tDoc)
+
+                # Wait for the last chunk of the text
+                if chunkNumber + 1 < len(chunks) and chunks[chunkNumber + 1][0] == index:
+                    continue
+
+                returnList[index] = self._EntitiesFromDocs(inTexts[index], textDocs)
+                textDocs = list()
+
+                if cacheKeys[index]:
+                    self._entityCache.Put(cacheKeys[index], returnList[index])
+
+        return returnList
+
+    # ******************************************************************************************************************
+    def _SplitText(self, inText: str) -> List[str]:
+        """Split a long text into chunks for the NLP.
+
+        Spacy's memory use goes up with the length of the Doc, and texts over its max_length are refused, so texts
+        longer than ChunkCharacters are split into chunks of at most that many characters.  The splits are at line
+        breaks where possible, then at the ends of sentences, so entities aren't cut in half.  A single sentence
+        longer than the limit is split at a space.
+        :param inText: text of the article
+        :return: list of chunks, just the text if it's short enough
+        """
+
+        if self._chunkCharacters <= 0 or len(inText) <= self._chunkCharacters:
+            return [inText]
+
+        # Break the text into pieces no longer than the limit
+        pieces = list()
+        for paragraph in _paragraphBreaks.split(inText):
+            if len(paragraph) <= self._chunkCharacters:
+                pieces.append(paragraph)
+                continue
+
+            for sentence in _sentenceBreaks.split(paragraph):
+                while len(sentence) > self._chunkCharacters:
+                    splitAt = sentence.rfind(" ", 0, self._chunkCharacters) + 1 or self._chunkCharacters
+                    pieces.append(sentence[:splitAt])
+                    sentence = sentence[splitAt:]
+
+                pieces.append(sentence)
+
+        # Then put as many pieces as fit back together
+        chunks = list()
+        chunk = str()
+        for piece in pieces:
+            if chunk and len(chunk) + len(piece) > self._chunkCharacters:
+                chunks.append(chunk)
+                chunk = str()
+
+            chunk += piece
+
+        if chunk:
+            chunks.append(chunk)
+
+        return chunks
+
+    # ******************************************************************************************************************
+    def _EntitiesFromDocs(self, inText: str, inDocs) -> DefaultDict[str, list]:
+        """Build the entity dictionary from the processed Spacy Docs of a text.
+
+        The entities of all of the chunks go into the one dictionary before the duplicates are removed, so a name found
+        in two chunks is only kept once, the same as if the text had been processed whole.
+        :param inText: text of the article
+        :param inDocs: Spacy Docs for the chunks of the text, in order
+        :return: defaultdict(list) of the extracted entities.
+        """
+
+        # Define our return dictionary
+        returnDict = defaultdict(list)
+        foundIt = False
+
+        # First check for problem entities, unless the EntityRuler already found them
+        if not self._nlpProfile["entityRuler"]:
+            returnDict = self._ProcessProblemEntities(inText, returnDict)
 
         # First go through and create the return dictionary
-        for tEntity in tEntities.ents:
+        for tEntity in (tEntity for tDoc in inDocs for tEntity in tDoc.ents):
             foundIt = False
             # Only process if the label is one we are using
             if tEntity.label_ not in self._goodLabels:
@@ -357,6 +1097,89 @@ class WebsiteBase(object):
 
         return returnDict
 
+    # ******************************************************************************************************************
+    def UseNLPProfile(self, inProfileName: str):
+        """Switch to the model and pipeline of an NLP profile.
+
+        The model is loaded by _LoadNLP the first time it's needed, so a website object that only discovers articles
+        never loads Spacy.
+        :param inProfileName: name of the profile, empty for the global settings
+        :return: None
+        """
+
+        self._nlpProfile = ReadNLPProfile(self._configObject, inProfileName)
+        self._modelName = self._nlpProfile["model"]
+        self._NLP = None
+        self._NLPLock = None
+        self._disabledPipes = list()
+
+    # ******************************************************************************************************************
+    def _LoadNLP(self):
+        """Load the model and pipeline of the NLP profile, if they aren't already.
+
+        The models are loaded once per process, so switching between profiles is cheap after the first time.
+        :return: None
+        """
+
+        if self._NLP is not None:
+            return
+
+        self._NLP = LoadModel(self._modelName, self._sharedVectorsPath)
+        self._NLPLock = _modelLocks[id(self._NLP)]
+
+        if self._nlpProfile["entityRuler"]:
+            UpdateEntityRuler(self._NLP, self._problemEntities)
+
+        self._disabledPipes = DisabledPipes(self._NLP, self._nlpProfile)
+
+        if self._entityCache:
+            self._entityCacheSalt = self._EntityCacheSalt()
+
+    # ******************************************************************************************************************
+    def _GetSubscriptionNLPProfile(self) -> str:
+        """Retrieve the name of the NLP profile for this subscription.
+
+        :return: the nlp_profile column of the subscription, empty if it isn't set (or migration 007 isn't applied)
+        """
+
+        try:
+            self._DBCursor.execute("SELECT nlp_profile FROM subscriptions WHERE url = %s;", (self._url,))
+            self._DBConnection.commit()
+
+            result = self._DBCursor.fetchone()
+
+            return result[0] or str() if result else str()
+
+        except Exception as e:
+            print("WebsiteBase::_GetSubscriptionNLPProfile: Exception {}".format(e))
+            self._ResetSQLConnection()
+            return str()
+
+    # ******************************************************************************************************************
+    def _EntityCacheSalt(self) -> str:
+        """Hash everything besides the text that changes what _GetEntities returns.
+
+        That's the model and its version, the pipeline, the chunk size, the labels we keep, the fuzzy ratio and the
+        problem entities.  If any of them change, the old cache entries just stop matching.
+        :return: hex digest
+        """
+
+        settings = [self._modelName, self._NLP.meta.get("version", str()), sorted(self._disabledPipes),
+                    self._nlpProfile["entityRuler"], self._chunkCharacters, sorted(self._goodLabels), self._fuzzy_ratio,
+                    sorted(self._problemEntities)]
+
+        return hashlib.sha256(json.dumps(settings).encode("utf-8")).hexdigest()
+
+    # ******************************************************************************************************************
+    def _EntityCacheKey(self, inText: str) -> str:
+        """Build the entity cache key for the text.
+
+        :param inText: text of the article
+        :return: hex digest
+        """
+
+        return hashlib.sha256((self._entityCacheSalt + inText).encode("utf-8")).hexdigest()
+
     # ******************************************************************************************************************
     def ProcessFeed(self):
         """Process the RSS feed.
@@ -368,33 +1191,303 @@ class WebsiteBase(object):
         try:
             extractedArticles = self._GetFeedItems()
 
-            # Don't do anything if we have no feeds to process
-            if not extractedArticles:
+            failedURLs = set()
+            for article in extractedArticles:
+                if not self.ParserFor(article.articleURL).ProcessArticle(article) and not article.duplicate:
+                    failedURLs.add(article.articleURL)
+
+            # Everything up to the newest entry has been handled now, apart from the failures
+            self._CapHighWaterMark(failedURLs)
+            self._SaveHighWaterMark()
+
+        except Exception as e:
+            print("Got exception: {}".format(e))
+
+    # ******************************************************************************************************************
+    def DiscoverFeed(self) -> int:
+        """Add the new articles in the RSS feed to pending_articles.
+
+        The discovery half of ProcessFeed, for the discover mode.  The articles are processed later by the extract mode.
+        :return: number of articles added
+        """
+
+        try:
+            extractedArticles = self._GetFeedItems()
+
+            added = 0
+            if extractedArticles:
+                self._DBCursor.execute("""
+                                        INSERT INTO pending_articles (article_url, article_title, website, classname,
+                                                                      subscription_url)
+                                        SELECT *, %s FROM UNNEST(%s::text[], %s::text[], %s::text[], %s::text[])
+                                        ON CONFLICT (article_url) DO NOTHING;
+                                        """,
+                                       (self._url,
+                                        [article.articleURL for article in extractedArticles],
+                                        [article.articleTitle for article in extractedArticles],
+                                        [article.website for article in extractedArticles],
+                                        [self._ParserClassname(article.articleURL) for article in extractedArticles]))
+                added = self._DBCursor.rowcount
+                self._DBConnection.commit()
+
+            # The articles are safely in pending_articles, so the high-water mark can move on
+            self._SaveHighWaterMark()
+
+            print("Added {} of {} new articles from {}".format(added, len(extractedArticles), self._url))
+
+            return added
+
+        except Exception as e:
+            print("WebsiteBase::DiscoverFeed: Exception {}".format(e))
+            self._ResetSQLConnection()
+            return 0
+
+    # ******************************************************************************************************************
+    def ParserFor(self, inURL: str):
+        """Get the website object that should parse an article.
+
+        With RouteByHost on, an article whose host is registered to another website class is handed to an object of
+        that class (created the first time and kept).  Otherwise it's us.
+        :param inURL: URL of the article
+        :return: website object
+        """
+
+        classname = self._ParserClassname(inURL)
+        if classname == type(self).__name__:
+            return self
+
+        parser = self._routedParsers.get(classname)
+        if parser is None:
+            parser = GetWebsiteClass(classname)(self._queue, self._configObject, self._url)
+            self._routedParsers[classname] = parser
+
+        return parser
+
+    # ******************************************************************************************************************
+    def _ParserClassname(self, inURL: str) -> str:
+        """Get the name of the website class that should parse an article, without creating an object of it.
+
+        :param inURL: URL of the article
+        :return: class name
+        """
+
+        if not self._routeByHost:
+            return type(self).__name__
+
+        return RouteURL(inURL, type(self).__name__)
+
+    # ******************************************************************************************************************
+    def _NewestEntry(self, inEntries: list) -> Tuple:
+        """Find the newest entry in the feed.
+
+        :param inEntries: feedparser entries
+        :return: (published time, guid) of the newest entry, both None if the feed is empty
+        """
+
+        if not inEntries:
+            return None, None
+
+        # Feeds without dates are assumed to be newest first
+        if self.lastEntryTimes:
+            newestEntry = max(inEntries, key=lambda entry: self.EntryTime(entry) or 0.0)
+        else:
+            newestEntry = inEntries[0]
+
+        return self.EntryTime(newestEntry), newestEntry.get("id", newestEntry.link)
+
+    # ******************************************************************************************************************
+    def _CapHighWaterMark(self, inFailedURLs: set):
+        """Hold the high-water mark back behind the articles that failed.
+
+        The mark becomes the newest entry that is both after and older than every failed entry, so the next read of the
+        feed gets back to them.  If there isn't one the mark stays where it was.
+        :param inFailedURLs: URLs of the articles that weren't pushed onto the queue
+        :return: None
+        """
+
+        if not self._pendingHighWaterMark or not inFailedURLs:
+            return
+
+        failedIndexes = [index for index, entry in enumerate(self._lastEntries) if entry.link in inFailedURLs]
+        if not failedIndexes:
+            return
+
+        failedTimes = [self.EntryTime(self._lastEntries[index]) for index in failedIndexes]
+        oldestFailure = None if None in failedTimes else min(failedTimes)
+
+        olderEntries = [entry for entry in self._lastEntries[max(failedIndexes) + 1:]
+                        if oldestFailure is None or (self.EntryTime(entry) or 0.0) < oldestFailure]
+
+        if olderEntries:
+            self._pendingHighWaterMark = self._NewestEntry(olderEntries) + (self._pendingHighWaterMark[2],)
+        else:
+            self._pendingHighWaterMark = None
+
+    # ******************************************************************************************************************
+    def _GetHighWaterMark(self) -> Tuple:
+        """Retrieve the high-water mark for this subscription.
+
+        :return: (published time, guid, full sweep due).  Times are seconds since the epoch.
+        """
+
+        try:
+            self._DBCursor.execute("""
+                                    SELECT EXTRACT(EPOCH FROM last_seen_published), last_seen_guid,
+                                    last_full_sweep IS NULL OR last_full_sweep < NOW() - make_interval(secs => %s)
+                                    FROM subscriptions WHERE url = %s;
+                                    """, (self._fullSweepInterval, self._url))
+            self._DBConnection.commit()
+
+            result = self._DBCursor.fetchone()
+            if not result:
+                return None, None, True
+
+            markTime, markGUID, fullSweep = result
+
+            if markTime is not None:
+                markTime = float(markTime)
+
+            return markTime, markGUID, fullSweep
+
+        except Exception as e:
+            print("WebsiteBase::_GetHighWaterMark: Exception {}".format(e))
+            self._ResetSQLConnection()
+            return None, None, True
+
+    # ******************************************************************************************************************
+    def _SaveHighWaterMark(self):
+        """Store the newest entry we processed as the high-water mark for this subscription.
+
+        :return: None
+        """
+
+        if not self._pendingHighWaterMark:
+            return
+
+        try:
+            markTime, markGUID, fullSweep = self._pendingHighWaterMark
+
+            # Don't move the mark for an empty feed
+            if markGUID is None:
                 return
 
-            for article in extractedArticles:
-                article.articleText = self._ParseArticle(article.articleURL)
+            # If this was a full sweep, reset the clock for the next one
+            self._DBCursor.execute("""
+                                    UPDATE subscriptions SET last_seen_published = to_timestamp(%s),
+                                    last_seen_guid = %s,
+                                    last_full_sweep = CASE WHEN %s THEN NOW() ELSE last_full_sweep END
+                                    WHERE url = %s;
+                                    """, (markTime, markGUID, fullSweep, self._url))
+            self._DBConnection.commit()
 
-                # If for whatever reason we got no text, continue on
-                if not article.articleText:
-                    continue
+            self._pendingHighWaterMark = None
+
+        except Exception as e:
+            print("WebsiteBase::_SaveHighWaterMark: Exception {}".format(e))
+            self._ResetSQLConnection()
+
+    # ******************************************************************************************************************
+    def ProcessArticle(self, inArticle: ExtractedArticle, inContent: bytes = None) -> bool:
+        """Process a single article.
+
+        Scrape the article text, run the NLP and push the result onto the queue.  If the page content has already been
+        downloaded (ie, by the async engine) it can be passed in and we skip the download.
+        :param inArticle: article wrapper from the feed
+        :param inContent: optional raw page content
+        :return: True if the article was pushed onto the queue.  If it wasn't because the queue stayed full, the
+        article's skipped flag is set.
+        """
+
+        try:
+            if inContent is None:
+                inArticle.articleText = self._ParseArticle(inArticle.articleURL)
+            else:
+                self._ArchivePage(inArticle.articleURL, inContent)
+                inArticle.articleText = self._ExtractText(inContent)
+
+            # If for whatever reason we got no text, continue on
+            if not inArticle.articleText:
+                return False
+
+            # Don't bother with the NLP for a republished copy of an article we already have
+            if self._dedupEnabled and self._IsNearDuplicate(inArticle):
+                inArticle.duplicate = True
+                return False
 
-                # Have spacy do the NLP
-                nlpEntities = self._GetEntities(article.articleText)
+            # Have spacy do the NLP and populate the article
+            inArticle.AddEntities(self._GetEntities(inArticle.articleText))
 
-                # Now populate the article
-                article.locations.extend(nlpEntities["GPE"])
-                article.facilities.extend(nlpEntities["FACILITY"])
-                article.facilities.extend(nlpEntities["FAC"])
-                article.people.extend(nlpEntities["PERSON"])
-                article.organizations.extend(nlpEntities["ORG"])
-                article.events.extend(nlpEntities["EVENT"])
+            # Now push into the queue.  If the DB writer is too far behind this waits, and gives up after the queue's
+            # PutTimeout.
+            self._queue.put(inArticle)
 
-                # Now push into the queue
-                self._queue.put(article)
+            # Only now is it on its way to the database.  Recorded any earlier, an article that gets skipped and tried
+            # again would match its own fingerprint.
+            if inArticle.fingerprint is not None:
+                with self._recentFingerprintsLock:
+                    self._recentFingerprints.append((inArticle.canonicalURL, inArticle.fingerprint))
+
+            return True
+
+        except queue.Full:
+            print("WebsiteBase::ProcessArticle: Queue is full, skipping {}".format(inArticle.articleURL))
+            inArticle.skipped = True
+            return False
 
         except Exception as e:
-            print("Got exception: {}".format(e))
+            print("WebsiteBase::ProcessArticle: Exception {}".format(e))
+            return False
+
+    # ******************************************************************************************************************
+    def _IsNearDuplicate(self, inArticle: ExtractedArticle) -> bool:
+        """Check if the article text is (nearly) the same as an article we already have.
+
+        Fingerprints the text and looks up the articles that share a band with it in the near-duplicate index.  Any
+        fingerprint within NearDuplicateDistance bits shares at least one band, so we only compare against those.
+        :param inArticle: article with the text filled in.  The fingerprint gets set on it, and ProcessArticle adds it
+            to the recent fingerprints once the article is queued.
+        :return: True if it's a duplicate
+        """
+
+        try:
+            inArticle.fingerprint = SimHash(inArticle.articleText)
+            if inArticle.fingerprint is None:
+                return False
+
+            # Other threads add to it while we look
+            with self._recentFingerprintsLock:
+                recentFingerprints = list(self._recentFingerprints)
+
+            for canonicalURL, fingerprint in recentFingerprints:
+                if canonicalURL != inArticle.canonicalURL and \
+                        HammingDistance(inArticle.fingerprint, fingerprint) <= self._nearDuplicateDistance:
+                    print("Skipping {}, it is a duplicate of an article processed this run".format(
+                        inArticle.articleURL))
+                    return True
+
+            bands = FingerprintBands(inArticle.fingerprint)
+
+            self._DBCursor.execute("""
+                                    SELECT DISTINCT news_articles.id, news_articles.simhash
+                                    FROM article_simhash_bands
+                                    JOIN news_articles ON news_articles.id = article_simhash_bands.article_id
+                                    WHERE (article_simhash_bands.band, article_simhash_bands.band_value) IN
+                                    (SELECT * FROM UNNEST(%s::smallint[], %s::integer[]));
+                                    """, (list(range(len(bands))), bands))
+            self._DBConnection.commit()
+
+            for articleID, fingerprint in self._DBCursor.fetchall():
+                if fingerprint is not None and \
+                        HammingDistance(inArticle.fingerprint, fingerprint) <= self._nearDuplicateDistance:
+                    print("Skipping {}, it is a duplicate of article {}".format(inArticle.articleURL, articleID))
+                    return True
+
+            return False
+
+        except Exception as e:
+            print("WebsiteBase::_IsNearDuplicate: Exception {}".format(e))
+            self._ResetSQLConnection()
+            return False
 
     # ******************************************************************************************************************
     def _RemoveStopWords(self, inText: str) -> str:
@@ -459,7 +1552,7 @@ class WebsiteBase(object):
         """Retrieve known problem entities from the DB.
 
         Queries the problem_entities table in the database to get the list of words we need to manually look for
-        :return: list(tuple) of values
+        :return: list(tuple) of values, None if the query failed
         """
 
         try:
@@ -479,7 +1572,35 @@ class WebsiteBase(object):
 
         except Exception as e:
             print("WebsiteBase::_GetProblemEntities: Exception {}".format(e))
-            return list()
+            self._ResetSQLConnection()
+            return None
+
+    # ******************************************************************************************************************
+    def _CheckProblemEntities(self):
+        """Re-read the problem entities if it's time to, and rebuild the EntityRuler if they changed.
+
+        :return: None
+        """
+
+        if self._problemEntitiesRefresh <= 0 or time.time() - self._problemEntitiesChecked < self._problemEntitiesRefresh:
+            return
+
+        self._problemEntitiesChecked = time.time()
+
+        # Keep what we have if the table couldn't be read
+        problemEntities = self._GetProblemEntities()
+        if problemEntities is None or sorted(problemEntities) == sorted(self._problemEntities):
+            return
+
+        print("WebsiteBase::_CheckProblemEntities: problem_entities changed, now {} entries".format(len(problemEntities)))
+
+        self._problemEntities = problemEntities
+
+        if self._nlpProfile["entityRuler"]:
+            UpdateEntityRuler(self._NLP, self._problemEntities)
+
+        if self._entityCache:
+            self._entityCacheSalt = self._EntityCacheSalt()
 
     # ******************************************************************************************************************
     def _ProcessProblemEntities(self, inText: str, inDict: DefaultDict[str, List]) -> DefaultDict[str, List]:
@@ -1,6 +1,6 @@
-from importlib import import_module
 from .ExtractedArticle import ExtractedArticle
 from .WebsiteBase import WebsiteBase
+from .Registry import GetWebsiteClass, ListWebsiteClasses, RegisterWebsite, RouteURL, ValidateWebsiteClasses
 import multiprocessing
 import configparser
 
@@ -21,13 +21,10 @@ def WebsiteFactory(inURL: tuple, inQueue: multiprocessing.Queue, inConfigObject:
         # Pull the URL and class name from the tuple
         url, classname = inURL
 
-        # Load the module
-        classmodule = import_module("." + classname, package="websites")
-
-        tempclass = getattr(classmodule, classname)
+        tempclass = GetWebsiteClass(classname)
 
         instance = tempclass(inQueue, inConfigObject, url)
 
         return instance
     except Exception as e:
-        raise ImportError("The URL {} cannot be handled at this time.".format(inURL))
+        raise ImportError("The URL {} cannot be handled at this time: {}".format(inURL, e)) from e